@@ -1,4 +1,9 @@
-tracker_list=$(curl -Ns https://ngosang.github.io/trackerslist/trackers_all_http.txt | awk '$0' | tr '\n\n' ',')
+TRACKERS_FILE=trackers.txt
+if [ -z "$(find "$TRACKERS_FILE" -mmin -1440 2>/dev/null)" ]; then
+    curl -Nsf --max-time 10 https://ngosang.github.io/trackerslist/trackers_all_http.txt -o "$TRACKERS_FILE.tmp" \
+        && mv "$TRACKERS_FILE.tmp" "$TRACKERS_FILE"
+fi
+tracker_list=$(awk '$0' "$TRACKERS_FILE" 2>/dev/null | tr '\n\n' ',')
 aria2c --allow-overwrite=true --auto-file-renaming=true --bt-enable-lpd=true --bt-detach-seed-only=true \
        --bt-remove-unselected-file=true --bt-tracker="[$tracker_list]" --bt-max-peers=0 --enable-rpc=true \
        --rpc-max-request-size=1024M --max-connection-per-server=10 --max-concurrent-downloads=10 --split=10 \
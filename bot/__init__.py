@@ -8,7 +8,8 @@ from dotenv import load_dotenv, dotenv_values
 from threading import Thread
 from time import sleep, time
 from subprocess import Popen, run as srun
-from os import remove as osremove, path as ospath, environ, getcwd
+from os import remove as osremove, path as ospath, environ, getcwd, chmod
+from shutil import copy, rmtree
 from aria2p import API as ariaAPI, Client as ariaClient
 from qbittorrentapi import Client as qbClient
 from faulthandler import enable as faulthandler_enable
@@ -43,11 +44,12 @@ extra_buttons = {}
 shorteneres_list = []
 aria2_options = {}
 qbit_options = {}
-queued_dl = {}
-queued_up = {}
 non_queued_dl = set()
 non_queued_up = set()
 
+BOOTSTRAP_TIMEOUT = 30
+DHT_FILES = [ospath.expanduser('~/.cache/aria2/dht.dat'), ospath.expanduser('~/.aria2/dht.dat')]
+
 
 def get_version():
     MAJOR = '1'
@@ -63,12 +65,70 @@ try:
 except:
     pass
 
+
+class TaskDict(dict):
+
+    def __init__(self):
+        super().__init__()
+        self.user_tasks = {}
+        self.status_tasks = {}
+        self.unindexed = {}
+        self.__statuses = {}
+
+    def __unindex(self, key):
+        if (task := self.get(key)) is None:
+            return
+        user_id = task.message.from_user.id
+        if (tasks := self.user_tasks.get(user_id)) is not None:
+            tasks.pop(key, None)
+            if not tasks:
+                del self.user_tasks[user_id]
+        self.__unset_status(key)
+
+    def __unset_status(self, key):
+        self.unindexed.pop(key, None)
+        if (status := self.__statuses.pop(key, None)) is not None:
+            tasks = self.status_tasks[status]
+            del tasks[key]
+            if not tasks:
+                del self.status_tasks[status]
+
+    def set_status(self, key, status):
+        # the status of a new status object is unknown until someone reads it, see unindexed
+        if key not in self or self.__statuses.get(key) == status:
+            return
+        self.__unset_status(key)
+        self.__statuses[key] = status
+        self.status_tasks.setdefault(status, {})[key] = None
+
+    def __setitem__(self, key, value):
+        self.__unindex(key)
+        super().__setitem__(key, value)
+        self.user_tasks.setdefault(value.message.from_user.id, {})[key] = None
+        self.unindexed[key] = None
+
+    def __delitem__(self, key):
+        self.__unindex(key)
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        self.__unindex(key)
+        return super().pop(key, *default)
+
+    def clear(self):
+        self.user_tasks.clear()
+        self.status_tasks.clear()
+        self.unindexed.clear()
+        self.__statuses.clear()
+        super().clear()
+
+
 download_dict_lock = Lock()
 status_reply_dict_lock = Lock()
 queue_dict_lock = Lock()
 qb_listener_lock = Lock()
 status_reply_dict = {}
-download_dict = {}
+download_dict = TaskDict()
 rss_dict = {}
 
 BOT_TOKEN = environ.get('BOT_TOKEN', '')
@@ -119,6 +179,19 @@ if DATABASE_URL:
 else:
     config_dict = {}
 
+# daemons and archive extraction run while the rest of the config is parsed
+if not ospath.exists('.netrc'):
+    with open('.netrc', 'w'):
+        pass
+chmod('.netrc', 0o600)
+copy('.netrc', '/root/.netrc')
+chmod('aria.sh', 0o755)
+bootstrap_procs = [Popen(["qbittorrent-nox", "-d", f"--profile={getcwd()}"]), Popen("./aria.sh", shell=True)]
+if ospath.exists('accounts.zip'):
+    if ospath.exists('accounts'):
+        rmtree('accounts')
+    bootstrap_procs.append(Popen(["7z", "x", "-o.", "-aoa", "accounts.zip", "accounts/*.json"]))
+
 OWNER_ID = environ.get('OWNER_ID', '')
 if len(OWNER_ID) == 0:
     log_error("OWNER_ID variable is missing! Exiting now")
@@ -200,6 +273,18 @@ if len(MEGA_EMAIL) == 0 or len(MEGA_PASSWORD) == 0:
     MEGA_EMAIL = ''
     MEGA_PASSWORD = ''
 
+MEGA_TRANSFER_SLOTS = environ.get('MEGA_TRANSFER_SLOTS', '')
+MEGA_TRANSFER_SLOTS = '' if len(MEGA_TRANSFER_SLOTS) == 0 else int(MEGA_TRANSFER_SLOTS)
+
+DOWNLOAD_BANDWIDTH_LIMIT = environ.get('DOWNLOAD_BANDWIDTH_LIMIT', '')
+DOWNLOAD_BANDWIDTH_LIMIT = '' if len(DOWNLOAD_BANDWIDTH_LIMIT) == 0 else float(DOWNLOAD_BANDWIDTH_LIMIT)
+
+UPLOAD_BANDWIDTH_LIMIT = environ.get('UPLOAD_BANDWIDTH_LIMIT', '')
+UPLOAD_BANDWIDTH_LIMIT = '' if len(UPLOAD_BANDWIDTH_LIMIT) == 0 else float(UPLOAD_BANDWIDTH_LIMIT)
+
+USER_BANDWIDTH_SHARE = environ.get('USER_BANDWIDTH_SHARE', '')
+USER_BANDWIDTH_SHARE = '' if len(USER_BANDWIDTH_SHARE) == 0 else int(USER_BANDWIDTH_SHARE)
+
 UPTOBOX_TOKEN = environ.get('UPTOBOX_TOKEN', '')
 if len(UPTOBOX_TOKEN) == 0:
     UPTOBOX_TOKEN = ''
@@ -310,6 +395,9 @@ INCOMPLETE_TASK_NOTIFIER = INCOMPLETE_TASK_NOTIFIER.lower() == 'true'
 STOP_DUPLICATE = environ.get('STOP_DUPLICATE', '')
 STOP_DUPLICATE = STOP_DUPLICATE.lower() == 'true'
 
+CONTENT_DEDUP = environ.get('CONTENT_DEDUP', '')
+CONTENT_DEDUP = CONTENT_DEDUP.lower() == 'true'
+
 IS_TEAM_DRIVE = environ.get('IS_TEAM_DRIVE', '')
 IS_TEAM_DRIVE = IS_TEAM_DRIVE.lower() == 'true'
 
@@ -584,6 +672,10 @@ config_dict = {'ANIME_TEMPLATE': ANIME_TEMPLATE,
                'MEDIA_GROUP': MEDIA_GROUP,
                'MEGA_EMAIL': MEGA_EMAIL,
                'MEGA_PASSWORD': MEGA_PASSWORD,
+               'MEGA_TRANSFER_SLOTS': MEGA_TRANSFER_SLOTS,
+               'DOWNLOAD_BANDWIDTH_LIMIT': DOWNLOAD_BANDWIDTH_LIMIT,
+               'UPLOAD_BANDWIDTH_LIMIT': UPLOAD_BANDWIDTH_LIMIT,
+               'USER_BANDWIDTH_SHARE': USER_BANDWIDTH_SHARE,
                'OWNER_ID': OWNER_ID,
                'QUEUE_ALL': QUEUE_ALL,
                'QUEUE_DOWNLOAD': QUEUE_DOWNLOAD,
@@ -606,6 +698,7 @@ config_dict = {'ANIME_TEMPLATE': ANIME_TEMPLATE,
                'STATUS_LIMIT': STATUS_LIMIT,
                'STATUS_UPDATE_INTERVAL': STATUS_UPDATE_INTERVAL,
                'STOP_DUPLICATE': STOP_DUPLICATE,
+               'CONTENT_DEDUP': CONTENT_DEDUP,
                'SUDO_USERS': SUDO_USERS,
                'TELEGRAM_API': TELEGRAM_API,
                'TELEGRAM_HASH': TELEGRAM_HASH,
@@ -657,23 +750,13 @@ if BASE_URL:
     Popen(
         f"gunicorn web.wserver:app --bind 0.0.0.0:{BASE_URL_PORT} --worker-class gevent", shell=True)
 
-srun(["qbittorrent-nox", "-d", f"--profile={getcwd()}"])
-if not ospath.exists('.netrc'):
-    with open('.netrc', 'w'):
-        pass
-srun(["chmod", "600", ".netrc"])
-srun(["cp", ".netrc", "/root/.netrc"])
-srun(["chmod", "+x", "aria.sh"])
-srun("./aria.sh", shell=True)
+for proc in bootstrap_procs:
+    proc.wait()
 if ospath.exists('accounts.zip'):
-    if ospath.exists('accounts'):
-        srun(["rm", "-rf", "accounts"])
-    srun(["7z", "x", "-o.", "-aoa", "accounts.zip", "accounts/*.json"])
     srun(["chmod", "-R", "777", "accounts"])
     osremove('accounts.zip')
 if not ospath.exists('accounts'):
     config_dict['USE_SERVICE_ACCOUNTS'] = False
-sleep(0.5)
 
 aria2 = ariaAPI(ariaClient(host="http://localhost", port=6800, secret=""))
 
@@ -682,7 +765,21 @@ def get_client():
     return qbClient(host="localhost", port=8090, VERIFY_WEBUI_CERTIFICATE=False, REQUESTS_ARGS={'timeout': (30, 60)})
 
 
+def wait_for_rpc(name, probe):
+    start = time()
+    while True:
+        try:
+            return probe()
+        except Exception as e:
+            if time() - start > BOOTSTRAP_TIMEOUT:
+                log_error(f"{name} is not ready after {BOOTSTRAP_TIMEOUT}s: {e}")
+                return
+            sleep(0.1)
+
+
 def aria2c_init():
+    if any(ospath.exists(dht) for dht in DHT_FILES):
+        return
     try:
         log_info("Initializing Aria2c")
         link = "https://linuxmint.com/torrents/lmde-5-cinnamon-64bit.iso.torrent"
@@ -696,8 +793,10 @@ def aria2c_init():
         log_error(f"Aria2c initializing error: {e}")
 
 
+qb_client = get_client()
+wait_for_rpc('Aria2c', aria2.client.get_version)
+wait_for_rpc('qBittorrent', qb_client.app_version)
 Thread(target=aria2c_init).start()
-sleep(1.5)
 
 aria2c_global = ['bt-max-open-files', 'download-result', 'keep-unfinished-download-result', 'log', 'log-level',
                  'max-concurrent-downloads', 'max-download-result', 'max-overall-download-limit', 'save-session',
@@ -710,7 +809,6 @@ else:
                for op in aria2c_global if op in aria2_options}
     aria2.set_global_options(a2c_glo)
 
-qb_client = get_client()
 if not qbit_options:
     qbit_options = dict(qb_client.app_preferences())
     del qbit_options['listen_port']
@@ -15,22 +15,53 @@ from signal import signal, SIGINT
 from aiofiles.os import path as aiopath, remove as aioremove
 from aiofiles import open as aiopen
 from psutil import disk_usage, cpu_percent, swap_memory, cpu_count, cpu_freq, virtual_memory, net_io_counters, boot_time
-from pyrogram.handlers import MessageHandler, CallbackQueryHandler
-from pyrogram.filters import command, private, regex
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler, EditedMessageHandler
+from pyrogram.filters import command, private, regex, create
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot import bot, config_dict, user_data, botStartTime, LOGGER, Interval, DATABASE_URL, QbInterval, INCOMPLETE_TASK_NOTIFIER, scheduler, get_version
-from .helper.ext_utils.fs_utils import start_cleanup, clean_all, exit_clean_up
-from .helper.ext_utils.bot_utils import get_progress_bar_string, get_readable_file_size, get_readable_time, cmd_exec, sync_to_async, set_commands, update_user_ldata
-from .helper.ext_utils.db_handler import DbManger
+from .helper.ext_utils.fs_utils import start_cleanup, clean_all, exit_clean_up, clean_download, start_storage_sampler
+from .helper.ext_utils.bot_utils import get_progress_bar_string, get_readable_file_size, get_readable_time, cmd_exec, sync_to_async, set_commands, update_user_ldata, \
+    arg_parser
+from .helper.ext_utils.db_handler import DbManger, pending_blobs, ensure_user_blobs
+from .helper.ext_utils.bandwidth_manager import bandwidth_governor
+from .helper.ext_utils.sa_ledger import sa_ledger
 from .helper.telegram_helper.bot_commands import BotCommands
 from .helper.telegram_helper.message_utils import sendMessage, editMessage, sendFile
 from .helper.telegram_helper.filters import CustomFilters
 from .helper.telegram_helper.button_build import ButtonMaker
 from .helper.listeners.aria2_listener import start_aria2_listener
 from .helper.themes import BotTheme
-from .modules import authorize, clone, gd_count, gd_delete, gd_list, cancel_mirror, mirror_leech, status, torrent_search, torrent_select, ytdlp, \
-                     rss, shell, eval, users_settings, bot_settings, speedtest, save_msg, images, imdb, anilist, mediainfo, mydramalist
+from .helper.ext_utils.module_loader import load_module, lazy_handler, log_import_report
+
+for module in ['authorize', 'clone', 'gd_count', 'gd_delete', 'gd_list', 'cancel_mirror', 'mirror_leech', 'status',
+               'torrent_search', 'torrent_select', 'ytdlp', 'rss', 'users_settings', 'bot_settings', 'save_msg']:
+    load_module(module)
+torrent_search = load_module('torrent_search')
+
+# handlers of rarely used modules, the module is imported on first matching update
+LAZY_HANDLERS = [
+    (MessageHandler, 'shell', 'shell', command(BotCommands.ShellCommand) & CustomFilters.sudo),
+    (EditedMessageHandler, 'shell', 'shell', command(BotCommands.ShellCommand) & CustomFilters.sudo),
+    (MessageHandler, 'eval', 'evaluate', command(BotCommands.EvalCommand) & CustomFilters.sudo),
+    (MessageHandler, 'eval', 'execute', command(BotCommands.ExecCommand) & CustomFilters.sudo),
+    (MessageHandler, 'eval', 'clear', command(BotCommands.ClearLocalsCommand) & CustomFilters.sudo),
+    (MessageHandler, 'speedtest', 'speedtest', command(BotCommands.SpeedCommand) & CustomFilters.authorized),
+    (MessageHandler, 'images', 'picture_add', command(BotCommands.AddImageCommand) & CustomFilters.authorized),
+    (MessageHandler, 'images', 'pictures', command(BotCommands.ImagesCommand) & CustomFilters.authorized),
+    (CallbackQueryHandler, 'images', 'pics_callback', regex(r'^images')),
+    (MessageHandler, 'imdb', 'imdb_search', command(BotCommands.IMDBCommand) & CustomFilters.authorized),
+    (CallbackQueryHandler, 'imdb', 'imdb_callback', regex(r'^imdb')),
+    (MessageHandler, 'anilist', 'anilist', command(BotCommands.AniListCommand) & CustomFilters.authorized),
+    (MessageHandler, 'anilist', 'character', command("character") & CustomFilters.authorized),
+    (MessageHandler, 'anilist', 'manga', command("manga") & CustomFilters.authorized),
+    (MessageHandler, 'anilist', 'anime_help', command(BotCommands.AnimeHelpCommand) & CustomFilters.authorized),
+    (CallbackQueryHandler, 'anilist', 'setAnimeButtons', regex(r'^anime')),
+    (CallbackQueryHandler, 'anilist', 'setCharacButtons', regex(r'^cha')),
+    (MessageHandler, 'mediainfo', 'mediainfo', command(BotCommands.MediaInfoCommand) & CustomFilters.authorized),
+    (MessageHandler, 'mydramalist', 'mydramalist_search', command(BotCommands.MyDramaListCommand) & CustomFilters.authorized),
+    (CallbackQueryHandler, 'mydramalist', 'mdl_callback', regex(r'^mdl')),
+]
 
 
 async def stats(client, message):
@@ -146,7 +177,9 @@ async def restart(client, message):
     for interval in [QbInterval, Interval]:
         if interval:
             interval[0].cancel()
-    await sync_to_async(clean_all)
+    journal = await DbManger().get_task_journal() if INCOMPLETE_TASK_NOTIFIER and DATABASE_URL else []
+    await sync_to_async(sa_ledger.flush)
+    await sync_to_async(clean_all, {str(row['mid']) for row in journal if row.get('resumable')})
     proc1 = await create_subprocess_exec('pkill', '-9', '-f', 'gunicorn|aria2c|qbittorrent-nox|ffmpeg|rclone')
     proc2 = await create_subprocess_exec('python3', 'update.py')
     await gather(proc1.wait(), proc2.wait())
@@ -208,7 +241,7 @@ NOTE: Try each command without any argument to see more detalis.
 /{BotCommands.CancelAllCommand} [query]: Cancel all [status] tasks.
 /{BotCommands.ListCommand} [query]: Search in Google Drive(s).
 /{BotCommands.SearchCommand} [query]: Search for torrents with API.
-/{BotCommands.StatusCommand}: Shows a status of all the downloads.
+/{BotCommands.StatusCommand} [me|user_id] [dl|up|clone|seed|queue|pause|arch]: Shows a status of all the downloads, optionally filtered.
 /{BotCommands.StatsCommand}: Show stats of the machine where the bot is hosted in.
 /{BotCommands.PingCommand}: Check how long it takes to Ping the Bot (Only Owner & Sudo).
 /{BotCommands.AuthorizeCommand}: Authorize a chat or a user to use the bot (Only Owner & Sudo).
@@ -230,6 +263,49 @@ async def bot_help(client, message):
     await sendMessage(message, help_string)
 
 
+async def load_user_blobs(_, update):
+    await ensure_user_blobs(update.from_user.id)
+
+
+async def get_resumable_message(row):
+    if row['isYtdlp'] and not row.get('qual') or not row.get('uid'):
+        return None
+    try:
+        message = await bot.get_messages(row['cid'], row['mid'])
+        if message.empty or not message.text:
+            return None
+        # batch children are sent by the bot, the task belongs to whoever started the batch
+        if not message.from_user or message.from_user.id != row['uid']:
+            message.from_user = await bot.get_users(row['uid'])
+    except Exception as e:
+        LOGGER.error(f"Unable to resume task {row['_id']}: {e}")
+        return None
+    args = arg_parser(message.text.split('\n')[0].split(' ')[1:], {'link': '', '-i': '', '-b': False, '-m': ''})
+    if args['-i'] not in ['', '0', '1'] or args['-b'] or args['-m']:
+        return None
+    return message
+
+
+async def resume_tasks(journal):
+    mirror_leech, ytdlp = load_module('mirror_leech'), load_module('ytdlp')
+    for row in journal:
+        if not row.get('resumable'):
+            continue
+        if (message := await get_resumable_message(row)) is None:
+            # start_cleanup kept the dir for this task, nothing will pick it up now
+            await clean_download(row['dir'])
+            continue
+        # replayed commands skip the update handlers, so the user's thumbnail and rclone config are not on disk yet
+        await ensure_user_blobs(message.from_user.id)
+        LOGGER.info(f"Resuming task: {row['_id']}")
+        if row['isYtdlp']:
+            await (ytdlp.ytdlleech if row['isLeech'] else ytdlp.ytdl)(bot, message, qual=row['qual'])
+        elif row['isQbit']:
+            await (mirror_leech.qb_leech if row['isLeech'] else mirror_leech.qb_mirror)(bot, message)
+        else:
+            await (mirror_leech.leech if row['isLeech'] else mirror_leech.mirror)(bot, message)
+
+
 async def restart_notification():
     now=datetime.now(timezone(config_dict['TIMEZONE']))
     if await aiopath.isfile(".restartmsg"):
@@ -272,9 +348,19 @@ async def restart_notification():
 
 
 async def main():
-    await gather(start_cleanup(), torrent_search.initiate_search_tools(), restart_notification(), search_images(), set_commands(bot))
+    journal = await DbManger().get_task_journal() if INCOMPLETE_TASK_NOTIFIER and DATABASE_URL else []
+    await gather(start_cleanup({str(row['mid']) for row in journal if row.get('resumable')}),
+                 torrent_search.initiate_search_tools(), restart_notification(), search_images(), set_commands(bot))
     await sync_to_async(start_aria2_listener, wait=False)
-    
+    await resume_tasks(journal)
+    bandwidth_governor.start()
+    start_storage_sampler()
+
+    blobs_filter = create(lambda _, __, update: bool(update.from_user) and update.from_user.id in pending_blobs)
+    bot.add_handler(MessageHandler(load_user_blobs, filters=blobs_filter), group=-2)
+    bot.add_handler(CallbackQueryHandler(load_user_blobs, filters=blobs_filter), group=-2)
+    for handler_class, module, func, filters in LAZY_HANDLERS:
+        bot.add_handler(lazy_handler(handler_class, module, func, filters))
     bot.add_handler(MessageHandler(
         start, filters=command(BotCommands.StartCommand) & private))
     bot.add_handler(CallbackQueryHandler(
@@ -291,6 +377,7 @@ async def main():
         BotCommands.HelpCommand) & CustomFilters.authorized))
     bot.add_handler(MessageHandler(stats, filters=command(
         BotCommands.StatsCommand) & CustomFilters.authorized))
+    log_import_report({module for _, module, _, _ in LAZY_HANDLERS})
     LOGGER.info("Bot Started!")
     signal(SIGINT, exit_clean_up)
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+from bot import LOGGER, config_dict, download_dict, download_dict_lock, aria2, aria2_options, qbit_options, get_client
+from bot.helper.ext_utils.bot_utils import EngineStatus, MirrorStatus, TokenBucket, setInterval, sync_to_async, transfer_speeds
+from bot.helper.mirror_utils.status_utils.aria2_status import Aria2Status
+from bot.helper.mirror_utils.status_utils.qbit_status import QbittorrentStatus
+
+GOVERNOR_INTERVAL = 5
+DEMAND_HEADROOM = 1.25
+MIN_SHARE_RATIO = 0.25
+
+
+class BandwidthGovernor:
+
+    def __init__(self):
+        self.usage = {'dl': {}, 'up': {}}
+        self.__shares = {'dl': {}, 'up': {}}
+        self.__task_limits = {'dl': {}, 'up': {}}
+        self.__bucket_rates = {'dl': {}, 'up': {}}
+        self.__buckets = {}
+        self.__applied = {}
+        self.__global = {'dl': None, 'up': None}
+        self.__updater = None
+
+    def start(self):
+        if self.__updater is None:
+            self.__updater = setInterval(GOVERNOR_INTERVAL, self.update)
+
+    @staticmethod
+    def limit(direction):
+        value = config_dict['DOWNLOAD_BANDWIDTH_LIMIT' if direction == 'dl' else 'UPLOAD_BANDWIDTH_LIMIT']
+        return int(value * 1024 ** 2) if value else 0
+
+    @staticmethod
+    def __allocate(limit, demand):
+        shares = {}
+        if not limit:
+            return shares
+        if user_share := config_dict['USER_BANDWIDTH_SHARE']:
+            cap = limit * min(user_share, 100) / 100
+        else:
+            cap = limit
+        remaining = limit
+        users = sorted(demand, key=demand.get)
+        for index, user_id in enumerate(users):
+            fair = min(cap, remaining / (len(users) - index))
+            shares[user_id] = min(fair, max(demand[user_id] * DEMAND_HEADROOM, fair * MIN_SHARE_RATIO))
+            remaining -= shares[user_id]
+        return shares
+
+    @staticmethod
+    def __measure(tasks):
+        usage = {'dl': {}, 'up': {}}
+        demand = {'dl': {}, 'up': {}}
+        user_tasks = {'dl': {}, 'up': {}}
+        statuses = []
+        for uid, task in tasks:
+            try:
+                status = task.status()
+                statuses.append((uid, task, status))
+                if status == MirrorStatus.STATUS_DOWNLOADING:
+                    direction, speed = 'dl', task.speed_raw()
+                elif status in [MirrorStatus.STATUS_UPLOADING, MirrorStatus.STATUS_CLONING]:
+                    direction, speed = 'up', task.speed_raw()
+                elif status == MirrorStatus.STATUS_SEEDING:
+                    direction, speed = 'up', task.upload_speed_raw()
+                else:
+                    continue
+                engine = task.eng()
+            except Exception as e:
+                LOGGER.error(f'Bandwidth governor: {e}')
+                continue
+            user_id = task.message.from_user.id
+            usage[direction][engine] = usage[direction].get(engine, 0) + speed
+            demand[direction][user_id] = demand[direction].get(user_id, 0) + speed
+            user_tasks[direction].setdefault(user_id, []).append(task)
+        return usage, demand, user_tasks, statuses
+
+    async def update(self):
+        async with download_dict_lock:
+            tasks = list(download_dict.items())
+        self.usage, demand, user_tasks, statuses = await sync_to_async(self.__measure, tasks)
+        async with download_dict_lock:
+            for uid, task, status in statuses:
+                # the task may have moved on to another status object meanwhile
+                if download_dict.get(uid) is task:
+                    download_dict.set_status(uid, status)
+        for direction in ['dl', 'up']:
+            transfer_speeds[direction] = sum(self.usage[direction].values())
+        applied = {}
+        for direction in ['dl', 'up']:
+            limit = self.limit(direction)
+            shares = self.__allocate(limit, demand[direction])
+            self.__shares[direction] = shares
+            self.__task_limits[direction] = {}
+            self.__bucket_rates[direction] = {}
+            for user_id, utasks in user_tasks[direction].items():
+                task_limit = int(shares.get(user_id, 0) / len(utasks))
+                self.__task_limits[direction][user_id] = task_limit
+                bucket_tasks = sum(task.eng() in [EngineStatus.STATUS_TG, EngineStatus.STATUS_GD] for task in utasks)
+                self.__bucket_rates[direction][user_id] = task_limit * bucket_tasks
+                for task in utasks:
+                    await self.__apply_task(task, direction, task_limit, applied)
+            await self.__apply_global(direction, limit)
+        self.__applied = applied
+        for key in list(self.__buckets):
+            user_id, direction = key
+            if not self.__bucket_rates[direction].get(user_id):
+                del self.__buckets[key]
+
+    async def __apply_task(self, task, direction, limit, applied):
+        if isinstance(task, Aria2Status):
+            option = 'max-download-limit' if direction == 'dl' else 'max-upload-limit'
+            key = (task.gid(), option)
+            if self.__applied.get(key, 0) != limit:
+                await self.__push(aria2.client.change_option, task.gid(), {option: f'{limit}'})
+        elif isinstance(task, QbittorrentStatus):
+            key = (task.hash(), direction)
+            if self.__applied.get(key, 0) != limit:
+                client = get_client()
+                method = client.torrents_set_download_limit if direction == 'dl' else client.torrents_set_upload_limit
+                await self.__push(method, limit=limit, torrent_hashes=key[0])
+        else:
+            return
+        if limit:
+            applied[key] = limit
+
+    async def __apply_global(self, direction, limit):
+        if self.__global[direction] == limit:
+            return
+        aria2_key = 'max-overall-download-limit' if direction == 'dl' else 'max-overall-upload-limit'
+        qbit_key = 'dl_limit' if direction == 'dl' else 'up_limit'
+        if limit:
+            LOGGER.info(f'Bandwidth governor {direction} limit: {limit} B/s')
+            aria2_value, qbit_value = f'{limit}', limit
+        else:
+            aria2_value = aria2_options.get(aria2_key, '0')
+            qbit_value = qbit_options.get(qbit_key, 0)
+        if await self.__push(aria2.set_global_options, {aria2_key: aria2_value}) and \
+                await self.__push(get_client().app_set_preferences, {qbit_key: qbit_value}):
+            self.__global[direction] = limit
+
+    @staticmethod
+    async def __push(func, *args, **kwargs):
+        try:
+            await sync_to_async(func, *args, **kwargs)
+            return True
+        except Exception as e:
+            LOGGER.error(f'Bandwidth governor: {e}')
+            return False
+
+    def task_limit(self, user_id, direction):
+        if not (limit := self.limit(direction)):
+            return 0
+        if task_limit := self.__task_limits[direction].get(user_id):
+            return task_limit
+        return int(limit / (len(self.__shares[direction]) + 1))
+
+    async def throttle(self, user_id, direction, size):
+        if size <= 0 or not (rate := self.__bucket_rates[direction].get(user_id)):
+            return
+        key = (user_id, direction)
+        if (bucket := self.__buckets.get(key)) is None:
+            bucket = self.__buckets[key] = TokenBucket(rate, rate)
+        elif bucket.rate != rate:
+            bucket.rate = bucket.burst = rate
+        while size > 0:
+            tokens = min(size, bucket.burst)
+            await bucket.acquire(tokens)
+            size -= tokens
+
+
+bandwidth_governor = BandwidthGovernor()
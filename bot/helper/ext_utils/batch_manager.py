@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+from time import time
+
+from bot import LOGGER
+from bot.helper.ext_utils.bot_utils import new_task
+from bot.helper.telegram_helper.message_utils import sendMessage, editMessage
+
+def strip_multi_arg(input_list):
+    msg = [s.strip() for s in input_list]
+    if '-i' in msg:
+        index = msg.index('-i')
+        del msg[index:index + 2]
+    return " ".join(msg)
+
+
+class BatchSubmitter:
+    def __init__(self, client, message, total):
+        self.__client = client
+        self.__message = message
+        self.__status = None
+        self.__last_edit = 0
+        self.total = total
+        self.submitted = 0
+        self.failed = 0
+
+    def __status_text(self, done=False):
+        msg = f"<b>Batch {'Submitted' if done else 'Submitting'}:</b> {self.submitted}/{self.total}"
+        if self.failed:
+            msg += f"\n<b>Failed:</b> {self.failed}"
+        return msg
+
+    async def __update_status(self, done=False):
+        if self.__status is None or isinstance(self.__status, str):
+            return
+        if done or time() - self.__last_edit > 10:
+            self.__last_edit = time()
+            await editMessage(self.__status, self.__status_text(done))
+
+    async def submit(self, reply_to, text, submit_task, sameDir=None):
+        nextmsg = await sendMessage(reply_to, text)
+        if isinstance(nextmsg, str):
+            self.failed += 1
+            return
+        nextmsg = await self.__client.get_messages(chat_id=self.__message.chat.id, message_ids=nextmsg.id)
+        if sameDir is not None:
+            sameDir['tasks'].add(nextmsg.id)
+        nextmsg.from_user = self.__message.from_user
+        submit_task(nextmsg)
+        self.submitted += 1
+        await self.__update_status()
+
+    async def run(self, items, submit_task, sameDir=None):
+        if self.total > 1:
+            self.__status = await sendMessage(self.__message, self.__status_text())
+        for reply_to, text in items:
+            try:
+                await self.submit(reply_to, text, submit_task, sameDir)
+            except Exception as e:
+                LOGGER.error(f"Batch submit error: {e}")
+                self.failed += 1
+        LOGGER.info(f"Batch Submitted: {self.submitted}/{self.total} tasks")
+        await self.__update_status(True)
+
+
+@new_task
+async def run_bulk(client, message, cmd, bulk, submit_task):
+    items = [(message, f"{cmd} {link}") for link in bulk]
+    await BatchSubmitter(client, message, len(items)).run(items, submit_task)
+
+
+@new_task
+async def run_multi(client, message, input_list, multi, submit_task, sameDir=None):
+    if multi <= 1 or not message.reply_to_message_id:
+        return
+    text = strip_multi_arg(input_list)
+    msg_ids = [message.reply_to_message_id + i for i in range(1, multi)]
+    targets = []
+    for i in range(0, len(msg_ids), 200):
+        targets.extend(await client.get_messages(chat_id=message.chat.id, message_ids=msg_ids[i:i + 200]))
+    items = [(target, text) for target in targets if not target.empty]
+    if sameDir is not None and len(items) < multi - 1:
+        sameDir['total'] -= multi - 1 - len(items)
+    await BatchSubmitter(client, message, len(items)).run(items, submit_task, sameDir)
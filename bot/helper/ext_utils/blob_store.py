@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+from asyncio import get_running_loop
+from collections import OrderedDict
+from hashlib import sha256
+from os import link, replace, scandir, utime
+from aiofiles.os import path as aiopath, makedirs, remove as aioremove, rename
+from aiofiles import open as aiopen
+
+from bot import LOGGER
+
+BLOB_DIR = 'blobs'
+
+BLOB_CACHE_SIZE = 500
+
+BLOB_PATHS = {'thumb': 'Thumbnails/{}.jpg', 'rclone': 'rclone/{}.conf'}
+
+# user_id ==> {key: digest}, digest is None until an inline legacy blob is moved to GridFS
+user_blobs = {}
+
+
+def blob_digest(data):
+    return sha256(data).hexdigest()
+
+
+def user_blob_path(user_id, key):
+    return BLOB_PATHS[key].format(user_id)
+
+
+def scan_blobs():
+    entries = []
+    try:
+        with scandir(BLOB_DIR) as it:
+            for entry in it:
+                if entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.name))
+    except FileNotFoundError:
+        pass
+    return [name for _, name in sorted(entries)]
+
+
+class BlobCache:
+    def __init__(self):
+        self.__entries = None
+
+    async def __load(self):
+        if self.__entries is None:
+            self.__entries = OrderedDict.fromkeys(await get_running_loop().run_in_executor(None, scan_blobs))
+
+    async def get(self, digest):
+        await self.__load()
+        if digest not in self.__entries:
+            return None
+        path = f'{BLOB_DIR}/{digest}'
+        try:
+            async with aiopen(path, 'rb') as f:
+                data = await f.read()
+        except FileNotFoundError:
+            del self.__entries[digest]
+            return None
+        if blob_digest(data) != digest:
+            LOGGER.warning(f'Dropping corrupted cached blob: {digest}')
+            await self.discard(digest)
+            return None
+        self.__entries.move_to_end(digest)
+        await get_running_loop().run_in_executor(None, utime, path)
+        return data
+
+    async def put(self, digest, data):
+        await self.__load()
+        if not await aiopath.isdir(BLOB_DIR):
+            await makedirs(BLOB_DIR, exist_ok=True)
+        if digest not in self.__entries:
+            tmp_path = f'{BLOB_DIR}/.{digest}'
+            async with aiopen(tmp_path, 'wb') as f:
+                await f.write(data)
+            await rename(tmp_path, f'{BLOB_DIR}/{digest}')
+        self.__entries[digest] = None
+        self.__entries.move_to_end(digest)
+        while len(self.__entries) > BLOB_CACHE_SIZE:
+            await self.discard(next(iter(self.__entries)))
+
+    async def link(self, digest, path):
+        # hard link the cached blob to path, the data survives the cache evicting it
+        await self.__load()
+        if digest not in self.__entries:
+            return False
+        try:
+            await get_running_loop().run_in_executor(None, link, f'{BLOB_DIR}/{digest}', f'{path}.tmp')
+            await get_running_loop().run_in_executor(None, replace, f'{path}.tmp', path)
+        except OSError:
+            return False
+        return True
+
+    async def discard(self, digest):
+        self.__entries.pop(digest, None)
+        try:
+            await aioremove(f'{BLOB_DIR}/{digest}')
+        except FileNotFoundError:
+            pass
+
+
+blob_cache = BlobCache()
+
+
+async def write_user_blob(user_id, key, data, digest):
+    # user files are links into BLOB_DIR, so they must be replaced and never rewritten in place
+    path = user_blob_path(user_id, key)
+    dir_ = path.rsplit('/', 1)[0]
+    if not await aiopath.isdir(dir_):
+        await makedirs(dir_, exist_ok=True)
+    if await blob_cache.link(digest, path):
+        return
+    async with aiopen(f'{path}.tmp', 'wb') as f:
+        await f.write(data)
+    await rename(f'{path}.tmp', path)
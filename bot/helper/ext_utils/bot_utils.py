@@ -10,9 +10,10 @@ from time import time
 from html import escape
 from uuid import uuid4
 from subprocess import run as srun
-from asyncio import create_subprocess_exec, create_subprocess_shell, run_coroutine_threadsafe, sleep
+from asyncio import create_subprocess_exec, create_subprocess_shell, run_coroutine_threadsafe, sleep, Lock
 from asyncio.subprocess import PIPE
 from functools import partial, wraps
+from itertools import islice
 from concurrent.futures import ThreadPoolExecutor
 
 from aiohttp import ClientSession as aioClientSession
@@ -24,7 +25,7 @@ from pyrogram.types import BotCommand
 from pyrogram.errors import PeerIdInvalid
 
 from bot.helper.ext_utils.db_handler import DbManger
-from bot.helper.themes import BotTheme
+from bot.helper.themes import get_theme
 from bot import OWNER_ID, bot_name, DATABASE_URL, LOGGER, get_client, aria2, download_dict, download_dict_lock, botStartTime, user_data, config_dict, bot_loop, extra_buttons, user
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.button_build import ButtonMaker
@@ -39,9 +40,8 @@ URL_REGEX = r'^(?!\/)(rtmps?:\/\/|mms:\/\/|rtsp:\/\/|https?:\/\/|ftp:\/\/)?([^\/
 
 SIZE_UNITS = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
 
-STATUS_START = 0
-PAGES = 1
-PAGE_NO = 1
+status_views = {}
+transfer_speeds = {'dl': 0, 'up': 0}
 
 
 class MirrorStatus:
@@ -74,6 +74,29 @@ class setInterval:
         self.task.cancel()
 
 
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__last = time()
+        self.__lock = Lock()
+
+    def __refill(self):
+        now = time()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    async def acquire(self, tokens=1):
+        tokens = min(tokens, self.burst)
+        async with self.__lock:
+            self.__refill()
+            while self.__tokens < tokens:
+                await sleep((tokens - self.__tokens) / self.rate)
+                self.__refill()
+            self.__tokens -= tokens
+
+
 def get_readable_file_size(size_in_bytes):
     if size_in_bytes is None:
         return '0B'
@@ -84,6 +107,26 @@ def get_readable_file_size(size_in_bytes):
     return f'{size_in_bytes:.2f}{SIZE_UNITS[index]}' if index > 0 else f'{size_in_bytes}B'
 
 
+def pack_lines(lines, limit, reserved=0):
+    chunks, chunk, size = [], [], reserved
+    for line in lines:
+        line_size = len(line.encode())
+        if chunk and size + line_size > limit:
+            chunks.append(''.join(chunk))
+            chunk, size = [], reserved
+        chunk.append(line)
+        size += line_size
+    if chunk:
+        chunks.append(''.join(chunk))
+    return chunks
+
+
+def speed_string_to_bytes(spd):
+    if match := re_match(r'([\d.]+)\s*([KMGTP]?)i?B', spd):
+        return float(match.group(1)) * 1024 ** SIZE_UNITS.index(f'{match.group(2)}B')
+    return 0
+
+
 async def getDownloadByGid(gid):
     async with download_dict_lock:
         return next((dl for dl in download_dict.values() if dl.gid() == gid), None)
@@ -188,114 +231,110 @@ class EngineStatus:
     STATUS_RCLONE = f"RClone {get_rclone_version()}"
 
 
-def get_readable_message():
+STATUS_FILTERS = {'dl': [MirrorStatus.STATUS_DOWNLOADING],
+                  'up': [MirrorStatus.STATUS_UPLOADING, MirrorStatus.STATUS_UPLOADDDL],
+                  'clone': [MirrorStatus.STATUS_CLONING],
+                  'seed': [MirrorStatus.STATUS_SEEDING],
+                  'queue': [MirrorStatus.STATUS_QUEUEDL, MirrorStatus.STATUS_QUEUEUP],
+                  'pause': [MirrorStatus.STATUS_PAUSED],
+                  'arch': [MirrorStatus.STATUS_ARCHIVING, MirrorStatus.STATUS_EXTRACTING, MirrorStatus.STATUS_SPLITTING]}
+
+
+def get_status_view(chat_id):
+    if chat_id not in status_views:
+        status_views[chat_id] = {'page': 0, 'pages': 1, 'user_id': None, 'status': None}
+    return status_views[chat_id]
+
+
+def get_status_tasks(view):
+    if view['status'] is not None:
+        for uid in list(download_dict.unindexed):
+            download_dict.set_status(uid, download_dict[uid].status())
+        uids = [uid for status in STATUS_FILTERS[view['status']] for uid in download_dict.status_tasks.get(status, {})]
+        if view['user_id'] is not None:
+            user_tasks = download_dict.user_tasks.get(view['user_id'], {})
+            uids = [uid for uid in uids if uid in user_tasks]
+        return [download_dict[uid] for uid in uids]
+    if view['user_id'] is not None:
+        return [download_dict[uid] for uid in download_dict.user_tasks.get(view['user_id'], {})]
+    return download_dict.values()
+
+
+def get_readable_message(chat_id=None):
     msg = ""
     button = None
     STATUS_LIMIT = config_dict['STATUS_LIMIT']
-    tasks = len(download_dict)
-    globals()['PAGES'] = (tasks + STATUS_LIMIT - 1) // STATUS_LIMIT
-    if PAGE_NO > PAGES and PAGES != 0:
-        globals()['STATUS_START'] = STATUS_LIMIT * (PAGES - 1)
-        globals()['PAGE_NO'] = PAGES
-    for download in list(download_dict.values())[STATUS_START:STATUS_LIMIT+STATUS_START]:
+    view = get_status_view(chat_id)
+    status_tasks = get_status_tasks(view)
+    tasks = len(status_tasks)
+    view['pages'] = max((tasks + STATUS_LIMIT - 1) // STATUS_LIMIT, 1)
+    view['page'] = min(view['page'], view['pages'] - 1)
+    start = view['page'] * STATUS_LIMIT
+    theme = get_theme()
+    for download in islice(status_tasks, start, start + STATUS_LIMIT):
         msg_link = download.message.link if download.message.chat.type in [
             ChatType.SUPERGROUP, ChatType.CHANNEL] and not config_dict['DELETE_LINKS'] else ''
-        msg += BotTheme('STATUS_NAME', Name=escape(f'{download.name()}'))
+        msg += theme('STATUS_NAME', Name=escape(f'{download.name()}'))
         if download.status() not in [MirrorStatus.STATUS_SPLITTING, MirrorStatus.STATUS_SEEDING]:
             if download.status() != MirrorStatus.STATUS_UPLOADDDL:
-                msg += BotTheme('BAR', Bar=f"{get_progress_bar_string(download.progress())} {download.progress()}")
-                msg += BotTheme('PROCESSED', Processed=f"{download.processed_bytes()} of {download.size()}")
-            msg += BotTheme('STATUS', Status=download.status(), Url=msg_link)
+                msg += theme.render(('BAR', {'Bar': f"{get_progress_bar_string(download.progress())} {download.progress()}"}),
+                                    ('PROCESSED', {'Processed': f"{download.processed_bytes()} of {download.size()}"}))
+            msg += theme('STATUS', Status=download.status(), Url=msg_link)
             if download.status() != MirrorStatus.STATUS_UPLOADDDL:
-                msg += BotTheme('ETA', Eta=download.eta())
-                msg += BotTheme('SPEED', Speed=download.speed())
-            msg += BotTheme('ELAPSED', Elapsed=get_readable_time(time() - download.message.date.timestamp()))
-            msg += BotTheme('ENGINE', Engine=download.eng())
-            msg += BotTheme('STA_MODE', Mode=download.upload_details['mode'])
+                msg += theme.render(('ETA', {'Eta': download.eta()}), ('SPEED', {'Speed': download.speed()}))
+            msg += theme.render(('ELAPSED', {'Elapsed': get_readable_time(time() - download.message.date.timestamp())}),
+                                ('ENGINE', {'Engine': download.eng()}),
+                                ('STA_MODE', {'Mode': download.upload_details['mode']}))
             if hasattr(download, 'seeders_num'):
                 try:
-                    msg += BotTheme('SEEDERS', Seeders=download.seeders_num())
-                    msg += BotTheme('LEECHERS', Leechers=download.leechers_num())
+                    msg += theme.render(('SEEDERS', {'Seeders': download.seeders_num()}),
+                                        ('LEECHERS', {'Leechers': download.leechers_num()}))
                 except:
                     pass
         elif download.status() == MirrorStatus.STATUS_SEEDING:
-            msg += BotTheme('STATUS', Status=download.status(), Url=msg_link)
-            msg += BotTheme('SEED_SIZE', Size=download.size())
-            msg += BotTheme('SEED_SPEED', Speed=download.upload_speed())
-            msg += BotTheme('UPLOADED', Upload=download.uploaded_bytes())
-            msg += BotTheme('RATIO', Ratio=download.ratio())
-            msg += BotTheme('TIME', Time=download.seeding_time())
-            msg += BotTheme('SEED_ENGINE', Engine=download.eng())
+            msg += theme.render(('STATUS', {'Status': download.status(), 'Url': msg_link}),
+                                ('SEED_SIZE', {'Size': download.size()}),
+                                ('SEED_SPEED', {'Speed': download.upload_speed()}),
+                                ('UPLOADED', {'Upload': download.uploaded_bytes()}),
+                                ('RATIO', {'Ratio': download.ratio()}),
+                                ('TIME', {'Time': download.seeding_time()}),
+                                ('SEED_ENGINE', {'Engine': download.eng()}))
         else:
-            msg += BotTheme('STATUS', Status=download.status(), Url=msg_link)
-            msg += BotTheme('STATUS_SIZE', Size=download.size())
-            msg += BotTheme('NON_ENGINE', Engine=download.eng())
+            msg += theme.render(('STATUS', {'Status': download.status(), 'Url': msg_link}),
+                                ('STATUS_SIZE', {'Size': download.size()}),
+                                ('NON_ENGINE', {'Engine': download.eng()}))
 
-        msg += BotTheme('USER',
-                        User=download.message.from_user.mention(style="html"))
-        msg += BotTheme('ID', Id=download.message.from_user.id)
-        msg += BotTheme('CANCEL', Cancel=f"/{BotCommands.CancelMirror}_{download.gid()}")
+        msg += theme.render(('USER', {'User': download.message.from_user.mention(style="html")}),
+                            ('ID', {'Id': download.message.from_user.id}),
+                            ('CANCEL', {'Cancel': f"/{BotCommands.CancelMirror}_{download.gid()}"}))
 
     if len(msg) == 0:
         return None, None
 
-    dl_speed = 0
-
-    def convert_speed_to_bytes_per_second(spd):
-        if 'K' in spd:
-            return float(spd.split('K')[0]) * 1024
-        elif 'M' in spd:
-            return float(spd.split('M')[0]) * 1048576
-        else:
-            return 0
-
-    dl_speed = 0
-    up_speed = 0
-    for download in download_dict.values():
-        tstatus = download.status()
-        spd = download.speed() if tstatus != MirrorStatus.STATUS_SEEDING else download.upload_speed()
-        speed_in_bytes_per_second = convert_speed_to_bytes_per_second(spd)
-        if tstatus == MirrorStatus.STATUS_DOWNLOADING:
-            dl_speed += speed_in_bytes_per_second
-        elif tstatus == MirrorStatus.STATUS_UPLOADING or tstatus == MirrorStatus.STATUS_SEEDING:
-            up_speed += speed_in_bytes_per_second
-
-    msg += BotTheme('FOOTER')
+    msg += theme('FOOTER')
     if tasks > STATUS_LIMIT:
-        msg += BotTheme('PAGE', Page=f"{PAGE_NO}/{PAGES}")
-        msg += BotTheme('TASKS', Tasks=tasks)
+        msg += theme.render(('PAGE', {'Page': f"{view['page'] + 1}/{view['pages']}"}), ('TASKS', {'Tasks': tasks}))
         buttons = ButtonMaker()
-        buttons.ibutton(BotTheme('PREVIOUS'), "status pre")
-        buttons.ibutton(BotTheme('REFRESH'), "status ref")
-        buttons.ibutton(BotTheme('NEXT'), "status nex")
+        buttons.ibutton(theme('PREVIOUS'), "status pre")
+        buttons.ibutton(theme('REFRESH'), "status ref")
+        buttons.ibutton(theme('NEXT'), "status nex")
         button = buttons.build_menu(3)
-    msg += BotTheme('Cpu', cpu=cpu_percent())
-    msg += BotTheme('FREE', free=get_readable_file_size(disk_usage(config_dict['DOWNLOAD_DIR']).free))
-    msg += BotTheme('Ram', ram=virtual_memory().percent)
-    msg += BotTheme('uptime', uptime=get_readable_time(time() - botStartTime))
-    msg += BotTheme('DL', DL=get_readable_file_size(dl_speed))
-    msg += BotTheme('UL', UL=get_readable_file_size(up_speed))
+    msg += theme.render(('Cpu', {'cpu': cpu_percent()}),
+                        ('FREE', {'free': get_readable_file_size(disk_usage(config_dict['DOWNLOAD_DIR']).free)}),
+                        ('Ram', {'ram': virtual_memory().percent}),
+                        ('uptime', {'uptime': get_readable_time(time() - botStartTime)}),
+                        ('DL', {'DL': get_readable_file_size(transfer_speeds['dl'])}),
+                        ('UL', {'UL': get_readable_file_size(transfer_speeds['up'])}))
     return msg, button
 
 
-async def turn_page(data):
-    STATUS_LIMIT = config_dict['STATUS_LIMIT']
-    global STATUS_START, PAGE_NO
+async def turn_page(data, chat_id):
     async with download_dict_lock:
+        view = get_status_view(chat_id)
         if data[1] == "nex":
-            if PAGE_NO == PAGES:
-                STATUS_START = 0
-                PAGE_NO = 1
-            else:
-                STATUS_START += STATUS_LIMIT
-                PAGE_NO += 1
+            view['page'] = (view['page'] + 1) % view['pages']
         elif data[1] == "pre":
-            if PAGE_NO == 1:
-                STATUS_START = STATUS_LIMIT * (PAGES - 1)
-                PAGE_NO = PAGES
-            else:
-                STATUS_START -= STATUS_LIMIT
-                PAGE_NO -= 1
+            view['page'] = (view['page'] - 1) % view['pages']
 
 
 def get_readable_time(seconds):
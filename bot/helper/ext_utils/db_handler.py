@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
-from aiofiles.os import path as aiopath, makedirs
+from asyncio import Lock
+from aiofiles.os import path as aiopath
 from aiofiles import open as aiopen
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import PyMongoError
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo.errors import PyMongoError, DuplicateKeyError
 from dotenv import dotenv_values
 
+from bot.helper.ext_utils.blob_store import BLOB_PATHS, user_blobs, blob_cache, blob_digest, user_blob_path, write_user_blob
 from bot import DATABASE_URL, user_data, rss_dict, LOGGER, bot_id, config_dict, aria2_options, qbit_options, bot_loop
 
+pending_blobs = set()
+blob_loads = {}
+# serializes storing a blob and pointing a user at it against dropping unreferenced blobs
+blob_refs_lock = Lock()
+
 
 class DbManger:
     def __init__(self):
@@ -36,25 +44,21 @@ class DbManger:
             await self.__db.settings.qbittorrent.update_one({'_id': bot_id}, {'$set': qbit_options}, upsert=True)
         # User Data
         if await self.__db.users.find_one():
-            rows = self.__db.users.find({})
+            # blobs stay in GridFS until the user's first update, see load_user_blobs
+            rows = self.__db.users.aggregate([{'$addFields': {key: {'$cond': [{'$eq': [{'$type': f'${key}'}, 'string']},
+                                                                             f'${key}', {'$toBool': f'${key}'}]}
+                                                              for key in BLOB_PATHS}}])
             # return a dict ==> {_id, is_sudo, is_auth, as_doc, thumb, yt_opt, media_group, equal_splits, split_size, rclone}
             async for row in rows:
                 uid = row['_id']
                 del row['_id']
-                thumb_path = f'Thumbnails/{uid}.jpg'
-                rclone_path = f'rclone/{uid}.conf'
-                if row.get('thumb'):
-                    if not await aiopath.exists('Thumbnails'):
-                        await makedirs('Thumbnails')
-                    async with aiopen(thumb_path, 'wb+') as f:
-                        await f.write(row['thumb'])
-                    row['thumb'] = thumb_path
-                if row.get('rclone'):
-                    if not await aiopath.exists('rclone'):
-                        await makedirs('rclone')
-                    async with aiopen(rclone_path, 'wb+') as f:
-                        await f.write(row['rclone'])
-                    row['rclone'] = rclone_path
+                for key in BLOB_PATHS:
+                    if digest := row.get(key):
+                        row[key] = user_blob_path(uid, key)
+                        user_blobs.setdefault(uid, {})[key] = digest if isinstance(digest, str) else None
+                        pending_blobs.add(uid)
+                    elif row.get(key, '') is None:
+                        del row[key]
                 user_data[uid] = row
             LOGGER.info("Users data has been imported from Database")
         # Rss Data
@@ -68,6 +72,66 @@ class DbManger:
             LOGGER.info("Rss data has been imported from Database.")
         self.__conn.close
 
+    async def __put_blob(self, data):
+        digest = blob_digest(data)
+        if await self.__db['blobs.files'].find_one({'_id': digest}, {'_id': 1}) is None:
+            bucket = AsyncIOMotorGridFSBucket(self.__db, 'blobs')
+            try:
+                await bucket.upload_from_stream_with_id(digest, digest, data)
+            except DuplicateKeyError:
+                # stored concurrently, but the aborted upload removes chunks by _id, so check the other copy is whole
+                if not await self.__blob_complete(digest):
+                    try:
+                        await bucket.delete(digest)
+                    except NoFile:
+                        pass
+                    try:
+                        await bucket.upload_from_stream_with_id(digest, digest, data)
+                    except DuplicateKeyError:
+                        pass
+        await blob_cache.put(digest, data)
+        return digest
+
+    async def __blob_complete(self, digest):
+        row = await self.__db['blobs.files'].find_one({'_id': digest}, {'length': 1, 'chunkSize': 1})
+        return row is not None and \
+            await self.__db['blobs.chunks'].count_documents({'files_id': digest}) == -(-row['length'] // row['chunkSize'])
+
+    async def __get_blob(self, digest):
+        if (data := await blob_cache.get(digest)) is not None:
+            return data
+        try:
+            stream = await AsyncIOMotorGridFSBucket(self.__db, 'blobs').open_download_stream(digest)
+        except NoFile:
+            LOGGER.error(f'Blob not found in database: {digest}')
+            return None
+        data = await stream.read()
+        await blob_cache.put(digest, data)
+        return data
+
+    async def __migrate_user_blobs(self, user_id):
+        # older documents keep the whole file inline, move it to GridFS and keep only the digest
+        for key, digest in list(user_blobs.get(user_id, {}).items()):
+            if digest is not None:
+                continue
+            row = await self.__db.users.find_one({'_id': user_id}, {key: 1})
+            if row and isinstance(row.get(key), bytes):
+                async with blob_refs_lock:
+                    digest = await self.__put_blob(row[key])
+                    await self.__db.users.update_one({'_id': user_id}, {'$set': {key: digest}})
+                user_blobs[user_id][key] = digest
+            else:
+                del user_blobs[user_id][key]
+
+    async def load_user_blobs(self, user_id):
+        if self.__err:
+            return
+        await self.__migrate_user_blobs(user_id)
+        for key, digest in user_blobs.get(user_id, {}).items():
+            if (data := await self.__get_blob(digest)) is not None:
+                await write_user_blob(user_id, key, data, digest)
+        self.__conn.close
+
     async def update_deploy_config(self):
         if self.__err:
             return
@@ -111,25 +175,42 @@ class DbManger:
     async def update_user_data(self, user_id):
         if self.__err:
             return
-        data = user_data[user_id]
-        if data.get('thumb'):
-            del data['thumb']
-        if data.get('rclone'):
-            del data['rclone']
+        await self.__migrate_user_blobs(user_id)
+        data = {key: value for key, value in user_data[user_id].items() if key not in BLOB_PATHS}
+        data.update(user_blobs.get(user_id, {}))
         await self.__db.users.replace_one({'_id': user_id}, data, upsert=True)
         self.__conn.close
 
     async def update_user_doc(self, user_id, key, path=''):
         if self.__err:
             return
+        old_digest = user_blobs.get(user_id, {}).get(key)
         if path:
             async with aiopen(path, 'rb+') as doc:
-                doc_bin = await doc.read()
-        else:
-            doc_bin = ''
-        await self.__db.users.update_one({'_id': user_id}, {'$set': {key: doc_bin}}, upsert=True)
+                data = await doc.read()
+        async with blob_refs_lock:
+            if path:
+                digest = await self.__put_blob(data)
+                user_blobs.setdefault(user_id, {})[key] = digest
+                await write_user_blob(user_id, key, data, digest)
+            else:
+                digest = ''
+                user_blobs.get(user_id, {}).pop(key, None)
+            await self.__db.users.update_one({'_id': user_id}, {'$set': {key: digest}}, upsert=True)
+            if old_digest and old_digest != digest:
+                await self.__release_blob(old_digest)
         self.__conn.close
 
+    async def __release_blob(self, digest):
+        # user documents are the references, drop the blob once none of them points at it
+        if await self.__db.users.find_one({'$or': [{key: digest} for key in BLOB_PATHS]}, {'_id': 1}) is not None:
+            return
+        try:
+            await AsyncIOMotorGridFSBucket(self.__db, 'blobs').delete(digest)
+        except NoFile:
+            pass
+        await blob_cache.discard(digest)
+
     async def rss_update_all(self):
         if self.__err:
             return
@@ -149,11 +230,19 @@ class DbManger:
         await self.__db.rss[bot_id].delete_one({'_id': user_id})
         self.__conn.close
 
-    async def add_incomplete_task(self, cid, link, tag):
+    async def add_incomplete_task(self, cid, link, tag, journal=None):
         if self.__err:
             return
-        await self.__db.tasks[bot_id].insert_one({'_id': link, 'cid': cid, 'tag': tag})
+        await self.__db.tasks[bot_id].replace_one({'_id': link}, {'cid': cid, 'tag': tag} | (journal or {}), upsert=True)
+        self.__conn.close
+
+    async def get_task_journal(self):
+        if self.__err:
+            return []
+        # return a list ==> [{_id, cid, tag, mid, uid, dir, isQbit, isLeech, isYtdlp, qual, resumable}]
+        rows = [row async for row in self.__db.tasks[bot_id].find({'mid': {'$exists': True}})]
         self.__conn.close
+        return rows
 
     async def rm_complete_task(self, link):
         if self.__err:
@@ -181,6 +270,19 @@ class DbManger:
         self.__conn.close
         return notifier_dict  # return a dict ==> {cid: {tag: [_id, _id, ...]}}
 
+    async def get_content_hash(self, md5):
+        if self.__err:
+            return None
+        row = await self.__db.hashes[bot_id].find_one({'_id': md5})
+        self.__conn.close
+        return row
+
+    async def update_content_hash(self, md5, dict_):
+        if self.__err:
+            return
+        await self.__db.hashes[bot_id].update_one({'_id': md5}, {'$set': dict_}, upsert=True)
+        self.__conn.close
+
     async def trunc_table(self, name):
         if self.__err:
             return
@@ -188,5 +290,15 @@ class DbManger:
         self.__conn.close
 
 
+async def ensure_user_blobs(user_id):
+    # write the user's thumbnail and rclone config to disk before a path from user_dict is used
+    if user_id in pending_blobs:
+        pending_blobs.discard(user_id)
+        blob_loads[user_id] = bot_loop.create_task(DbManger().load_user_blobs(user_id))
+        blob_loads[user_id].add_done_callback(lambda _: blob_loads.pop(user_id, None))
+    if (task := blob_loads.get(user_id)) is not None:
+        await task
+
+
 if DATABASE_URL:
     bot_loop.run_until_complete(DbManger().db_load())
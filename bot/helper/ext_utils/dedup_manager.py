@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+
+from bot import DATABASE_URL
+from bot.helper.ext_utils.bot_utils import sync_to_async
+from bot.helper.ext_utils.db_handler import DbManger
+from bot.helper.ext_utils.leech_utils import get_file_fingerprint
+
+CONTENT_CACHE_SIZE = 10000
+
+content_hashes = OrderedDict()
+
+
+def __cache(key, row):
+    content_hashes[key] = row
+    content_hashes.move_to_end(key)
+    while len(content_hashes) > CONTENT_CACHE_SIZE:
+        content_hashes.popitem(last=False)
+    return row
+
+
+async def get_fingerprint(path):
+    return await sync_to_async(get_file_fingerprint, path)
+
+
+async def lookup_content(key):
+    if key in content_hashes:
+        content_hashes.move_to_end(key)
+        return content_hashes[key]
+    if DATABASE_URL and (row := await DbManger().get_content_hash(key)):
+        del row['_id']
+        return __cache(key, row)
+    return {}
+
+
+async def store_content(key, name, value):
+    __cache(key, content_hashes.get(key, {}))[name] = value
+    if DATABASE_URL:
+        await DbManger().update_content_hash(key, {name: value})
@@ -15,4 +15,9 @@ class RssShutdownException(Exception):
 
 class TgLinkException(Exception):
     """No Access granted for this chat"""
-    pass
\ No newline at end of file
+    pass
+
+
+class RcloneRcException(Exception):
+    """Rclone remote control daemon returned an error"""
+    pass
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
-from os import walk, path as ospath
-from aiofiles.os import remove as aioremove, path as aiopath, listdir, rmdir, makedirs
+from os import scandir, stat, fstat, copy_file_range, remove as osremove, rmdir as osrmdir, listdir as oslistdir, path as ospath, \
+    SEEK_END
+from collections import OrderedDict
+from threading import Lock
+from queue import SimpleQueue, Empty
+from aiofiles.os import remove as aioremove, path as aiopath, listdir, makedirs
 from aioshutil import rmtree as aiormtree
-from shutil import rmtree, disk_usage
+from shutil import rmtree, disk_usage, copyfileobj
 from magic import Magic
 from re import split as re_split, I, search as re_search
 from subprocess import run as srun
@@ -10,7 +14,8 @@ from sys import exit as sexit
 
 from .exceptions import NotSupportedExtractionArchive
 from bot import aria2, LOGGER, DOWNLOAD_DIR, get_client, GLOBAL_EXTENSION_FILTER
-from bot.helper.ext_utils.bot_utils import sync_to_async, cmd_exec
+from bot.helper.ext_utils.bot_utils import sync_to_async, setInterval
+from bot.helper.ext_utils.sa_ledger import sa_ledger
 
 ARCH_EXT = [".tar.bz2", ".tar.gz", ".bz2", ".gz", ".tar.xz", ".tar", ".tbz2", ".tgz", ".lzma2",
             ".zip", ".7z", ".z", ".rar", ".iso", ".wim", ".cab", ".apm", ".arj", ".chm",
@@ -21,6 +26,43 @@ FIRST_SPLIT_REGEX = r'(\.|_)part0*1\.rar$|(\.|_)7z\.0*1$|(\.|_)zip\.0*1$|^(?!.*(
 
 SPLIT_REGEX = r'\.r\d+$|\.7z\.\d+$|\.z\d+$|\.zip\.\d+$'
 
+TREE_CACHE_SIZE = 32
+
+MIME_CACHE_SIZE = 10000
+
+JOIN_BUFFER_SIZE = 8 * 1024 * 1024
+
+STORAGE_SAMPLE_INTERVAL = 10
+
+MIME_EXTENSIONS = {'.mp4': 'video/mp4', '.mkv': 'video/x-matroska', '.webm': 'video/webm', '.avi': 'video/x-msvideo',
+                   '.mov': 'video/quicktime', '.m4v': 'video/x-m4v', '.ts': 'video/mp2t', '.flv': 'video/x-flv',
+                   '.mp3': 'audio/mpeg', '.flac': 'audio/flac', '.m4a': 'audio/x-m4a', '.wav': 'audio/x-wav',
+                   '.opus': 'audio/ogg', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+                   '.gif': 'image/gif', '.webp': 'image/webp', '.pdf': 'application/pdf', '.zip': 'application/zip',
+                   '.rar': 'application/x-rar', '.7z': 'application/x-7z-compressed', '.txt': 'text/plain'}
+
+tree_cache = OrderedDict()
+
+# uid ==> {stage: bytes}, expected peak footprint of download, extract/zip and split
+storage_reservations = {}
+# uid ==> bytes the task had on disk at the last sample, see sample_storage
+storage_written = {}
+storage_lock = Lock()
+storage_sampler = None
+
+
+class TreeScan:
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.files = []
+        self.dirs = [path]
+        self.filtered = 0
+
+    @property
+    def folders(self):
+        return len(self.dirs) - 1
+
 
 def is_first_archive_split(file):
     return bool(re_search(FIRST_SPLIT_REGEX, file))
@@ -34,7 +76,54 @@ def is_archive_split(file):
     return bool(re_search(SPLIT_REGEX, file))
 
 
+def scan_tree(path):
+    tree = TreeScan(path)
+    ext_filter = tuple(GLOBAL_EXTENSION_FILTER)
+    stack = [path]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            entries = list(scandir(dirpath))
+        except OSError as e:
+            LOGGER.error(f"Unable to scan {dirpath}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                tree.dirs.append(entry.path)
+                stack.append(entry.path)
+                continue
+            try:
+                f_size = entry.stat().st_size
+            except OSError:
+                f_size = 0
+            tree.size += f_size
+            tree.files.append((dirpath, entry.name, f_size))
+            if entry.name.endswith(ext_filter):
+                tree.filtered += 1
+    return tree
+
+
+async def get_tree(path, cached=True):
+    if cached and (tree := tree_cache.get(path)) is not None:
+        tree_cache.move_to_end(path)
+        return tree
+    tree = await sync_to_async(scan_tree, path)
+    tree_cache[path] = tree
+    tree_cache.move_to_end(path)
+    while len(tree_cache) > TREE_CACHE_SIZE:
+        tree_cache.popitem(last=False)
+    return tree
+
+
+def invalidate_tree(path):
+    path = path.rstrip('/')
+    for key in list(tree_cache):
+        if key == path or key.startswith(f'{path}/') or path.startswith(f'{key}/'):
+            del tree_cache[key]
+
+
 async def clean_target(path):
+    invalidate_tree(path)
     if await aiopath.exists(path):
         LOGGER.info(f"Cleaning Target: {path}")
         if await aiopath.isdir(path):
@@ -50,6 +139,7 @@ async def clean_target(path):
 
 
 async def clean_download(path):
+    invalidate_tree(path)
     if await aiopath.exists(path):
         LOGGER.info(f"Cleaning Download: {path}")
         try:
@@ -58,8 +148,31 @@ async def clean_download(path):
             pass
 
 
-async def start_cleanup():
+def clean_download_dir(keep):
+    try:
+        entries = list(scandir(DOWNLOAD_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name in keep:
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                rmtree(entry.path)
+            else:
+                osremove(entry.path)
+        except OSError:
+            pass
+
+
+async def start_cleanup(keep=()):
+    # torrents are dropped without their files, journaled task dirs are resumed by the engines
     get_client().torrents_delete(torrent_hashes="all")
+    if keep:
+        await sync_to_async(aria2.remove_all, True)
+        await sync_to_async(clean_download_dir, keep)
+        await makedirs(DOWNLOAD_DIR, exist_ok=True)
+        return
     try:
         await aiormtree(DOWNLOAD_DIR)
     except:
@@ -67,9 +180,12 @@ async def start_cleanup():
     await makedirs(DOWNLOAD_DIR)
 
 
-def clean_all():
+def clean_all(keep=()):
     aria2.remove_all(True)
     get_client().torrents_delete(torrent_hashes="all")
+    if keep:
+        clean_download_dir(keep)
+        return
     try:
         rmtree(DOWNLOAD_DIR)
     except:
@@ -80,6 +196,7 @@ def exit_clean_up(signal, frame):
     try:
         LOGGER.info(
             "Please wait, while we clean up and stop the running downloads")
+        sa_ledger.flush()
         clean_all()
         srun(['pkill', '-9', '-f', 'gunicorn|aria2c|qbittorrent-nox|ffmpeg'])
         sexit(0)
@@ -88,40 +205,35 @@ def exit_clean_up(signal, frame):
         sexit(1)
 
 
+def clean_tree(tree):
+    for dirpath, filee, _ in tree.files:
+        if filee.endswith(".!qB") or filee.endswith('.parts') and filee.startswith('.'):
+            osremove(ospath.join(dirpath, filee))
+    for dirpath in reversed(tree.dirs):
+        if not ospath.isdir(dirpath):
+            continue
+        if dirpath.endswith((".unwanted", "splited_files_mltb", "copied_mltb")):
+            rmtree(dirpath)
+        elif not oslistdir(dirpath):
+            osrmdir(dirpath)
+
+
 async def clean_unwanted(path):
     LOGGER.info(f"Cleaning unwanted files/folders: {path}")
-    for dirpath, _, files in await sync_to_async(walk, path, topdown=False):
-        for filee in files:
-            if filee.endswith(".!qB") or filee.endswith('.parts') and filee.startswith('.'):
-                await aioremove(ospath.join(dirpath, filee))
-        if dirpath.endswith((".unwanted", "splited_files_mltb", "copied_mltb")):
-            await aiormtree(dirpath)
-    for dirpath, _, files in await sync_to_async(walk, path, topdown=False):
-        if not await listdir(dirpath):
-            await rmdir(dirpath)
+    tree = await get_tree(path, False)
+    invalidate_tree(path)
+    await sync_to_async(clean_tree, tree)
 
 
 async def get_path_size(path):
     if await aiopath.isfile(path):
         return await aiopath.getsize(path)
-    total_size = 0
-    for root, dirs, files in await sync_to_async(walk, path):
-        for f in files:
-            abs_path = ospath.join(root, f)
-            total_size += await aiopath.getsize(abs_path)
-    return total_size
+    return (await get_tree(path, False)).size
 
 
 async def count_files_and_folders(path):
-    total_files = 0
-    total_folders = 0
-    for _, dirs, files in await sync_to_async(walk, path):
-        total_files += len(files)
-        for f in files:
-            if f.endswith(tuple(GLOBAL_EXTENSION_FILTER)):
-                total_files -= 1
-        total_folders += len(dirs)
-    return total_folders, total_files
+    tree = await get_tree(path)
+    return tree.folders, len(tree.files) - tree.filtered
 
 
 def get_base_name(orig_path):
@@ -135,40 +247,143 @@ def get_base_name(orig_path):
             'File format not supported for extraction')
 
 
+class MimeDetector:
+    def __init__(self):
+        self.__magics = SimpleQueue()
+        self.__cache = OrderedDict()
+        self.__lock = Lock()
+
+    def __from_file(self, file_path):
+        try:
+            mime = self.__magics.get_nowait()
+        except Empty:
+            mime = Magic(mime=True)
+        try:
+            return mime.from_file(file_path)
+        finally:
+            self.__magics.put(mime)
+
+    def detect(self, file_path):
+        st = stat(file_path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.__lock:
+            if (mime_type := self.__cache.get(key)) is not None:
+                self.__cache.move_to_end(key)
+                return mime_type
+        mime_type = self.__from_file(file_path) or "text/plain"
+        if mime_type == 'application/octet-stream':
+            # libmagic could not tell, fall back to the extension
+            mime_type = MIME_EXTENSIONS.get(ospath.splitext(file_path)[1].lower(), mime_type)
+        with self.__lock:
+            self.__cache[key] = mime_type
+            while len(self.__cache) > MIME_CACHE_SIZE:
+                self.__cache.popitem(last=False)
+        return mime_type
+
+
+mime_detector = MimeDetector()
+
+
 def get_mime_type(file_path):
-    mime = Magic(mime=True)
-    mime_type = mime.from_file(file_path)
-    mime_type = mime_type or "text/plain"
-    return mime_type
+    return mime_detector.detect(file_path)
 
 
-def check_storage_threshold(size, threshold, arch=False, alloc=False):
-    free = disk_usage(DOWNLOAD_DIR).free
-    if not alloc:
-        if (not arch and free - size < threshold or arch and free - (size * 2) < threshold):
-            return False
-    elif not arch:
-        if free < threshold:
+def disk_used(path):
+    used = 0
+    stack = [path]
+    while stack:
+        try:
+            with scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        used += entry.stat(follow_symlinks=False).st_blocks * 512
+        except OSError:
+            continue
+    return used
+
+
+def sample_storage():
+    # walks the task dirs in the background, so admission only does arithmetic under storage_lock
+    for uid in list(storage_reservations):
+        storage_written[uid] = disk_used(f'{DOWNLOAD_DIR}{uid}') + disk_used(f'{DOWNLOAD_DIR}{uid}10000')
+    for uid in list(storage_written):
+        if uid not in storage_reservations:
+            storage_written.pop(uid, None)
+
+
+async def update_storage():
+    if storage_reservations or storage_written:
+        await sync_to_async(sample_storage)
+
+
+def start_storage_sampler():
+    global storage_sampler
+    if storage_sampler is None:
+        storage_sampler = setInterval(STORAGE_SAMPLE_INTERVAL, update_storage)
+
+
+def outstanding_storage():
+    # reserved peak footprint of every task minus what it had written at the last sample,
+    # a stale sample only overestimates what is still to come
+    return sum(max(sum(stages.values()) - storage_written.get(uid, 0), 0)
+               for uid, stages in list(storage_reservations.items()))
+
+
+def reserve_storage(uid, stages, threshold=None):
+    with storage_lock:
+        storage_reservations[uid] = stages
+        if threshold is not None and disk_usage(DOWNLOAD_DIR).free - outstanding_storage() < threshold:
+            del storage_reservations[uid]
             return False
-    elif free - size < threshold:
-        return False
     return True
 
 
+def release_storage(uid, stage=None):
+    if stage is None:
+        storage_reservations.pop(uid, None)
+        storage_written.pop(uid, None)
+    elif (stages := storage_reservations.get(uid)) is not None:
+        stages.pop(stage, None)
+
+
+def shrink_storage(uid, stage, size):
+    if (stages := storage_reservations.get(uid)) is not None and stage in stages:
+        stages[stage] = max(stages[stage] - size, 0)
+
+
+def join_parts(path, final_name, parts):
+    with open(ospath.join(path, final_name), 'wb', buffering=0) as dest:
+        for part in parts:
+            with open(ospath.join(path, part), 'rb', buffering=0) as src:
+                remaining = fstat(src.fileno()).st_size
+                try:
+                    while remaining > 0:
+                        if (copied := copy_file_range(src.fileno(), dest.fileno(), remaining)) == 0:
+                            break
+                        remaining -= copied
+                except OSError:
+                    # filesystem without copy_file_range support
+                    src.seek(-remaining, SEEK_END)
+                    copyfileobj(src, dest, JOIN_BUFFER_SIZE)
+
+
 async def join_files(path):
     files = await listdir(path)
     results = []
     for file_ in files:
         if re_search(r"\.0+2$", file_) and await sync_to_async(get_mime_type, f'{path}/{file_}') == 'application/octet-stream':
             final_name = file_.rsplit('.', 1)[0]
-            cmd = f'cat {path}/{final_name}.* > {path}/{final_name}'
-            _, stderr, code = await cmd_exec(cmd, True)
-            if code != 0:
-                LOGGER.error(f'Failed to join {final_name}, stderr: {stderr}')
+            parts = sorted(f for f in files if f.startswith(f'{final_name}.') and f[len(final_name) + 1:].isdigit())
+            try:
+                await sync_to_async(join_parts, path, final_name, parts)
+            except OSError as e:
+                LOGGER.error(f'Failed to join {final_name}, error: {e}')
             else:
-                results.append(final_name)
+                results.append(parts)
     if results:
-        for res in results:
-            for file_ in files:
-                if re_search(fr"{res}\.0[0-9]+$", file_):
-                    await aioremove(f'{path}/{file_}')
+        invalidate_tree(path)
+        for parts in results:
+            for file_ in parts:
+                await aioremove(f'{path}/{file_}')
@@ -244,6 +244,10 @@ default_desp = {'AS_DOCUMENT': 'Default type of Telegram file upload. Default is
                 'MEDIA_GROUP': 'View Uploaded splitted file parts in media group. Default is False.',
                 'MEGA_EMAIL': 'E-Mail used to sign-in on mega.nz for using premium account. Str',
                 'MEGA_PASSWORD': 'Password for mega.nz account. Str',
+                'MEGA_TRANSFER_SLOTS': 'Number of parallel Mega transfers sharing the logged-in Mega session. Empty means no limit. Int',
+                'DOWNLOAD_BANDWIDTH_LIMIT': 'Global download bandwidth in MB/s shared by aria2, qBittorrent, rclone, Google Drive and Telegram tasks. Empty means no limit. Float',
+                'UPLOAD_BANDWIDTH_LIMIT': 'Global upload bandwidth in MB/s shared by Telegram, Google Drive, rclone uploads and seeding. Empty means no limit. Float',
+                'USER_BANDWIDTH_SHARE': 'Maximum percentage of the global bandwidth limits a single user can take. Unused bandwidth is given to other users. Int',
                 'OWNER_ID': 'The Telegram User ID (not username) of the Owner of the bot.',
                 'QUEUE_ALL': 'Number of parallel tasks of downloads and uploads. For example if 20 task added and QUEUE_ALL is 8, then the summation of uploading and downloading tasks are 8 and the rest in queue. Int. NOTE: if you want to fill QUEUE_DOWNLOAD or QUEUE_UPLOAD, then QUEUE_ALL value must be greater than or equal to the greatest one and less than or equal to summation of QUEUE_UPLOAD and QUEUE_DOWNLOAD',
                 'QUEUE_DOWNLOAD': 'Number of all parallel downloading tasks. Int',
@@ -261,6 +265,7 @@ default_desp = {'AS_DOCUMENT': 'Default type of Telegram file upload. Default is
                 'SEARCH_PLUGINS': 'List of qBittorrent search plugins (github raw links). I have added some plugins, you can remove/add plugins as you want.',
                 'STATUS_LIMIT': 'Limit the no. of tasks shown in status message with buttons. Default is 10. NOTE: Recommended limit is 4 tasks.',
                 'STATUS_UPDATE_INTERVAL': 'Time in seconds after which the progress/status message will be updated. Recommended 10 seconds at least.',
+                'CONTENT_DEDUP': 'Identify every file by content before upload (MD5 for Drive, sampled fingerprint for Telegram) and server-side copy (Drive) or resend (Telegram) files that were already uploaded, instead of uploading them again. Default is False',
                 'STOP_DUPLICATE': "Bot will check file/folder name in Drive incase uploading to GDRIVE_ID. If it's present in Drive then downloading or cloning will be stopped. (NOTE: Item will be checked using name and not hash, so this feature is not perfect yet). Default is False",
                 'SUDO_USERS': 'Fill user_id of users whom you want to give sudo permission. Separate them by space. Int',
                 'TELEGRAM_API': 'This is to authenticate your Telegram account for downloading Telegram files. You can get this from https://my.telegram.org.',
@@ -1,8 +1,12 @@
 import hashlib
 from re import sub as re_sub
 from shlex import split as ssplit
-from os import path as ospath
-from aiofiles.os import remove as aioremove, path as aiopath, mkdir
+from os import path as ospath, utime, open as osopen, close as osclose, preadv, O_RDONLY, SEEK_SET, SEEK_CUR, SEEK_END
+from io import RawIOBase
+from json import loads
+from collections import OrderedDict
+from aiofiles.os import remove as aioremove, path as aiopath, mkdir, makedirs, listdir, rename as aiorename, \
+    stat as aiostat
 from time import time
 from re import search as re_search
 from asyncio import create_subprocess_exec
@@ -13,18 +17,45 @@ from bot.helper.ext_utils.bot_utils import cmd_exec, sync_to_async, get_readable
 from bot.helper.ext_utils.fs_utils import ARCH_EXT, get_mime_type
 from bot.helper.ext_utils.telegraph_helper import telegraph
 
-async def is_multi_streams(path):
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+FINGERPRINT_SAMPLE = 1024 * 1024
+PROBE_CACHE_SIZE = 256
+THUMB_CACHE_DIR = 'Thumbnails/cache'
+THUMB_CACHE_SIZE = 200
+THUMB_SCALE = 320
+
+probe_cache = OrderedDict()
+
+
+async def probe_media(path):
+    try:
+        stat = await aiostat(path)
+    except OSError as e:
+        LOGGER.error(f'Probe Media: {e}. Mostly File not found!')
+        return {}
+    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if (probe := probe_cache.get(key)) is not None:
+        probe_cache.move_to_end(key)
+        return probe
     try:
         result = await cmd_exec(["ffprobe", "-hide_banner", "-loglevel", "error", "-print_format",
-                                 "json", "-show_streams", path])
+                                 "json", "-show_format", "-show_streams", path])
         if res := result[1]:
-            LOGGER.warning(f'Get Video Streams: {res}')
+            LOGGER.warning(f'Probe Media: {res}')
+        probe = loads(result[0])
     except Exception as e:
-        LOGGER.error(f'Get Video Streams: {e}. Mostly File not found!')
-        return False
-    fields = eval(result[0]).get('streams')
+        LOGGER.error(f'Probe Media: {e}. Mostly File not found!')
+        return {}
+    probe_cache[key] = probe
+    while len(probe_cache) > PROBE_CACHE_SIZE:
+        probe_cache.popitem(last=False)
+    return probe
+
+
+async def is_multi_streams(path):
+    fields = (await probe_media(path)).get('streams')
     if fields is None:
-        LOGGER.error(f"get_video_streams: {result}")
+        LOGGER.error(f"get_video_streams: {path}")
         return False
     videos = 0
     audios = 0
@@ -37,17 +68,9 @@ async def is_multi_streams(path):
 
 
 async def get_media_info(path):
-    try:
-        result = await cmd_exec(["ffprobe", "-hide_banner", "-loglevel", "error", "-print_format",
-                                 "json", "-show_format", path])
-        if res := result[1]:
-            LOGGER.warning(f'Get Media Info: {res}')
-    except Exception as e:
-        LOGGER.error(f'Get Media Info: {e}. Mostly File not found!')
-        return 0, None, None
-    fields = eval(result[0]).get('format')
+    fields = (await probe_media(path)).get('format')
     if fields is None:
-        LOGGER.error(f"get_media_info: {result}")
+        LOGGER.error(f"get_media_info: {path}")
         return 0, None, None
     duration = round(float(fields.get('duration', 0)))
     tags = fields.get('tags', {})
@@ -56,6 +79,16 @@ async def get_media_info(path):
     return duration, artist, title
 
 
+async def get_video_dimensions(path):
+    for stream in (await probe_media(path)).get('streams', []):
+        if stream.get('codec_type') == 'video' and stream.get('width') and stream.get('height'):
+            width, height = stream['width'], stream['height']
+            if abs(int(stream.get('tags', {}).get('rotate', 0))) in [90, 270]:
+                width, height = height, width
+            return width, height
+    return 480, 320
+
+
 async def get_document_type(path):
     is_video, is_audio, is_image = False, False, False
     if path.endswith(tuple(ARCH_EXT)) or re_search(r'.+(\.|_)(rar|7z|zip|bin)(\.0*\d+)?$', path):
@@ -67,17 +100,9 @@ async def get_document_type(path):
         return False, False, True
     if not mime_type.startswith('video') and not mime_type.endswith('octet-stream'):
         return is_video, is_audio, is_image
-    try:
-        result = await cmd_exec(["ffprobe", "-hide_banner", "-loglevel", "error", "-print_format",
-                                 "json", "-show_streams", path])
-        if res := result[1]:
-            LOGGER.warning(f'Get Document Type: {res}')
-    except Exception as e:
-        LOGGER.error(f'Get Document Type: {e}. Mostly File not found!')
-        return is_video, is_audio, is_image
-    fields = eval(result[0]).get('streams')
+    fields = (await probe_media(path)).get('streams')
     if fields is None:
-        LOGGER.error(f"get_document_type: {result}")
+        LOGGER.error(f"get_document_type: {path}")
         return is_video, is_audio, is_image
     for stream in fields:
         if stream.get('codec_type') == 'video':
@@ -87,106 +112,260 @@ async def get_document_type(path):
     return is_video, is_audio, is_image
 
 
-async def take_ss(video_file, duration):
-    des_dir = 'Thumbnails'
-    if not await aiopath.exists(des_dir):
-        await mkdir(des_dir)
-    des_dir = ospath.join(des_dir, f"{time()}.jpg")
+class FileSlice(RawIOBase):
+
+    def __init__(self, path, offset, length, name):
+        super().__init__()
+        self.name = name
+        self.__fd = osopen(path, O_RDONLY)
+        self.__offset = offset
+        self.__length = length
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_CUR:
+            offset += self.__position
+        elif whence == SEEK_END:
+            offset += self.__length
+        self.__position = min(max(offset, 0), self.__length)
+        return self.__position
+
+    def tell(self):
+        return self.__position
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.__length - self.__position)
+        if size <= 0:
+            return 0
+        size = preadv(self.__fd, [memoryview(buffer)[:size]], self.__offset + self.__position)
+        self.__position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            osclose(self.__fd)
+        super().close()
+
+
+def get_file_fingerprint(path):
+    size = ospath.getsize(path)
+    digest = hashlib.md5(f"{size}:{ospath.basename(path)}".encode())
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(size // 2 - FINGERPRINT_SAMPLE // 2, 0), max(size - FINGERPRINT_SAMPLE, 0)}):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_SAMPLE))
+    return f"fp-{digest.hexdigest()}"
+
+
+async def __prune_thumbs():
+    thumbs = [(await aiopath.getmtime(thumb), thumb) for thumb in
+              [ospath.join(THUMB_CACHE_DIR, name) for name in await listdir(THUMB_CACHE_DIR)]]
+    for _, thumb in sorted(thumbs)[:-THUMB_CACHE_SIZE]:
+        try:
+            await aioremove(thumb)
+        except OSError:
+            pass
+
+
+async def take_ss(video_file, duration, fingerprint=None):
+    await makedirs(THUMB_CACHE_DIR, exist_ok=True)
+    if fingerprint is None:
+        fingerprint = await sync_to_async(get_file_fingerprint, video_file)
+    des_dir = ospath.join(THUMB_CACHE_DIR, f"{fingerprint}.jpg")
+    if await aiopath.exists(des_dir):
+        await sync_to_async(utime, des_dir)
+        return des_dir
     if duration is None:
         duration = (await get_media_info(video_file))[0]
     if duration == 0:
         duration = 3
     duration = duration // 2
-    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-ss", str(duration),
-           "-i", video_file, "-vf", "thumbnail", "-frames:v", "1", des_dir]
+    tmp_path = f"{des_dir}.{time()}.jpg"
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-skip_frame", "nokey", "-ss", str(duration),
+           "-i", video_file, "-an", "-sn", "-vf", f"scale='min({THUMB_SCALE},iw)':-2", "-frames:v", "1", tmp_path]
     status = await create_subprocess_exec(*cmd, stderr=PIPE)
-    if await status.wait() != 0 or not await aiopath.exists(des_dir):
+    if await status.wait() != 0 or not await aiopath.exists(tmp_path):
         err = (await status.stderr.read()).decode().strip()
         LOGGER.error(
             f'Error while extracting thumbnail. Name: {video_file} stderr: {err}')
         return None
+    await aiorename(tmp_path, des_dir)
+    await __prune_thumbs()
     return des_dir
 
 
-async def split_file(path, size, file_, dirpath, split_size, listener, start_time=0, i=1, inLoop=False, multi_streams=True):
+def __plan_cuts(keyframes, total, split_size):
+    cuts = []
+    start = 0
+    previous = None
+    for time_, offset in keyframes + [(None, total)]:
+        if offset - start > split_size and previous is not None and previous[1] > start:
+            cuts.append(previous[0])
+            start = previous[1]
+        previous = (time_, offset)
+    return cuts
+
+
+async def __keyframe_index(path, listener):
+    video_index = next((stream['index'] for stream in (await probe_media(path)).get('streams', [])
+                        if stream.get('codec_type') == 'video'), None)
+    if video_index is None:
+        return None, 0
+    cmd = ["ffprobe", "-hide_banner", "-loglevel", "error", "-show_entries",
+           "packet=stream_index,pts_time,dts_time,size,flags", "-of", "csv=p=0", path]
+    listener.suproc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
+    keyframes = []
+    total = 0
+    async for line in listener.suproc.stdout:
+        fields = line.decode().strip().split(',')
+        if len(fields) < 5 or not fields[3].isdigit():
+            continue
+        stream_index, pts_time, dts_time, size, flags = fields[:5]
+        if int(stream_index) == video_index and 'K' in flags:
+            time_ = pts_time if pts_time != 'N/A' else dts_time
+            if time_ != 'N/A' and float(time_) > 0:
+                keyframes.append((time_, total))
+        total += int(size)
+    code = await listener.suproc.wait()
+    if code == -9:
+        return False, 0
+    elif code != 0:
+        err = (await listener.suproc.stderr.read()).decode().strip()
+        LOGGER.warning(f"Keyframe index: {err}. Path: {path}")
+        return None, 0
+    return keyframes, total
+
+
+async def __split_by_size(path, file_, dirpath, split_size, parts, listener, multi_streams):
+    duration = (await get_media_info(path))[0]
+    base_name, extension = ospath.splitext(file_)
+    start_time, i = 0, 1
+    while i <= parts or start_time < duration - 4:
+        out_path = ospath.join(dirpath, f"{base_name}.part{i:03}{extension}")
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-ss", str(start_time), "-i", path,
+               "-fs", str(split_size), "-map", "0", "-map_chapters", "-1", "-async", "1", "-strict",
+               "-2", "-c", "copy", out_path]
+        if not multi_streams:
+            del cmd[10]
+            del cmd[10]
+        if listener.suproc == 'cancelled' or listener.suproc is not None and listener.suproc.returncode == -9:
+            return False
+        listener.suproc = await create_subprocess_exec(*cmd, stderr=PIPE)
+        code = await listener.suproc.wait()
+        if code == -9:
+            return False
+        elif code != 0:
+            err = (await listener.suproc.stderr.read()).decode().strip()
+            try:
+                await aioremove(out_path)
+            except:
+                pass
+            if multi_streams:
+                LOGGER.warning(
+                    f"{err}. Retrying without map, -map 0 not working in all situations. Path: {path}")
+                multi_streams = False
+                continue
+            LOGGER.warning(
+                f"{err}. Unable to split this video, if it's size less than {MAX_SPLIT_SIZE} will be uploaded as it is. Path: {path}")
+            return "errored"
+        out_size = await aiopath.getsize(out_path)
+        if out_size > MAX_SPLIT_SIZE:
+            split_size -= out_size - MAX_SPLIT_SIZE + 5000000
+            await aioremove(out_path)
+            continue
+        lpd = (await get_media_info(out_path))[0]
+        if lpd == 0:
+            LOGGER.error(
+                f'Something went wrong while splitting, mostly file is corrupted. Path: {path}')
+            break
+        elif duration == lpd:
+            LOGGER.warning(
+                f"This file has been splitted with default stream and audio, so you will only see one part with less size from orginal one because it doesn't have all streams and audios. This happens mostly with MKV videos. Path: {path}")
+            break
+        elif lpd <= 3:
+            await aioremove(out_path)
+            break
+        start_time += lpd - 3
+        i += 1
+    return True
+
+
+async def __remove_parts(dirpath, base_name, extension, count):
+    for i in range(1, count + 1):
+        try:
+            await aioremove(ospath.join(dirpath, f"{base_name}.part{i:03}{extension}"))
+        except:
+            pass
+
+
+async def split_file(path, size, file_, dirpath, split_size, listener):
     if listener.suproc == 'cancelled' or listener.suproc is not None and listener.suproc.returncode == -9:
         return False
-    if listener.seed and not listener.newDir:
-        dirpath = f"{dirpath}/splited_files_mltb"
-        if not await aiopath.exists(dirpath):
-            await mkdir(dirpath)
     user_id = listener.message.from_user.id
     user_dict = user_data.get(user_id, {})
     leech_split_size = user_dict.get(
         'split_size') or config_dict['LEECH_SPLIT_SIZE']
     parts = -(-size // leech_split_size)
-    if (user_dict.get('equal_splits') or config_dict['EQUAL_SPLITS']) and not inLoop:
+    if user_dict.get('equal_splits') or config_dict['EQUAL_SPLITS']:
         split_size = ((size + parts - 1) // parts) + 1000
     if (await get_document_type(path))[0]:
-        if multi_streams:
-            multi_streams = await is_multi_streams(path)
-        duration = (await get_media_info(path))[0]
+        if listener.seed and not listener.newDir:
+            dirpath = f"{dirpath}/splited_files_mltb"
+            if not await aiopath.exists(dirpath):
+                await mkdir(dirpath)
+        multi_streams = await is_multi_streams(path)
+        keyframes, total = await __keyframe_index(path, listener)
+        if keyframes is False:
+            return False
+        # packet sizes exclude container overhead, keep a margin below the hard limit
+        cut_size = split_size - 5000000 - split_size // 100
+        if not keyframes or not (cuts := __plan_cuts(keyframes, total, cut_size)):
+            LOGGER.warning(f"No keyframe index, splitting by size instead. Path: {path}")
+            return await __split_by_size(path, file_, dirpath, split_size - 5000000, parts, listener, multi_streams)
         base_name, extension = ospath.splitext(file_)
-        split_size -= 5000000
-        while i <= parts or start_time < duration - 4:
-            parted_name = f"{base_name}.part{i:03}{extension}"
-            out_path = ospath.join(dirpath, parted_name)
-            cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-ss", str(start_time), "-i", path,
-                   "-fs", str(split_size), "-map", "0", "-map_chapters", "-1", "-async", "1", "-strict",
-                   "-2", "-c", "copy", out_path]
+        out_path = ospath.join(dirpath, f"{base_name.replace('%', '%%')}.part%03d{extension}")
+        while True:
+            cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path, "-map", "0", "-map_chapters", "-1",
+                   "-strict", "-2", "-c", "copy", "-f", "segment", "-segment_times", ",".join(cuts),
+                   "-segment_start_number", "1", "-reset_timestamps", "1", out_path]
             if not multi_streams:
-                del cmd[10]
-                del cmd[10]
+                del cmd[6]
+                del cmd[6]
             if listener.suproc == 'cancelled' or listener.suproc is not None and listener.suproc.returncode == -9:
                 return False
             listener.suproc = await create_subprocess_exec(*cmd, stderr=PIPE)
             code = await listener.suproc.wait()
             if code == -9:
                 return False
-            elif code != 0:
-                err = (await listener.suproc.stderr.read()).decode().strip()
-                try:
-                    await aioremove(out_path)
-                except:
-                    pass
-                if multi_streams:
-                    LOGGER.warning(
-                        f"{err}. Retrying without map, -map 0 not working in all situations. Path: {path}")
-                    return await split_file(path, size, file_, dirpath, split_size, listener, start_time, i, True, False)
-                else:
-                    LOGGER.warning(
-                        f"{err}. Unable to split this video, if it's size less than {MAX_SPLIT_SIZE} will be uploaded as it is. Path: {path}")
-                return "errored"
-            out_size = await aiopath.getsize(out_path)
-            if out_size > MAX_SPLIT_SIZE:
-                dif = out_size - MAX_SPLIT_SIZE
-                split_size -= dif + 5000000
-                await aioremove(out_path)
-                return await split_file(path, size, file_, dirpath, split_size, listener, start_time, i, True, )
-            lpd = (await get_media_info(out_path))[0]
-            if lpd == 0:
-                LOGGER.error(
-                    f'Something went wrong while splitting, mostly file is corrupted. Path: {path}')
+            elif code == 0:
                 break
-            elif duration == lpd:
+            err = (await listener.suproc.stderr.read()).decode().strip()
+            await __remove_parts(dirpath, base_name, extension, len(cuts) + 1)
+            if multi_streams:
                 LOGGER.warning(
-                    f"This file has been splitted with default stream and audio, so you will only see one part with less size from orginal one because it doesn't have all streams and audios. This happens mostly with MKV videos. Path: {path}")
-                break
-            elif lpd <= 3:
-                await aioremove(out_path)
-                break
-            start_time += lpd - 3
-            i += 1
+                    f"{err}. Retrying without map, -map 0 not working in all situations. Path: {path}")
+                multi_streams = False
+                continue
+            LOGGER.warning(
+                f"{err}. Unable to split this video, if it's size less than {MAX_SPLIT_SIZE} will be uploaded as it is. Path: {path}")
+            return "errored"
+        for i in range(1, len(cuts) + 2):
+            part = ospath.join(dirpath, f"{base_name}.part{i:03}{extension}")
+            if await aiopath.exists(part) and await aiopath.getsize(part) > MAX_SPLIT_SIZE:
+                LOGGER.warning(f"Keyframe split produced a part above {get_readable_file_size(MAX_SPLIT_SIZE)}, splitting by size instead. Path: {path}")
+                await __remove_parts(dirpath, base_name, extension, len(cuts) + 1)
+                return await __split_by_size(path, file_, dirpath, split_size - 5000000, parts, listener, multi_streams)
     else:
-        out_path = ospath.join(dirpath, f"{file_}.")
-        listener.suproc = await create_subprocess_exec("split", "--numeric-suffixes=1", "--suffix-length=3",
-                                                       f"--bytes={split_size}", path, out_path, stderr=PIPE)
-        code = await listener.suproc.wait()
-        if code == -9:
-            return False
-        elif code != 0:
-            err = (await listener.suproc.stderr.read()).decode().strip()
-            LOGGER.error(err)
+        listener.virtual_parts[path] = [
+            (f"{file_}.{i + 1:03}", offset, min(split_size, size - offset))
+            for i, offset in enumerate(range(0, size, split_size))]
+        return "virtual"
     return True
 
 async def format_filename(file_, user_id, dirpath=None, isMirror=False):
@@ -284,7 +463,9 @@ async def get_mediainfo_link(up_path):
 
 def get_md5_hash(up_path):
     md5_hash = hashlib.md5()
-    with open(up_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            md5_hash.update(byte_block)
-        return md5_hash.hexdigest()
\ No newline at end of file
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(up_path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            md5_hash.update(view[:size])
+    return md5_hash.hexdigest()
\ No newline at end of file
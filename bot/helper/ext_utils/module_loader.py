@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+from importlib import import_module
+from inspect import iscoroutine
+from sys import modules
+from time import time
+from threading import Lock
+from psutil import Process
+
+from bot import LOGGER
+from bot.helper.ext_utils.bot_utils import sync_to_async, get_readable_file_size
+
+module_costs = {}
+module_lock = Lock()
+process = Process()
+
+
+def load_module(name):
+    path = f'bot.modules.{name}'
+    with module_lock:
+        if name in module_costs:
+            return modules[path]
+        rss, start = process.memory_info().rss, time()
+        module = import_module(path)
+        module_costs[name] = (time() - start, max(process.memory_info().rss - rss, 0))
+    return module
+
+
+def lazy_handler(handler_class, name, func, filters):
+    async def callback(client, update):
+        module = modules[f'bot.modules.{name}'] if name in module_costs else await sync_to_async(load_module, name)
+        if iscoroutine(result := getattr(module, func)(client, update)):
+            await result
+    return handler_class(callback, filters=filters)
+
+
+def log_import_report(deferred):
+    report = ', '.join(f'{name}: {cost * 1000:.0f}ms/{get_readable_file_size(mem)}'
+                       for name, (cost, mem) in sorted(module_costs.items(), key=lambda x: x[1][0], reverse=True))
+    LOGGER.info(f'Module import cost: {report}')
+    if deferred := [name for name in deferred if name not in module_costs]:
+        LOGGER.info(f'Deferred modules: {", ".join(deferred)}')
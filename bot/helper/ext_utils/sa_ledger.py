@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+from json import dump, load
+from os import listdir, path as ospath, replace
+from random import random
+from threading import Lock
+from time import time
+
+from bot import LOGGER
+
+SA_DAILY_QUOTA = 750 * 1024 ** 3
+SA_WINDOW = 24 * 3600
+SA_BUCKET = 3600
+SA_COOLDOWN = 3600
+SA_SAVE_INTERVAL = 60
+
+
+class ServiceAccountLedger:
+
+    def __init__(self, path='sa_ledger.json'):
+        self.__path = path
+        self.__lock = Lock()
+        self.__entries = None
+        self.__accounts = ([], None)
+        self.__last_save = 0
+
+    def accounts(self):
+        stamp = ospath.getmtime('accounts')
+        with self.__lock:
+            if self.__accounts[1] != stamp:
+                self.__accounts = (sorted(listdir('accounts')), stamp)
+            return self.__accounts[0]
+
+    def __load(self):
+        if self.__entries is not None:
+            return
+        self.__entries = {}
+        if ospath.exists(self.__path):
+            try:
+                with open(self.__path) as f:
+                    self.__entries = load(f)
+            except Exception as e:
+                LOGGER.error(f'Failed to load service accounts ledger: {e}')
+
+    def __save(self, force=False):
+        if self.__entries is None or not force and time() - self.__last_save < SA_SAVE_INTERVAL:
+            return
+        self.__last_save = time()
+        try:
+            with open(f'{self.__path}.tmp', 'w') as f:
+                dump(self.__entries, f)
+            replace(f'{self.__path}.tmp', self.__path)
+        except Exception as e:
+            LOGGER.error(f'Failed to save service accounts ledger: {e}')
+
+    def __entry(self, name):
+        self.__load()
+        entry = self.__entries.setdefault(name, {'usage': {}, 'limited': 0, 'hits': 0})
+        oldest = int((time() - SA_WINDOW) // SA_BUCKET)
+        for bucket in [b for b in entry['usage'] if int(b) <= oldest]:
+            del entry['usage'][bucket]
+        return entry
+
+    @staticmethod
+    def __remaining(entry):
+        return SA_DAILY_QUOTA - sum(entry['usage'].values())
+
+    def record(self, name, size):
+        if not size:
+            return
+        with self.__lock:
+            entry = self.__entry(name)
+            bucket = str(int(time() // SA_BUCKET))
+            entry['usage'][bucket] = entry['usage'].get(bucket, 0) + int(size)
+            self.__save()
+
+    def rate_limited(self, name):
+        with self.__lock:
+            entry = self.__entry(name)
+            entry['limited'] = time()
+            entry['hits'] += 1
+            self.__save(True)
+
+    def flush(self):
+        with self.__lock:
+            self.__save(True)
+
+    def pick(self, names, size=0):
+        with self.__lock:
+            now = time()
+            healthy, limited = [], []
+            for name in names:
+                entry = self.__entry(name)
+                remaining = self.__remaining(entry)
+                if now - entry['limited'] < SA_COOLDOWN or remaining < size:
+                    limited.append((entry['limited'], name))
+                else:
+                    healthy.append((remaining, random(), name))
+        if healthy:
+            return max(healthy)[2]
+        LOGGER.warning('All service accounts are rate limited or out of daily quota!')
+        return min(limited)[1]
+
+
+sa_ledger = ServiceAccountLedger()
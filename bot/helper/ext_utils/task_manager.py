@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 from asyncio import Event
+from heapq import heappush, heappop
+from itertools import count
 
-from bot import OWNER_ID, config_dict, queued_dl, queued_up, non_queued_up, non_queued_dl, queue_dict_lock, LOGGER, user_data, download_dict
+from bot import OWNER_ID, config_dict, non_queued_up, non_queued_dl, queue_dict_lock, LOGGER, user_data, download_dict
 from bot.helper.mirror_utils.upload_utils.gdriveTools import GoogleDriveHelper
-from bot.helper.ext_utils.fs_utils import get_base_name, check_storage_threshold
+from bot.helper.ext_utils.fs_utils import get_base_name, reserve_storage, release_storage, storage_reservations
 from bot.helper.ext_utils.bot_utils import get_user_tasks, getdailytasks, sync_to_async, get_telegraph_list, get_readable_file_size, checking_access
 from bot.helper.telegram_helper.message_utils import forcesub, BotPm_check, user_info
 from bot.helper.themes import BotTheme
 
+UNKNOWN_SIZE_BUCKET = (4 * 1024**3).bit_length()
+FAIR_SHARE_UNIT = 1024**3
+
 
 async def stop_duplicate_check(name, listener):
     if (
@@ -34,91 +39,179 @@ async def stop_duplicate_check(name, listener):
     return False, None
 
 
-async def is_queued(uid):
+class TaskQueue:
+    def __init__(self):
+        self.__tasks = {}
+        self.__user_tasks = {}
+        self.__users = []
+        self.__queued_users = set()
+        self.__vtime = {}
+        self.__clock = 0
+        self.__seq = count()
+
+    def __contains__(self, uid):
+        return uid in self.__tasks
+
+    def __len__(self):
+        return len(self.__tasks)
+
+    def __push_user(self, user_id, priority):
+        heappush(self.__users, (priority, self.__vtime[user_id], next(self.__seq), user_id))
+        self.__queued_users.add(user_id)
+
+    def __clean_user(self, user_id):
+        heap = self.__user_tasks.get(user_id)
+        while heap and heap[0][-1] not in self.__tasks:
+            heappop(heap)
+        if heap:
+            return heap
+        self.__user_tasks.pop(user_id, None)
+        if self.__vtime.get(user_id, 0) <= self.__clock:
+            self.__vtime.pop(user_id, None)
+
+    def add(self, uid, user_id, size=0, priority=1):
+        event = Event()
+        bucket = size.bit_length() if size else UNKNOWN_SIZE_BUCKET
+        self.__tasks[uid] = (event, size)
+        heappush(self.__user_tasks.setdefault(user_id, []), (bucket, next(self.__seq), uid))
+        if user_id not in self.__queued_users:
+            self.__vtime[user_id] = max(self.__vtime.get(user_id, 0), self.__clock)
+            self.__push_user(user_id, priority)
+        return event
+
+    def remove(self, uid):
+        if uid in self.__tasks:
+            event, _ = self.__tasks.pop(uid)
+            event.set()
+
+    def pop(self):
+        while self.__users:
+            priority, vtime, _, user_id = heappop(self.__users)
+            self.__queued_users.discard(user_id)
+            if not (heap := self.__clean_user(user_id)):
+                continue
+            _, _, uid = heappop(heap)
+            event, size = self.__tasks.pop(uid)
+            self.__clock = vtime
+            self.__vtime[user_id] = vtime + 1 + size / FAIR_SHARE_UNIT
+            if self.__clean_user(user_id):
+                self.__push_user(user_id, priority)
+            event.set()
+            return uid
+
+
+queued_dl = TaskQueue()
+queued_up = TaskQueue()
+
+
+def get_task_priority(user_id):
+    return 0 if user_id == OWNER_ID or user_id in user_data and user_data[user_id].get('is_sudo') else 1
+
+
+async def is_queued(listener, size=0):
     all_limit = config_dict['QUEUE_ALL']
     dl_limit = config_dict['QUEUE_DOWNLOAD']
     event = None
     added_to_queue = False
+    # tasks that skipped limit_checker still have to show up in the storage ledger
+    if listener.uid not in storage_reservations:
+        await reserve_task_storage(size, listener, False)
     if all_limit or dl_limit:
         async with queue_dict_lock:
             dl = len(non_queued_dl)
             up = len(non_queued_up)
             if (all_limit and dl + up >= all_limit and (not dl_limit or dl >= dl_limit)) or (dl_limit and dl >= dl_limit):
                 added_to_queue = True
-                event = Event()
-                queued_dl[uid] = event
+                user_id = listener.message.from_user.id
+                event = queued_dl.add(listener.uid, user_id, size, get_task_priority(user_id))
     return added_to_queue, event
 
 
-def start_dl_from_queued(uid):
-    queued_dl[uid].set()
-    del queued_dl[uid]
+async def is_queued_up(listener, size=0):
+    up_limit = config_dict['QUEUE_UPLOAD']
+    all_limit = config_dict['QUEUE_ALL']
+    event = None
+    added_to_queue = False
+    async with queue_dict_lock:
+        dl = len(non_queued_dl)
+        up = len(non_queued_up)
+        if (all_limit and dl + up >= all_limit and (not up_limit or up >= up_limit)) or (up_limit and up >= up_limit):
+            added_to_queue = True
+            user_id = listener.message.from_user.id
+            event = queued_up.add(listener.uid, user_id, size, get_task_priority(user_id))
+    return added_to_queue, event
+
 
+def start_dl_from_queued(limit=None):
+    started = 0
+    while queued_dl and (limit is None or started < limit):
+        if queued_dl.pop() is None:
+            break
+        started += 1
+    return started
 
-def start_up_from_queued(uid):
-    queued_up[uid].set()
-    del queued_up[uid]
+
+def start_up_from_queued(limit=None):
+    started = 0
+    while queued_up and (limit is None or started < limit):
+        if queued_up.pop() is None:
+            break
+        started += 1
+    return started
 
 
 async def start_from_queued():
-    if all_limit := config_dict['QUEUE_ALL']:
-        dl_limit = config_dict['QUEUE_DOWNLOAD']
-        up_limit = config_dict['QUEUE_UPLOAD']
-        async with queue_dict_lock:
-            dl = len(non_queued_dl)
-            up = len(non_queued_up)
-            all_ = dl + up
-            if all_ < all_limit:
-                f_tasks = all_limit - all_
-                if queued_up and (not up_limit or up < up_limit):
-                    for index, uid in enumerate(list(queued_up.keys()), start=1):
-                        f_tasks = all_limit - all_
-                        start_up_from_queued(uid)
-                        f_tasks -= 1
-                        if f_tasks == 0 or (up_limit and index >= up_limit - up):
-                            break
-                if queued_dl and (not dl_limit or dl < dl_limit) and f_tasks != 0:
-                    for index, uid in enumerate(list(queued_dl.keys()), start=1):
-                        start_dl_from_queued(uid)
-                        if (dl_limit and index >= dl_limit - dl) or index == f_tasks:
-                            break
-        return
+    dl_limit = config_dict['QUEUE_DOWNLOAD']
+    up_limit = config_dict['QUEUE_UPLOAD']
+    async with queue_dict_lock:
+        dl = len(non_queued_dl)
+        up = len(non_queued_up)
+        if all_limit := config_dict['QUEUE_ALL']:
+            f_tasks = all_limit - dl - up
+            if f_tasks <= 0:
+                return
+            up_slots = min(f_tasks, up_limit - up) if up_limit else f_tasks
+            if up_slots > 0:
+                f_tasks -= start_up_from_queued(up_slots)
+            dl_slots = min(f_tasks, dl_limit - dl) if dl_limit else f_tasks
+            if dl_slots > 0:
+                start_dl_from_queued(dl_slots)
+            return
+        if up_limit:
+            if up < up_limit:
+                start_up_from_queued(up_limit - up)
+        else:
+            start_up_from_queued()
+        if dl_limit:
+            if dl < dl_limit:
+                start_dl_from_queued(dl_limit - dl)
+        else:
+            start_dl_from_queued()
 
-    if up_limit := config_dict['QUEUE_UPLOAD']:
-        async with queue_dict_lock:
-            up = len(non_queued_up)
-            if queued_up and up < up_limit:
-                f_tasks = up_limit - up
-                for index, uid in enumerate(list(queued_up.keys()), start=1):
-                    start_up_from_queued(uid)
-                    if index == f_tasks:
-                        break
-    else:
-        async with queue_dict_lock:
-            if queued_up:
-                for uid in list(queued_up.keys()):
-                    start_up_from_queued(uid)
 
-    if dl_limit := config_dict['QUEUE_DOWNLOAD']:
-        async with queue_dict_lock:
-            dl = len(non_queued_dl)
-            if queued_dl and dl < dl_limit:
-                f_tasks = dl_limit - dl
-                for index, uid in enumerate(list(queued_dl.keys()), start=1):
-                    start_dl_from_queued(uid)
-                    if index == f_tasks:
-                        break
-    else:
-        async with queue_dict_lock:
-            if queued_dl:
-                for uid in list(queued_dl.keys()):
-                    start_dl_from_queued(uid)
+def get_storage_stages(size, listener):
+    stages = {'download': size}
+    if listener.extract or listener.compress:
+        stages['archive'] = size
+    if listener.isLeech and not listener.compress:
+        split_size = user_data.get(listener.message.from_user.id, {}).get('split_size') or config_dict['LEECH_SPLIT_SIZE']
+        if size > split_size:
+            stages['split'] = size
+    return stages
+
+
+async def reserve_task_storage(size, listener, check=True):
+    if not (STORAGE_THRESHOLD := config_dict['STORAGE_THRESHOLD']) or listener.isClone or not size:
+        return True
+    threshold = STORAGE_THRESHOLD * 1024**3 if check else None
+    return await sync_to_async(reserve_storage, listener.uid, get_storage_stages(size, listener), threshold)
 
 
 async def limit_checker(size, listener, isTorrent=False, isMega=False, isDriveLink=False, isYtdlp=False):
     LOGGER.info('Checking Size Limit of file/folder...')
     user_id = listener.message.from_user.id
     if user_id == OWNER_ID or user_id in user_data and user_data[user_id].get('is_sudo'):
+        await reserve_task_storage(size, listener, False)
         return
     limit_exceeded = ''
     if listener.isClone:
@@ -156,12 +249,9 @@ async def limit_checker(size, listener, isTorrent=False, isMega=False, isDriveLi
             if size > limit:
                 limit_exceeded = f'Leech limit is {get_readable_file_size(limit)}'
         
-        if (STORAGE_THRESHOLD := config_dict['STORAGE_THRESHOLD']) and not listener.isClone:
-            arch = any([listener.compress, listener.extract])
-            limit = STORAGE_THRESHOLD * 1024**3
-            acpt = await sync_to_async(check_storage_threshold, size, limit, arch)
-            if not acpt:
-                limit_exceeded = f'You must leave {get_readable_file_size(limit)} free storage.'
+        if not await reserve_task_storage(size, listener):
+            limit = config_dict['STORAGE_THRESHOLD'] * 1024**3
+            limit_exceeded = f'You must leave {get_readable_file_size(limit)} free storage.'
         
         if (PLAYLIST_LIMIT := config_dict['PLAYLIST_LIMIT']):
             limit_exceeded = f'Playlist limit is {PLAYLIST_LIMIT}'
@@ -191,6 +281,7 @@ async def limit_checker(size, listener, isTorrent=False, isMega=False, isDriveLi
                         LOGGER.info(f"User : {user_id} Daily Leech Size : {get_readable_file_size(lsize)}")
 
     if limit_exceeded:
+        release_storage(listener.uid)
         return f"{limit_exceeded}.\nYour File/Folder size is {get_readable_file_size(size)}"
 
 
@@ -54,7 +54,7 @@ class TelegraphHelper:
             await sleep(st.retry_after)
             return await self.edit_page(path, title, content)
 
-    async def edit_telegraph(self, path, telegraph_content):
+    async def edit_telegraph(self, path, telegraph_content, title=None):
         nxt_page = 1
         prev_page = 0
         num_of_path = len(path)
@@ -71,7 +71,7 @@ class TelegraphHelper:
                     nxt_page += 1
             await self.edit_page(
                 path=path[prev_page],
-                title=f"{config_dict['TITLE_NAME']} Torrent Search",
+                title=title or f"{config_dict['TITLE_NAME']} Torrent Search",
                 content=content
             )
         return
@@ -5,19 +5,23 @@ from requests import utils as rutils
 from aiofiles.os import path as aiopath, remove as aioremove, listdir, makedirs
 from os import walk, path as ospath
 from html import escape
+from io import BytesIO
 from aioshutil import move
-from asyncio import create_subprocess_exec, sleep, Event
+from asyncio import create_subprocess_exec, sleep
 from pyrogram.enums import ChatType
 
 from bot import Interval, aria2, DOWNLOAD_DIR, download_dict, download_dict_lock, LOGGER, bot_name, DATABASE_URL, \
-    MAX_SPLIT_SIZE, config_dict, status_reply_dict_lock, user_data, non_queued_up, non_queued_dl, queued_up, \
-    queued_dl, queue_dict_lock, bot, GLOBAL_EXTENSION_FILTER
-from bot.helper.ext_utils.bot_utils import extra_btns, sync_to_async, get_readable_file_size, get_readable_time, is_mega_link, is_gdrive_link
+    MAX_SPLIT_SIZE, config_dict, status_reply_dict_lock, user_data, non_queued_up, non_queued_dl, queue_dict_lock, \
+    bot, GLOBAL_EXTENSION_FILTER
+from bot.helper.ext_utils.bot_utils import extra_btns, sync_to_async, get_readable_file_size, get_readable_time, is_mega_link, is_gdrive_link, \
+    pack_lines
+from bot.helper.ext_utils.telegraph_helper import telegraph
 from bot.helper.ext_utils.fs_utils import get_base_name, get_path_size, clean_download, clean_target, \
-    is_first_archive_split, is_archive, is_archive_split, join_files
+    is_first_archive_split, is_archive, is_archive_split, join_files, get_tree, invalidate_tree, release_storage, \
+    shrink_storage
 from bot.helper.ext_utils.leech_utils import split_file
 from bot.helper.ext_utils.exceptions import NotSupportedExtractionArchive
-from bot.helper.ext_utils.task_manager import start_from_queued
+from bot.helper.ext_utils.task_manager import start_from_queued, is_queued_up, queued_dl, queued_up
 from bot.helper.mirror_utils.status_utils.extract_status import ExtractStatus
 from bot.helper.mirror_utils.status_utils.zip_status import ZipStatus
 from bot.helper.mirror_utils.status_utils.split_status import SplitStatus
@@ -30,10 +34,15 @@ from bot.helper.mirror_utils.upload_utils.gdriveTools import GoogleDriveHelper
 from bot.helper.mirror_utils.upload_utils.pyrogramEngine import TgUploader
 from bot.helper.mirror_utils.upload_utils.ddlEngine import DDLUploader
 from bot.helper.mirror_utils.rclone_utils.transfer import RcloneTransferHelper
-from bot.helper.telegram_helper.message_utils import sendBot, sendMessage, delete_all_messages, delete_links, sendMirrorLog, update_all_messages
+from bot.helper.telegram_helper.message_utils import sendBot, sendMessage, delete_all_messages, delete_links, sendMirrorLog, update_all_messages, \
+    sendFile
 from bot.helper.telegram_helper.button_build import ButtonMaker
 from bot.helper.ext_utils.db_handler import DbManger
-from bot.helper.themes import BotTheme
+from bot.helper.themes import get_theme
+
+LEECH_LIST_MAX_MESSAGES = 4
+
+TELEGRAPH_PAGE_LIMIT = 39000
 
 
 class MirrorLeechListener:
@@ -58,9 +67,11 @@ class MirrorLeechListener:
         self.isSuperGroup = message.chat.type in [ChatType.SUPERGROUP, ChatType.CHANNEL]
         self.isPrivate = message.chat.type == ChatType.BOT
         self.suproc = None
+        self.virtual_parts = {}
         self.sameDir = sameDir
         self.rcFlags = rcFlags
         self.upPath = upPath
+        self.ytQual = None
         self.random_pic = 'IMAGES'
         self.join = join
         self.leechlogmsg = None
@@ -87,7 +98,12 @@ class MirrorLeechListener:
         
     async def onDownloadStart(self):
         if self.isSuperGroup and config_dict['INCOMPLETE_TASK_NOTIFIER'] and DATABASE_URL:
-            await DbManger().add_incomplete_task(self.message.chat.id, self.message.link, self.tag)
+            await DbManger().add_incomplete_task(self.message.chat.id, self.message.link, self.tag, {
+                'mid': self.message.id, 'uid': self.message.from_user.id, 'dir': self.dir, 'isQbit': self.isQbit,
+                'isLeech': self.isLeech, 'isYtdlp': self.isYtdlp, 'qual': self.ytQual,
+                # with DELETE_LINKS the command message is gone by the time it could be replayed
+                'resumable': not (self.isClone or self.sameDir or self.select or self.isYtdlp and not self.ytQual
+                                  or config_dict['DELETE_LINKS'])})
 
     async def onDownloadComplete(self):
         multi_links = False
@@ -252,6 +268,9 @@ class MirrorLeechListener:
             elif not self.seed:
                 await clean_target(dl_path)
 
+        if not self.seed:
+            release_storage(self.uid, 'archive')
+
         if not self.compress and not self.extract:
             up_path = dl_path
 
@@ -264,48 +283,44 @@ class MirrorLeechListener:
                 checked = False
                 LEECH_SPLIT_SIZE = user_dict.get(
                     'split_size', False) or config_dict['LEECH_SPLIT_SIZE']
-                for dirpath, _, files in await sync_to_async(walk, up_dir, topdown=False):
-                    for file_ in files:
+                for dirpath, file_, f_size in (await get_tree(up_dir)).files:
+                    if f_size > LEECH_SPLIT_SIZE:
+                        if not checked:
+                            checked = True
+                            async with download_dict_lock:
+                                download_dict[self.uid] = SplitStatus(
+                                    up_name, size, gid, self)
+                            LOGGER.info(f"Splitting: {up_name}")
                         f_path = ospath.join(dirpath, file_)
-                        f_size = await aiopath.getsize(f_path)
-                        if f_size > LEECH_SPLIT_SIZE:
-                            if not checked:
-                                checked = True
-                                async with download_dict_lock:
-                                    download_dict[self.uid] = SplitStatus(
-                                        up_name, size, gid, self)
-                                LOGGER.info(f"Splitting: {up_name}")
-                            res = await split_file(f_path, f_size, file_, dirpath, LEECH_SPLIT_SIZE, self)
-                            if not res:
+                        invalidate_tree(up_dir)
+                        res = await split_file(f_path, f_size, file_, dirpath, LEECH_SPLIT_SIZE, self)
+                        if not res:
+                            return
+                        if res == "virtual":
+                            # only videos are cut on disk, the rest is split while uploading
+                            shrink_storage(self.uid, 'split', f_size)
+                            continue
+                        if res == "errored":
+                            if f_size <= MAX_SPLIT_SIZE:
+                                continue
+                            try:
+                                await aioremove(f_path)
+                            except:
                                 return
-                            if res == "errored":
-                                if f_size <= MAX_SPLIT_SIZE:
-                                    continue
-                                try:
-                                    await aioremove(f_path)
-                                except:
-                                    return
-                            elif not self.seed or self.newDir:
-                                try:
-                                    await aioremove(f_path)
-                                except:
-                                    return
-                            else:
-                                m_size.append(f_size)
-                                o_files.append(file_)
+                        elif not self.seed or self.newDir:
+                            try:
+                                await aioremove(f_path)
+                            except:
+                                return
+                        else:
+                            m_size.append(f_size)
+                            o_files.append(file_)
+                if not m_size:
+                    release_storage(self.uid, 'split')
 
-        up_limit = config_dict['QUEUE_UPLOAD']
-        all_limit = config_dict['QUEUE_ALL']
-        added_to_queue = False
-        async with queue_dict_lock:
-            dl = len(non_queued_dl)
-            up = len(non_queued_up)
-            if (all_limit and dl + up >= all_limit and (not up_limit or up >= up_limit)) or (up_limit and up >= up_limit):
-                added_to_queue = True
-                LOGGER.info(f"Added to Queue/Upload: {name}")
-                event = Event()
-                queued_up[self.uid] = event
+        added_to_queue, event = await is_queued_up(self, size)
         if added_to_queue:
+            LOGGER.info(f"Added to Queue/Upload: {name}")
             async with download_dict_lock:
                 download_dict[self.uid] = QueueStatus(
                     name, size, gid, self, 'Up')
@@ -356,65 +371,81 @@ class MirrorLeechListener:
             await update_all_messages()
             await RCTransfer.upload(up_path, size)
 
+    async def __publish_file_list(self, name, lines):
+        pages = pack_lines([line.replace('\n', '<br>') for line in lines], TELEGRAPH_PAGE_LIMIT)
+        title = f"{config_dict['TITLE_NAME']} Leech: {name}"[:256]
+        try:
+            path = [(await telegraph.create_page(title=title, content=page))['path'] for page in pages]
+            if len(path) > 1:
+                await telegraph.edit_telegraph(path, pages, title)
+            return f'https://telegra.ph/{path[0]}'
+        except Exception as e:
+            LOGGER.error(f'Unable to publish leech file list on Telegraph: {e}')
+            return None
+
     async def onUploadComplete(self, link, size, files, folders, mime_type, name, rclonePath=''):
+        release_storage(self.uid)
         if self.isSuperGroup and config_dict['INCOMPLETE_TASK_NOTIFIER'] and DATABASE_URL:
             await DbManger().rm_complete_task(self.message.link)
         user_id = self.message.from_user.id
         user_dict = user_data.get(user_id, {})
-        msg = BotTheme('NAME', Name=escape(name))
-        msg += BotTheme('SIZE', Size=get_readable_file_size(size))
-        msg += BotTheme('ELAPSE', Time=get_readable_time(time() - self.message.date.timestamp()))
-        msg += BotTheme('MODE', Mode=self.upload_details['mode'])
+        theme = get_theme()
+        msg = theme.render(('NAME', {'Name': escape(name)}),
+                           ('SIZE', {'Size': get_readable_file_size(size)}),
+                           ('ELAPSE', {'Time': get_readable_time(time() - self.message.date.timestamp())}),
+                           ('MODE', {'Mode': self.upload_details['mode']}))
         LOGGER.info(f'Task Done: {name}')
         buttons = ButtonMaker()
         if self.isLeech:
-            msg += BotTheme('L_TOTAL_FILES', Files=folders)
+            msg += theme('L_TOTAL_FILES', Files=folders)
             if mime_type != 0:
-                msg += BotTheme('L_CORRUPTED_FILES', Corrupt=mime_type)
-            msg += BotTheme('L_CC', Tag=self.tag)
+                msg += theme('L_CORRUPTED_FILES', Corrupt=mime_type)
+            msg += theme('L_CC', Tag=self.tag)
             if not files:
                 if self.isPrivate:
-                    msg += BotTheme('PM_BOT_MSG')
+                    msg += theme('PM_BOT_MSG')
                 await sendMessage(self.message, msg, photo=self.random_pic)
             else:
                 toPM = False
                 if config_dict['BOT_PM'] or user_dict.get('bot_pm'):
-                    await sendBot(self.message, msg + BotTheme('PM_BOT_MSG'), photo=self.random_pic)
+                    await sendBot(self.message, msg + theme('PM_BOT_MSG'), photo=self.random_pic)
                     if self.isSuperGroup:
                         btn = ButtonMaker()
                         if self.source_url and config_dict['SOURCE_LINK']:
-                            buttons.ubutton(BotTheme('SOURCE_URL'), self.source_url)
-                            btn.ubutton(BotTheme('SOURCE_URL'), self.source_url)
-                        btn.ubutton(BotTheme('CHECK_PM'), f"https://t.me/{bot_name}", 'header')
+                            buttons.ubutton(theme('SOURCE_URL'), self.source_url)
+                            btn.ubutton(theme('SOURCE_URL'), self.source_url)
+                        btn.ubutton(theme('CHECK_PM'), f"https://t.me/{bot_name}", 'header')
                         btn = extra_btns(btn)
                         toPM = True
-                        await sendMessage(self.message, msg + BotTheme('L_BOT_MSG'), btn.build_menu(2), self.random_pic)
-                msg += BotTheme('L_LL_MSG')
+                        await sendMessage(self.message, msg + theme('L_BOT_MSG'), btn.build_menu(2), self.random_pic)
+                msg += theme('L_LL_MSG')
                 if self.leechlogmsg:
                     self.leechlogmsg._client = bot
-                fmsg = '\n\n'
-                for index, (link, name) in enumerate(files.items(), start=1):
-                    fmsg += f"{index}. <a href='{link}'>{name}</a>\n"
-                    limit = 4000 if not config_dict['IMAGES'] else 1000
-                    if len(fmsg.encode() + msg.encode()) > limit:
-                        if config_dict['SAVE_MSG']:
-                            buttons.ibutton(BotTheme('SAVE_MSG'), 'save', 'footer')
-                        if self.source_url and config_dict['SOURCE_LINK']:
-                            buttons.ubutton(BotTheme('SOURCE_URL'), self.source_url)
-                        if self.leechlogmsg or not toPM:
-                            log_msg = await sendMessage(self.leechlogmsg if self.leechlogmsg else self.message, msg + fmsg, buttons.build_menu(1), self.random_pic)
-                        await sleep(1)
-                        fmsg = '\n\n'
-                if fmsg != '\n\n':
-                    if config_dict['SAVE_MSG']:
-                        buttons.ibutton(BotTheme('SAVE_MSG'), 'save', 'footer')
-                    if self.source_url and config_dict['SOURCE_LINK']:
-                        buttons.ubutton(BotTheme('SOURCE_URL'), self.source_url)
-                    if self.leechlogmsg or not toPM:
-                        log_msg = await sendMessage(self.leechlogmsg if self.leechlogmsg else self.message, msg + fmsg, buttons.build_menu(1), self.random_pic)
+                if config_dict['SAVE_MSG']:
+                    buttons.ibutton(theme('SAVE_MSG'), 'save', 'footer')
+                if self.source_url and config_dict['SOURCE_LINK']:
+                    buttons.ubutton(theme('SOURCE_URL'), self.source_url)
+                limit = 4000 if not config_dict['IMAGES'] else 1000
+                lines = [f"{index}. <a href='{link}'>{name}</a>\n" for index, (link, name) in enumerate(files.items(), start=1)]
+                chunks = pack_lines(lines, limit, len(msg.encode()) + 2)
+                list_file = None
+                if len(chunks) > LEECH_LIST_MAX_MESSAGES:
+                    if list_url := await self.__publish_file_list(name, lines):
+                        buttons.ubutton('🔎 VIEW', list_url, 'header')
+                    else:
+                        list_file = BytesIO(''.join(f'{index}. {name}\n{link}\n' for index, (link, name) in enumerate(files.items(), start=1)).encode())
+                        list_file.name = 'leech_files.txt'
+                    chunks = ['']
+                button = buttons.build_menu(1)
+                if self.leechlogmsg or not toPM:
+                    if list_file is not None:
+                        await sendFile(self.leechlogmsg if self.leechlogmsg else self.message, list_file)
+                    for chunk in chunks:
+                        log_msg = await sendMessage(self.leechlogmsg if self.leechlogmsg else self.message,
+                                                    f'{msg}\n\n{chunk}' if chunk else msg, button, self.random_pic)
                 if self.leechlogmsg and not (config_dict['BOT_PM'] or user_dict.get('bot_pm')):
                     buttons = ButtonMaker()
-                    buttons.ubutton(BotTheme('CHECK_LL'), log_msg.link)
+                    buttons.ubutton(theme('CHECK_LL'), log_msg.link)
                     await sendMessage(self.message, msg, buttons.build_menu(1), self.random_pic)
             if self.seed:
                 if self.newDir:
@@ -426,66 +457,66 @@ class MirrorLeechListener:
                 return
         else:
             is_DDL = 'gofile' in link or 'streamsb' in link
-            msg += BotTheme('M_TYPE', Mimetype=mime_type)
+            msg += theme('M_TYPE', Mimetype=mime_type)
             if mime_type == "Folder":
                 if not is_DDL:
-                    msg += BotTheme('M_SUBFOLD', Folder=folders)
-                    msg += BotTheme('TOTAL_FILES', Files=files)
+                    msg += theme('M_SUBFOLD', Folder=folders)
+                    msg += theme('TOTAL_FILES', Files=files)
             if link or rclonePath and config_dict['RCLONE_SERVE_URL']:
 
                 if is_DDL:
-                    buttons.ubutton(BotTheme('DDL_LINK', Serv='GoFile'), link)
+                    buttons.ubutton(theme('DDL_LINK', Serv='GoFile'), link)
                 elif link:
                     if not config_dict['DISABLE_DRIVE_LINK']:
-                        buttons.ubutton(BotTheme('CLOUD_LINK'), link)
+                        buttons.ubutton(theme('CLOUD_LINK'), link)
                 else:
-                    msg += BotTheme('RCPATH', RCpath=rclonePath)
+                    msg += theme('RCPATH', RCpath=rclonePath)
                 if rclonePath and (RCLONE_SERVE_URL := config_dict['RCLONE_SERVE_URL']):
                     remote, path = rclonePath.split(':', 1)
                     url_path = rutils.quote(f'{path}')
                     share_url = f'{RCLONE_SERVE_URL}/{remote}/{url_path}'
                     if mime_type == "Folder":
                         share_url += '/'
-                    buttons.ubutton(BotTheme('RCLONE_LINK'), share_url)
+                    buttons.ubutton(theme('RCLONE_LINK'), share_url)
                 elif (INDEX_URL := config_dict['INDEX_URL']) and not rclonePath and not is_DDL:
                     url_path = rutils.quote(f'{name}')
                     share_url = f'{INDEX_URL}/{url_path}'
                     if mime_type == "Folder":
                         share_url += '/'
-                        buttons.ubutton(BotTheme('INDEX_LINK'), share_url)
+                        buttons.ubutton(theme('INDEX_LINK'), share_url)
                     else:
-                        buttons.ubutton(BotTheme('INDEX_LINK'), share_url)
+                        buttons.ubutton(theme('INDEX_LINK'), share_url)
                         if mime_type.startswith(('image', 'video', 'audio')):
                             share_urls = f'{INDEX_URL}/{url_path}?a=view'
-                            buttons.ubutton(BotTheme('VIEW_LINK'), share_urls)
+                            buttons.ubutton(theme('VIEW_LINK'), share_urls)
 
                 buttons = extra_btns(buttons)
                 button = buttons.build_menu(2)
             else:
-                msg += BotTheme('RCPATH', RCpath=rclonePath)
+                msg += theme('RCPATH', RCpath=rclonePath)
                 button = None
-            msg += BotTheme('M_CC', Tag=self.tag)
+            msg += theme('M_CC', Tag=self.tag)
 
 
             if config_dict['BOT_PM'] or user_dict.get('bot_pm'):
                 await sendBot(self.message, msg, button, self.random_pic)
-                nmsg = msg + BotTheme('M_BOT_MSG')
+                nmsg = msg + theme('M_BOT_MSG')
                 if button is not None:
                     if config_dict['SAVE_MSG']:
-                        buttons.ibutton(BotTheme('SAVE_MSG'), 'save', 'footer')
+                        buttons.ibutton(theme('SAVE_MSG'), 'save', 'footer')
                     button = buttons.build_menu(2)
                 btns = ButtonMaker()
                 btns = extra_btns(btns)
                 if self.source_url and config_dict['SOURCE_LINK']:
-                    btns.ubutton(BotTheme('SOURCE_URL'), self.source_url)
-                btns.ubutton(BotTheme('CHECK_PM'), f"https://t.me/{bot_name}", 'header')
+                    btns.ubutton(theme('SOURCE_URL'), self.source_url)
+                btns.ubutton(theme('CHECK_PM'), f"https://t.me/{bot_name}", 'header')
                 await sendMessage(self.message, nmsg, btns.build_menu(1), self.random_pic)
             else:
                 if config_dict['SAVE_MSG']:
                     if button is not None:
                         if self.source_url and config_dict['SOURCE_LINK']:
-                            buttons.ubutton(BotTheme('SOURCE_URL'), self.source_url)
-                        buttons.ibutton(BotTheme('SAVE_MSG'), 'save', 'footer')
+                            buttons.ubutton(theme('SOURCE_URL'), self.source_url)
+                        buttons.ibutton(theme('SAVE_MSG'), 'save', 'footer')
                         button = buttons.build_menu(2)
                 await sendMessage(self.message, msg, button, self.random_pic)
 
@@ -521,6 +552,7 @@ class MirrorLeechListener:
         await delete_links(self.message)
 
     async def onDownloadError(self, error, button=None):
+        release_storage(self.uid)
         async with download_dict_lock:
             if self.uid in download_dict.keys():
                 del download_dict[self.uid]
@@ -539,12 +571,8 @@ class MirrorLeechListener:
             await DbManger().rm_complete_task(self.message.link)
 
         async with queue_dict_lock:
-            if self.uid in queued_dl:
-                queued_dl[self.uid].set()
-                del queued_dl[self.uid]
-            if self.uid in queued_up:
-                queued_up[self.uid].set()
-                del queued_up[self.uid]
+            queued_dl.remove(self.uid)
+            queued_up.remove(self.uid)
             if self.uid in non_queued_dl:
                 non_queued_dl.remove(self.uid)
             if self.uid in non_queued_up:
@@ -557,6 +585,7 @@ class MirrorLeechListener:
             await clean_download(self.newDir)
 
     async def onUploadError(self, error):
+        release_storage(self.uid)
         async with download_dict_lock:
             if self.uid in download_dict.keys():
                 del download_dict[self.uid]
@@ -571,12 +600,8 @@ class MirrorLeechListener:
             await DbManger().rm_complete_task(self.message.link)
 
         async with queue_dict_lock:
-            if self.uid in queued_dl:
-                queued_dl[self.uid].set()
-                del queued_dl[self.uid]
-            if self.uid in queued_up:
-                queued_up[self.uid].set()
-                del queued_up[self.uid]
+            queued_dl.remove(self.uid)
+            queued_up.remove(self.uid)
             if self.uid in non_queued_dl:
                 non_queued_dl.remove(self.uid)
             if self.uid in non_queued_up:
@@ -1,75 +1,180 @@
 #!/usr/bin/env python3
 from random import SystemRandom
 from string import ascii_letters, digits
+from collections import OrderedDict
+from time import time
 from aiofiles.os import makedirs
-from asyncio import Event
-from mega import MegaApi, MegaListener, MegaRequest, MegaTransfer, MegaError
+from asyncio import Event, Lock, Semaphore
+from mega import MegaApi, MegaRequestListener, MegaTransferListener, MegaRequest, MegaTransfer, MegaError
 
-from bot import LOGGER, config_dict, download_dict_lock, download_dict, non_queued_dl, queue_dict_lock
+from bot import LOGGER, config_dict, download_dict_lock, download_dict, non_queued_dl, queue_dict_lock, bot_loop
 from bot.helper.telegram_helper.message_utils import sendMessage, sendStatusMessage
-from bot.helper.ext_utils.bot_utils import get_mega_link_type, async_to_sync, sync_to_async
+from bot.helper.ext_utils.bot_utils import get_mega_link_type, sync_to_async
 from bot.helper.mirror_utils.status_utils.mega_download_status import MegaDownloadStatus
 from bot.helper.mirror_utils.status_utils.queue_status import QueueStatus
 from bot.helper.ext_utils.task_manager import is_queued, limit_checker, stop_duplicate_check
 
+FOLDER_CACHE_TTL = 1800
+FOLDER_CACHE_SIZE = 20
 
-class MegaAppListener(MegaListener):
-    _NO_EVENT_ON = (MegaRequest.TYPE_LOGIN, MegaRequest.TYPE_FETCH_NODES)
-    NO_ERROR = "no error"
 
-    def __init__(self, continue_event: Event, listener):
-        self.continue_event = continue_event
-        self.node = None
-        self.public_node = None
-        self.listener = listener
-        self.is_cancelled = False
+class MegaRequestHandler(MegaRequestListener):
+
+    def __init__(self):
+        self.event = Event()
+        self.wait_type = None
         self.error = None
-        self.__bytes_transferred = 0
-        self.__speed = 0
-        self.__name = ''
+        self.public_node = None
+        self.node = None
         super().__init__()
 
-    @property
-    def speed(self):
-        return self.__speed
-
-    @property
-    def downloaded_bytes(self):
-        return self.__bytes_transferred
+    def prepare(self, request_type):
+        self.event.clear()
+        self.wait_type = request_type
+        self.error = None
+        self.public_node = None
+        self.node = None
 
     def onRequestFinish(self, api, request, error):
+        request_type = request.getType()
+        if request_type != self.wait_type:
+            return
         if str(error).lower() != "no error":
             self.error = error.copy()
             LOGGER.error(f'Mega onRequestFinishError: {self.error}')
-            self.continue_event.set()
-            return
-        request_type = request.getType()
-        if request_type == MegaRequest.TYPE_LOGIN:
-            api.fetchNodes()
         elif request_type == MegaRequest.TYPE_GET_PUBLIC_NODE:
             self.public_node = request.getPublicMegaNode()
-            self.__name = self.public_node.getName()
         elif request_type == MegaRequest.TYPE_FETCH_NODES:
-            LOGGER.info("Fetching Root Node.")
             self.node = api.getRootNode()
-            self.__name = self.node.getName()
-            LOGGER.info(f"Node Name: {self.node.getName()}")
-        if request_type not in self._NO_EVENT_ON or self.node and "cloud drive" not in self.__name.lower():
-            self.continue_event.set()
+        bot_loop.call_soon_threadsafe(self.event.set)
 
     def onRequestTemporaryError(self, api, request, error: MegaError):
         LOGGER.error(f'Mega Request error in {error}')
-        if not self.is_cancelled:
-            self.is_cancelled = True
-            async_to_sync(self.listener.onDownloadError,
-                          f"RequestTempError: {error.toString()}")
+        if request.getType() != self.wait_type:
+            return
         self.error = error.toString()
-        self.continue_event.set()
+        bot_loop.call_soon_threadsafe(self.event.set)
+
+
+class MegaSession:
+
+    def __init__(self):
+        self.api = MegaApi(None, None, None, 'WZML-X')
+        self.__handler = MegaRequestHandler()
+        self.api.addRequestListener(self.__handler)
+        self.__lock = Lock()
+        self.root = None
+
+    async def request(self, request_type, function, *args):
+        async with self.__lock:
+            self.__handler.prepare(request_type)
+            await sync_to_async(function, *args)
+            await self.__handler.event.wait()
+            return self.__handler.error, self.__handler.public_node or self.__handler.node
+
+    async def login(self, email, password):
+        error, _ = await self.request(MegaRequest.TYPE_LOGIN, self.api.login, email, password)
+        if error is None:
+            error, self.root = await self.request(MegaRequest.TYPE_FETCH_NODES, self.api.fetchNodes)
+        return error
+
+    async def login_to_folder(self, link):
+        error, _ = await self.request(MegaRequest.TYPE_LOGIN, self.api.loginToFolder, link)
+        if error is None:
+            error, self.root = await self.request(MegaRequest.TYPE_FETCH_NODES, self.api.fetchNodes)
+        return error
+
+    async def logout(self):
+        try:
+            await self.request(MegaRequest.TYPE_LOGOUT, self.api.logout)
+        except Exception as e:
+            LOGGER.error(f'Mega logout error: {e}')
+
+
+class MegaSessionPool:
+
+    def __init__(self):
+        self.__account = None
+        self.__credentials = None
+        self.__folders = OrderedDict()
+        self.__lock = Lock()
+        self.__slots = None
+        self.__slots_count = None
+
+    async def account(self):
+        credentials = (config_dict['MEGA_EMAIL'], config_dict['MEGA_PASSWORD'])
+        async with self.__lock:
+            if self.__account is not None and self.__credentials == credentials:
+                if not all(credentials) or await sync_to_async(self.__account.api.isLoggedIn):
+                    return self.__account, None
+            if self.__account is not None:
+                await self.__account.logout()
+                self.__account = None
+            session = MegaSession()
+            if all(credentials):
+                LOGGER.info('Logging in Mega session pool')
+                if error := await session.login(*credentials):
+                    return None, error
+            self.__account = session
+            self.__credentials = credentials
+            return session, None
+
+    async def folder_node(self, link):
+        async with self.__lock:
+            if link in self.__folders:
+                session, node, added = self.__folders[link]
+                if time() - added < FOLDER_CACHE_TTL:
+                    self.__folders.move_to_end(link)
+                    LOGGER.info(f'Using cached Mega folder node: {link}')
+                    return node, None
+                del self.__folders[link]
+                await session.logout()
+            session = MegaSession()
+            if error := await session.login_to_folder(link):
+                return None, error
+            node = await sync_to_async(session.api.authorizeNode, session.root)
+            self.__folders[link] = (session, node, time())
+            while len(self.__folders) > FOLDER_CACHE_SIZE:
+                _, (old_session, _, _) = self.__folders.popitem(last=False)
+                await old_session.logout()
+            return node, None
+
+    def slots(self):
+        count = config_dict['MEGA_TRANSFER_SLOTS']
+        if count != self.__slots_count:
+            self.__slots = Semaphore(count) if count else None
+            self.__slots_count = count
+        return self.__slots
+
+
+mega_pool = MegaSessionPool()
+
+
+class MegaAppListener(MegaTransferListener):
+
+    def __init__(self, continue_event: Event, listener, name):
+        self.continue_event = continue_event
+        self.listener = listener
+        self.is_cancelled = False
+        self.is_finished = False
+        self.error = None
+        self.__bytes_transferred = 0
+        self.__speed = 0
+        self.__name = name
+        super().__init__()
+
+    @property
+    def speed(self):
+        return self.__speed
+
+    @property
+    def downloaded_bytes(self):
+        return self.__bytes_transferred
 
     def onTransferUpdate(self, api: MegaApi, transfer: MegaTransfer):
         if self.is_cancelled:
             api.cancelTransfer(transfer, None)
-            self.continue_event.set()
+            bot_loop.call_soon_threadsafe(self.continue_event.set)
             return
         self.__speed = transfer.getSpeed()
         self.__bytes_transferred = transfer.getTransferredBytes()
@@ -77,10 +182,10 @@ class MegaAppListener(MegaListener):
     def onTransferFinish(self, api: MegaApi, transfer: MegaTransfer, error):
         try:
             if self.is_cancelled:
-                self.continue_event.set()
+                bot_loop.call_soon_threadsafe(self.continue_event.set)
             elif transfer.isFinished() and (transfer.isFolderTransfer() or transfer.getFileName() == self.__name):
-                async_to_sync(self.listener.onDownloadComplete)
-                self.continue_event.set()
+                self.is_finished = True
+                bot_loop.call_soon_threadsafe(self.continue_event.set)
         except Exception as e:
             LOGGER.error(e)
 
@@ -95,73 +200,39 @@ class MegaAppListener(MegaListener):
             # Don't break the transfer queue if transfer's in queued (1) or retrying (4) state [causes seg fault]
             return
 
-        self.error = errStr
         if not self.is_cancelled:
+            self.error = f"TransferTempError: {errStr} ({filen})"
             self.is_cancelled = True
-            async_to_sync(self.listener.onDownloadError,
-                          f"TransferTempError: {errStr} ({filen})")
-            self.continue_event.set()
+            bot_loop.call_soon_threadsafe(self.continue_event.set)
 
     async def cancel_download(self):
         self.is_cancelled = True
         await self.listener.onDownloadError("Download Canceled by user")
 
 
-class AsyncExecutor:
-
-    def __init__(self):
-        self.continue_event = Event()
-
-    async def do(self, function, args):
-        self.continue_event.clear()
-        await sync_to_async(function, *args)
-        await self.continue_event.wait()
-
-
 async def add_mega_download(mega_link, path, listener, name):
-    MEGA_EMAIL = config_dict['MEGA_EMAIL']
-    MEGA_PASSWORD = config_dict['MEGA_PASSWORD']
-
-    executor = AsyncExecutor()
-    api = MegaApi(None, None, None, 'WZML-X')
-    folder_api = None
-
-    mega_listener = MegaAppListener(executor.continue_event, listener)
-    api.addListener(mega_listener)
-
-    if MEGA_EMAIL and MEGA_PASSWORD:
-        await executor.do(api.login, (MEGA_EMAIL, MEGA_PASSWORD))
-
-    if get_mega_link_type(mega_link) == "file":
-        await executor.do(api.getPublicNode, (mega_link,))
-        node = mega_listener.public_node
-    else:
-        folder_api = MegaApi(None, None, None, 'WZML-X')
-        folder_api.addListener(mega_listener)
-        await executor.do(folder_api.loginToFolder, (mega_link,))
-        node = await sync_to_async(folder_api.authorizeNode, mega_listener.node)
-    if mega_listener.error is not None:
-        await sendMessage(listener.message, str(mega_listener.error))
-        await executor.do(api.logout, ())
-        if folder_api is not None:
-            await executor.do(folder_api.logout, ())
+    session, error = await mega_pool.account()
+    if error is None:
+        if get_mega_link_type(mega_link) == "file":
+            error, node = await session.request(MegaRequest.TYPE_GET_PUBLIC_NODE, session.api.getPublicNode, mega_link)
+        else:
+            node, error = await mega_pool.folder_node(mega_link)
+    if error is not None:
+        await sendMessage(listener.message, str(error))
         return
 
     name = name or node.getName()
     msg, button = await stop_duplicate_check(name, listener)
     if msg:
         await sendMessage(listener.message, msg, button)
-        await executor.do(api.logout, ())
-        if folder_api is not None:
-            await executor.do(folder_api.logout, ())
         return
 
     gid = ''.join(SystemRandom().choices(ascii_letters + digits, k=8))
-    size = api.getSize(node)
+    size = session.api.getSize(node)
     if limit_exceeded := await limit_checker(size, listener, isMega=True):
         await sendMessage(listener.message, limit_exceeded)
         return
-    added_to_queue, event = await is_queued(listener.uid)
+    added_to_queue, event = await is_queued(listener, size)
     if added_to_queue:
         LOGGER.info(f"Added to Queue/Download: {name}")
         async with download_dict_lock:
@@ -172,15 +243,14 @@ async def add_mega_download(mega_link, path, listener, name):
         await event.wait()
         async with download_dict_lock:
             if listener.uid not in download_dict:
-                await executor.do(api.logout, ())
-                if folder_api is not None:
-                    await executor.do(folder_api.logout, ())
                 return
         from_queue = True
         LOGGER.info(f'Start Queued Download from Mega: {name}')
     else:
         from_queue = False
 
+    continue_event = Event()
+    mega_listener = MegaAppListener(continue_event, listener, name)
     async with download_dict_lock:
         download_dict[listener.uid] = MegaDownloadStatus(name, size, gid, mega_listener, listener.message, listener.upload_details)
     async with queue_dict_lock:
@@ -194,7 +264,17 @@ async def add_mega_download(mega_link, path, listener, name):
         LOGGER.info(f"Download from Mega: {name}")
 
     await makedirs(path, exist_ok=True)
-    await executor.do(api.startDownload, (node, path, name, None, False, None))
-    await executor.do(api.logout, ())
-    if folder_api is not None:
-        await executor.do(folder_api.logout, ())
+    if slots := mega_pool.slots():
+        await slots.acquire()
+    try:
+        if mega_listener.is_cancelled:
+            return
+        await sync_to_async(session.api.startDownload, node, path, name, None, False, None, mega_listener)
+        await continue_event.wait()
+    finally:
+        if slots:
+            slots.release()
+    if mega_listener.error is not None:
+        await listener.onDownloadError(mega_listener.error)
+    elif mega_listener.is_finished:
+        await listener.onDownloadComplete()
@@ -1,35 +1,35 @@
 #!/usr/bin/env python3
 from asyncio import gather
-from json import loads
 from random import SystemRandom
 from string import ascii_letters, digits
+from aiohttp import ClientError
 
 from bot import download_dict, download_dict_lock, queue_dict_lock, non_queued_dl, LOGGER
-from bot.helper.ext_utils.bot_utils import cmd_exec
+from bot.helper.ext_utils.exceptions import RcloneRcException
 from bot.helper.telegram_helper.message_utils import sendMessage, sendStatusMessage
 from bot.helper.ext_utils.task_manager import is_queued, stop_duplicate_check
 from bot.helper.mirror_utils.status_utils.rclone_status import RcloneStatus
 from bot.helper.mirror_utils.status_utils.queue_status import QueueStatus
 from bot.helper.mirror_utils.rclone_utils.transfer import RcloneTransferHelper
+from bot.helper.mirror_utils.rclone_utils.daemon import get_rclone_daemon
 
 
 async def add_rclone_download(rc_path, config_path, path, name, listener):
     remote, rc_path = rc_path.split(':', 1)
     rc_path = rc_path.strip('/')
 
-    cmd1 = ['rclone', 'lsjson', '--fast-list', '--stat', '--no-mimetype',
-            '--no-modtime', '--config', config_path, f'{remote}:{rc_path}']
-    cmd2 = ['rclone', 'size', '--fast-list', '--json',
-            '--config', config_path, f'{remote}:{rc_path}']
-    res1, res2 = await gather(cmd_exec(cmd1), cmd_exec(cmd2))
-    if res1[2] != res2[2] != 0:
-        if res1[2] != -9:
-            err = res1[1] or res2[1]
-            msg = f'Error: While getting rclone stat/size. Path: {remote}:{rc_path}. Stderr: {err[:4000]}'
-            await sendMessage(listener.message, msg)
+    try:
+        daemon = await get_rclone_daemon(config_path)
+        rstat, rsize = await gather(daemon.call('operations/stat', fs=f'{remote}:', remote=rc_path,
+                                                opt={'noModTime': True, 'noMimeType': True}),
+                                    daemon.call('operations/size', fs=f'{remote}:{rc_path}'))
+    except (RcloneRcException, ClientError) as err:
+        msg = f'Error: While getting rclone stat/size. Path: {remote}:{rc_path}. Error: {str(err)[:4000]}'
+        await sendMessage(listener.message, msg)
+        return
+    if (rstat := rstat['item']) is None:
+        await sendMessage(listener.message, f'Error: Path not found. Path: {remote}:{rc_path}')
         return
-    rstat = loads(res1[0])
-    rsize = loads(res2[0])
     if rstat['IsDir']:
         if not name:
             name = rc_path.rsplit('/', 1)[-1] if rc_path else remote
@@ -44,7 +44,7 @@ async def add_rclone_download(rc_path, config_path, path, name, listener):
         await sendMessage(listener.message, msg, button)
         return
 
-    added_to_queue, event = await is_queued(listener.uid)
+    added_to_queue, event = await is_queued(listener, size)
     if added_to_queue:
         LOGGER.info(f"Added to Queue/Download: {name}")
         async with download_dict_lock:
@@ -8,6 +8,7 @@ from bot.helper.mirror_utils.status_utils.telegram_status import TelegramStatus
 from bot.helper.mirror_utils.status_utils.queue_status import QueueStatus
 from bot.helper.telegram_helper.message_utils import sendStatusMessage, sendMessage
 from bot.helper.ext_utils.task_manager import is_queued, limit_checker, stop_duplicate_check
+from bot.helper.ext_utils.bandwidth_manager import bandwidth_governor
 
 global_lock = Lock()
 GLOBAL_GID = set()
@@ -55,7 +56,9 @@ class TelegramDownloadHelper:
                 user.stop_transmission()
             else:
                 bot.stop_transmission()
+        chunk_size = current - self.__processed_bytes
         self.__processed_bytes = current
+        await bandwidth_governor.throttle(self.__listener.message.from_user.id, 'dl', chunk_size)
 
     async def __onDownloadError(self, error):
         async with global_lock:
@@ -116,7 +119,7 @@ class TelegramDownloadHelper:
                     await sendMessage(self.__listener.message, limit_exceeded)
                     await delete_links(self.__listener.message)
                     return
-                added_to_queue, event = await is_queued(self.__listener.uid)
+                added_to_queue, event = await is_queued(self.__listener, size)
                 if added_to_queue:
                     LOGGER.info(f"Added to Queue/Download: {name}")
                     async with download_dict_lock:
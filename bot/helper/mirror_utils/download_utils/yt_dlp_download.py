@@ -196,6 +196,8 @@ class YoutubeDLHelper:
 
         self.__gid = ''.join(SystemRandom().choices(
             ascii_letters + digits, k=10))
+        # journaled so a resumed task keeps the format of its .part files
+        self.__listener.ytQual = qual
 
         await self.__onDownloadStart()
 
@@ -261,7 +263,7 @@ class YoutubeDLHelper:
                 limit_exceeded += f'\nYour Playlist has {self.playlist_count} files'
             await self.__listener.onDownloadError(limit_exceeded)
             return
-        added_to_queue, event = await is_queued(self.__listener.uid)
+        added_to_queue, event = await is_queued(self.__listener, self.__size)
         if added_to_queue:
             LOGGER.info(f"Added to Queue/Download: {self.name}")
             async with download_dict_lock:
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+from asyncio import create_subprocess_exec, sleep, Lock
+from configparser import ConfigParser
+from hashlib import sha256
+from secrets import token_hex
+from socket import socket
+from logging import getLogger
+from aiohttp import ClientSession, ClientError, BasicAuth
+from aiofiles.os import path as aiopath
+from aiofiles import open as aiopen
+
+from bot.helper.ext_utils.exceptions import RcloneRcException
+
+LOGGER = getLogger(__name__)
+
+DAEMON_START_TIMEOUT = 30
+JOB_POLL_INTERVAL = 1
+
+# rewritten by rclone itself on OAuth refresh, a change here alone needs no restart
+CONFIG_VOLATILE_KEYS = {'token'}
+
+rclone_daemons = {}
+rclone_daemons_lock = Lock()
+
+
+class RcloneDaemon:
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.__proc = None
+        self.__url = None
+        self.__auth = None
+        self.__session = None
+        self.__stamp = None
+        self.__signature = None
+        self.__jobs = set()
+        self.__lock = Lock()
+
+    @staticmethod
+    def __free_port():
+        with socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    async def __config_signature(self):
+        async with aiopen(self.config_path) as f:
+            text = await f.read()
+        config = ConfigParser(interpolation=None)
+        try:
+            config.read_string(text)
+        except Exception:
+            return sha256(text.encode()).hexdigest()
+        return sha256(repr(sorted((section, key, value) for section in config.sections()
+                                  for key, value in config.items(section)
+                                  if key not in CONFIG_VOLATILE_KEYS)).encode()).hexdigest()
+
+    async def __start(self):
+        await self.stop()
+        port = self.__free_port()
+        user, password = token_hex(8), token_hex(16)
+        self.__url = f'http://127.0.0.1:{port}'
+        self.__auth = BasicAuth(user, password)
+        self.__session = ClientSession(auth=self.__auth)
+        self.__stamp = await aiopath.getmtime(self.config_path)
+        self.__signature = await self.__config_signature()
+        cmd = ['rclone', 'rcd', '--config', self.config_path, '--rc-addr', f'127.0.0.1:{port}',
+               '--rc-user', user, '--rc-pass', password, '--log-file', 'rlog.txt', '--log-level', 'DEBUG']
+        self.__proc = await create_subprocess_exec(*cmd)
+        for _ in range(DAEMON_START_TIMEOUT * 10):
+            if self.__proc.returncode is not None:
+                break
+            try:
+                await self.__post('rc/noop')
+                LOGGER.info(f'Rclone daemon started for {self.config_path} on port {port}')
+                return
+            except ClientError:
+                await sleep(0.1)
+        await self.stop()
+        raise RcloneRcException(f'Rclone daemon failed to start for {self.config_path}')
+
+    async def __ensure(self):
+        async with self.__lock:
+            if self.__proc is None or self.__proc.returncode is not None:
+                await self.__start()
+                return
+            if (stamp := await aiopath.getmtime(self.config_path)) == self.__stamp:
+                return
+            if await self.__config_signature() == self.__signature:
+                self.__stamp = stamp
+            elif self.__jobs:
+                # restarting would kill the running jobs, pick the new config up once idle
+                return
+            else:
+                LOGGER.info(f'Rclone config changed, restarting daemon for {self.config_path}')
+                await self.__start()
+
+    async def __post(self, method, params=None):
+        async with self.__session.post(f'{self.__url}/{method}', json=params or {}) as response:
+            result = await response.json(content_type=None)
+            if response.status != 200:
+                raise RcloneRcException(result.get('error', f'{method} failed with status {response.status}'))
+            return result
+
+    async def call(self, method, **params):
+        await self.__ensure()
+        return await self.__post(method, params)
+
+    async def submit(self, method, **params):
+        jobid = (await self.call(method, _async=True, **params))['jobid']
+        self.__jobs.add(jobid)
+        return jobid
+
+    async def job_stats(self, jobid):
+        return await self.call('core/stats', group=f'job/{jobid}')
+
+    async def wait_job(self, jobid, on_stats=None):
+        try:
+            while True:
+                status = await self.call('job/status', jobid=jobid)
+                if on_stats is not None:
+                    on_stats(await self.job_stats(jobid))
+                if status['finished']:
+                    return status
+                await sleep(JOB_POLL_INTERVAL)
+        finally:
+            self.__jobs.discard(jobid)
+
+    async def stop_job(self, jobid):
+        try:
+            await self.call('job/stop', jobid=jobid)
+        except (RcloneRcException, ClientError) as e:
+            LOGGER.error(f'Rclone job stop: {e}')
+
+    async def stop(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+        if self.__proc is not None and self.__proc.returncode is None:
+            try:
+                self.__proc.kill()
+                await self.__proc.wait()
+            except:
+                pass
+        self.__proc = None
+        self.__jobs.clear()
+
+
+async def get_rclone_daemon(config_path):
+    async with rclone_daemons_lock:
+        if config_path not in rclone_daemons:
+            rclone_daemons[config_path] = RcloneDaemon(config_path)
+        return rclone_daemons[config_path]
@@ -1,22 +1,75 @@
 #!/usr/bin/env python3
-from asyncio import wait_for, Event, wrap_future
+from asyncio import wait_for, Event, wrap_future, create_task, gather, shield
+from collections import OrderedDict
 from aiofiles.os import path as aiopath
 from aiofiles import open as aiopen
 from configparser import ConfigParser
 from pyrogram.handlers import CallbackQueryHandler
 from pyrogram.filters import regex, user
 from functools import partial
-from json import loads
+from aiohttp import ClientError
 from time import time
 
 from bot import LOGGER, config_dict
 from bot.helper.ext_utils.db_handler import DbManger
 from bot.helper.telegram_helper.button_build import ButtonMaker
 from bot.helper.telegram_helper.message_utils import sendMessage, editMessage
-from bot.helper.ext_utils.bot_utils import cmd_exec, new_thread, get_readable_file_size, new_task, get_readable_time
+from bot.helper.mirror_utils.rclone_utils.daemon import get_rclone_daemon
+from bot.helper.ext_utils.exceptions import RcloneRcException
+from bot.helper.ext_utils.bot_utils import new_thread, get_readable_file_size, new_task, get_readable_time
 
 LIST_LIMIT = 6
 
+LISTING_CACHE_TTL = 120
+
+LISTING_CACHE_SIZE = 512
+
+listing_cache = OrderedDict()
+listing_tasks = {}
+remote_sections = {}
+
+
+async def __fetch_listing(config_path, remote, path, item_type):
+    opt = {'noMimeType': True, 'noModTime': True,
+           'dirsOnly': item_type == '--dirs-only', 'filesOnly': item_type == '--files-only'}
+    daemon = await get_rclone_daemon(config_path)
+    result = (await daemon.call('operations/list', fs=remote, remote=path.rstrip('/'), opt=opt))['list']
+    return sorted(result, key=lambda x: x["Path"])
+
+
+async def get_listing(config_path, remote, path, item_type):
+    key = (config_path, remote, path, item_type)
+    stamp = await aiopath.getmtime(config_path)
+    if (cached := listing_cache.get(key)) is not None:
+        if cached[0] == stamp and time() - cached[1] < LISTING_CACHE_TTL:
+            listing_cache.move_to_end(key)
+            return cached[2]
+        del listing_cache[key]
+    if (task := listing_tasks.get(key)) is None:
+        task = create_task(__fetch_listing(config_path, remote, path, item_type))
+        listing_tasks[key] = task
+        task.add_done_callback(lambda _: listing_tasks.pop(key, None))
+    result = await shield(task)
+    listing_cache[key] = (stamp, time(), result)
+    listing_cache.move_to_end(key)
+    while len(listing_cache) > LISTING_CACHE_SIZE:
+        listing_cache.popitem(last=False)
+    return result
+
+
+async def prefetch_listings(config_path, remote, paths, item_type):
+    results = await gather(*[get_listing(config_path, remote, path, item_type) for path in paths],
+                           return_exceptions=True)
+    for path, result in zip(paths, results):
+        if isinstance(result, Exception):
+            LOGGER.debug(f'Rclone prefetch failed. Path: {remote}{path}. Error: {result}')
+
+
+def invalidate_listing(config_path, remote):
+    for key in list(listing_cache):
+        if key[0] == config_path and key[1] == remote:
+            del listing_cache[key]
+
 
 @new_task
 async def path_updates(client, query, obj):
@@ -36,9 +89,11 @@ async def path_updates(client, query, obj):
     if data[1] == 'pre':
         obj.iter_start -= LIST_LIMIT * obj.page_step
         await obj.get_path_buttons()
+        obj.prefetch_page()
     elif data[1] == 'nex':
         obj.iter_start += LIST_LIMIT * obj.page_step
         await obj.get_path_buttons()
+        obj.prefetch_page()
     elif data[1] == 'back':
         if data[2] == 're':
             await obj.list_config()
@@ -197,35 +252,46 @@ class RcloneList:
             self.item_type == itype
         elif self.list_status == 'rcu':
             self.item_type == '--dirs-only'
-        cmd = ['rclone', 'lsjson', self.item_type, '--fast-list', '--no-mimetype',
-               '--no-modtime', '--config', self.config_path, f"{self.remote}{self.path}"]
         if self.is_cancelled:
             return
-        res, err, code = await cmd_exec(cmd)
-        if code not in [0, -9]:
+        try:
+            result = await get_listing(self.config_path, self.remote, self.path, self.item_type)
+        except (RcloneRcException, ClientError) as err:
             LOGGER.error(
-                f'While rclone listing. Path: {self.remote}{self.path}. Stderr: {err}')
-            self.remote = err[:4000]
+                f'While rclone listing. Path: {self.remote}{self.path}. Error: {err}')
+            self.remote = str(err)[:4000]
             self.path = ''
             self.event.set()
             return
-        result = loads(res)
         if len(result) == 0 and itype != self.item_type and self.list_status == 'rcd':
             itype = '--dirs-only' if self.item_type == '--files-only' else '--files-only'
             self.item_type = itype
             return await self.get_path(itype)
-        self.path_list = sorted(result, key=lambda x: x["Path"])
+        self.path_list = result
         self.iter_start = 0
         await self.get_path_buttons()
+        self.prefetch_page()
+
+    def prefetch_page(self):
+        paths = [f"{self.path}/{idict['Path']}" if self.path else idict['Path']
+                 for idict in self.path_list[self.iter_start:LIST_LIMIT*self.page_step+self.iter_start]
+                 if idict['IsDir']]
+        if paths:
+            create_task(prefetch_listings(self.config_path, self.remote, paths, self.item_type))
 
     async def list_remotes(self):
-        config = ConfigParser()
-        async with aiopen(self.config_path, 'r') as f:
-            contents = await f.read()
-            config.read_string(contents)
-        if config.has_section('combine'):
-            config.remove_section('combine')
-        self.__sections = config.sections()
+        stamp = await aiopath.getmtime(self.config_path)
+        if (cached := remote_sections.get(self.config_path)) is not None and cached[0] == stamp:
+            self.__sections = cached[1]
+        else:
+            config = ConfigParser()
+            async with aiopen(self.config_path, 'r') as f:
+                contents = await f.read()
+                config.read_string(contents)
+            if config.has_section('combine'):
+                config.remove_section('combine')
+            self.__sections = config.sections()
+            remote_sections[self.config_path] = (stamp, self.__sections)
         if len(self.__sections) == 1:
             self.remote = f'{self.__sections[0]}:'
             await self.get_path()
@@ -1,16 +1,22 @@
 from asyncio import create_subprocess_exec, gather
 from asyncio.subprocess import PIPE
 from re import findall as re_findall
-from json import loads
-from aiofiles.os import path as aiopath, mkdir, listdir
+from os import path as ospath
+from aiohttp import ClientError
+from aiofiles.os import path as aiopath, mkdir
 from aiofiles import open as aiopen
 from configparser import ConfigParser
-from random import randrange
 from logging import getLogger
 
 from bot import config_dict, GLOBAL_EXTENSION_FILTER
-from bot.helper.ext_utils.bot_utils import cmd_exec, sync_to_async
+from bot.helper.ext_utils.bot_utils import sync_to_async, get_readable_file_size, get_readable_time, speed_string_to_bytes
+from bot.helper.ext_utils.exceptions import RcloneRcException
 from bot.helper.ext_utils.fs_utils import get_mime_type, count_files_and_folders
+from bot.helper.ext_utils.bandwidth_manager import bandwidth_governor
+from bot.helper.ext_utils.sa_ledger import sa_ledger
+from bot.helper.ext_utils.db_handler import ensure_user_blobs
+from bot.helper.mirror_utils.rclone_utils.daemon import get_rclone_daemon
+from bot.helper.mirror_utils.rclone_utils.list import invalidate_listing
 
 
 LOGGER = getLogger(__name__)
@@ -24,6 +30,7 @@ class RcloneTransferHelper:
         self.__eta = '-'
         self.__percentage = '0%'
         self.__speed = '0 B/s'
+        self.__speed_raw = 0
         self.__size = '0 B'
         self.__is_cancelled = False
         self.__is_download = False
@@ -31,6 +38,9 @@ class RcloneTransferHelper:
         self.__sa_count = 1
         self.__sa_index = 0
         self.__sa_number = 0
+        self.__daemon = None
+        self.__jobid = None
+        self.stats = {}
         self.name = name
 
     @property
@@ -45,6 +55,10 @@ class RcloneTransferHelper:
     def speed(self):
         return self.__speed
 
+    @property
+    def speed_raw(self):
+        return self.__speed_raw
+
     @property
     def eta(self):
         return self.__eta
@@ -53,6 +67,13 @@ class RcloneTransferHelper:
     def size(self):
         return self.__size
 
+    @property
+    def copied(self):
+        # server-side copies and moves (e.g. Drive to Drive) are not counted in bytes/transfers
+        stats = self.stats
+        return (stats.get('transfers', 0) + stats.get('serverSideCopies', 0) + stats.get('serverSideMoves', 0),
+                stats.get('bytes', 0) + stats.get('serverSideCopyBytes', 0) + stats.get('serverSideMoveBytes', 0))
+
     async def __progress(self):
         while not (self.__proc is None or self.__is_cancelled):
             try:
@@ -64,23 +85,33 @@ class RcloneTransferHelper:
             if data := re_findall(r'Transferred:\s+([\d.]+\s*\w+)\s+/\s+([\d.]+\s*\w+),\s+([\d.]+%)\s*,\s+([\d.]+\s*\w+/s),\s+ETA\s+([\dwdhms]+)', data):
                 self.__transferred_size, self.__size, self.__percentage, self.__speed, self.__eta = data[
                     0]
+                self.__speed_raw = speed_string_to_bytes(self.__speed)
 
     def __switchServiceAccount(self):
-        if self.__sa_index == self.__sa_number - 1:
-            self.__sa_index = 0
-        else:
-            self.__sa_index += 1
+        sa_files = sa_ledger.accounts()
+        sa_ledger.rate_limited(sa_files[self.__sa_index])
+        self.__sa_index = sa_files.index(sa_ledger.pick(sa_files))
         self.__sa_count += 1
         remote = f'sa{self.__sa_index:03}'
         LOGGER.info(f"Switching to {remote} remote")
         return remote
 
+    def __record_usage(self, size):
+        sa_ledger.record(sa_ledger.accounts()[self.__sa_index], size)
+
+    def __pick_service_account(self, size=0):
+        sa_files = sa_ledger.accounts()
+        self.__sa_number = len(sa_files)
+        self.__sa_index = sa_files.index(sa_ledger.pick(sa_files, size))
+        return f'sa{self.__sa_index:03}'
+
     async def __create_rc_sa(self, remote, remote_opts):
         sa_conf_dir = 'rclone_sa'
         sa_conf_file = f'{sa_conf_dir}/{remote}.conf'
         if not await aiopath.isdir(sa_conf_dir):
             await mkdir(sa_conf_dir)
-        elif await aiopath.isfile(sa_conf_file):
+        elif await aiopath.isfile(sa_conf_file) and \
+                await aiopath.getmtime(sa_conf_file) >= await aiopath.getmtime('accounts'):
             return sa_conf_file
 
         if gd_id := remote_opts.get('team_drive'):
@@ -90,7 +121,7 @@ class RcloneTransferHelper:
         else:
             return 'rclone.conf'
 
-        files = await listdir('accounts')
+        files = await sync_to_async(sa_ledger.accounts)
         text = ''.join(f"[sa{i:03}]\ntype = drive\nscope = drive\nservice_account_file = accounts/{sa}\n{option} = {gd_id}\n\n"
                        for i, sa in enumerate(files))
 
@@ -98,33 +129,58 @@ class RcloneTransferHelper:
             await f.write(text)
         return sa_conf_file
 
-    async def __start_download(self, cmd, remote_type):
+    def __update_stats(self, stats):
+        self.stats = stats
+        transferred = self.copied[1]
+        total = max(stats.get('totalBytes', 0), transferred)
+        self.__transferred_size = get_readable_file_size(transferred)
+        self.__size = get_readable_file_size(total)
+        self.__percentage = f'{round(transferred * 100 / total)}%' if total else '0%'
+        self.__speed_raw = stats.get('speed', 0)
+        self.__speed = f'{get_readable_file_size(self.__speed_raw)}/s'
+        self.__eta = get_readable_time(stats['eta']) if stats.get('eta') else '-'
+
+    async def __run_cmd(self, cmd):
         self.__proc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
         _, return_code = await gather(self.__progress(), self.__proc.wait())
+        if return_code in [0, -9]:
+            return return_code, ''
+        return return_code, (await self.__proc.stderr.read()).decode().strip()
 
+    async def __run_job(self, config_path, method, params):
+        try:
+            self.__daemon = await get_rclone_daemon(config_path)
+            await self.__daemon.call('core/bwlimit', rate=self.__bwlimit_rate())
+            if self.__is_cancelled:
+                return -9, ''
+            self.__jobid = await self.__daemon.submit(method, **params)
+            status = await self.__daemon.wait_job(self.__jobid, self.__update_stats)
+        except (RcloneRcException, ClientError) as e:
+            return 1, str(e)
         if self.__is_cancelled:
-            return
+            return -9, ''
+        return (0, '') if status['success'] else (1, status['error'])
 
+    async def __transfer(self, config_path, build, remote, remote_type):
+        cmd, job = build(remote)
+        if cmd is not None:
+            return_code, error = await self.__run_cmd(cmd)
+        else:
+            return_code, error = await self.__run_job(config_path, *job)
+        if self.__is_cancelled or return_code == -9:
+            return None
         if return_code == 0:
-            await self.__listener.onDownloadComplete()
-        elif return_code != -9:
-            error = (await self.__proc.stderr.read()).decode().strip()
-            if not error and remote_type == 'drive' and config_dict['USE_SERVICE_ACCOUNTS']:
-                error = "Mostly your service accounts don't have access to this drive!"
-            LOGGER.error(error)
-
-            if self.__sa_number != 0 and remote_type == 'drive' and 'RATE_LIMIT_EXCEEDED' in error and config_dict['USE_SERVICE_ACCOUNTS']:
-                if self.__sa_count < self.__sa_number:
-                    remote = self.__switchServiceAccount()
-                    cmd[6] = f"{remote}:{cmd[6].split(':', 1)[1]}"
-                    if self.__is_cancelled:
-                        return
-                    return await self.__start_download(cmd, remote_type)
-                else:
-                    LOGGER.info(
-                        f"Reached maximum number of service accounts switching, which is {self.__sa_count}")
-
-            await self.__listener.onDownloadError(error[:4000])
+            return ''
+        if not error and remote_type == 'drive' and config_dict['USE_SERVICE_ACCOUNTS']:
+            error = "Mostly your service accounts don't have access to this drive!"
+        LOGGER.error(error)
+        if self.__sa_number != 0 and remote_type == 'drive' and 'RATE_LIMIT_EXCEEDED' in error and config_dict['USE_SERVICE_ACCOUNTS']:
+            if self.__sa_count < self.__sa_number:
+                remote = await sync_to_async(self.__switchServiceAccount)
+                return await self.__transfer(config_path, build, remote, remote_type)
+            LOGGER.info(
+                f"Reached maximum number of service accounts switching, which is {self.__sa_count}")
+        return error or 'Rclone transfer failed!'
 
     async def download(self, remote, rc_path, config_path, path):
         self.__is_download = True
@@ -139,77 +195,80 @@ class RcloneTransferHelper:
                 and await aiopath.isdir('accounts'):
             config_path = await self.__create_rc_sa(remote, remote_opts)
             if config_path != 'rclone.conf':
-                sa_files = await listdir('accounts')
-                self.__sa_number = len(sa_files)
-                self.__sa_index = randrange(self.__sa_number)
-                remote = f'sa{self.__sa_index:03}'
+                remote = await sync_to_async(self.__pick_service_account)
                 LOGGER.info(f'Download with service account {remote}')
 
         rcflags = self.__listener.rcFlags or config_dict['RCLONE_FLAGS']
-        cmd = self.__getUpdatedCommand(
-            config_path, f'{remote}:{rc_path}', path, rcflags, 'copy')
+        try:
+            is_dir = await self.__is_dir(config_path, remote, rc_path)
+        except (RcloneRcException, ClientError) as err:
+            await self.__listener.onDownloadError(str(err))
+            return
+
+        def build(remote):
+            # the daemon only has one shared bwlimit, so per-user limits need their own rclone process
+            if rcflags or self.__task_limit('dl'):
+                cmd = self.__getUpdatedCommand(
+                    config_path, f'{remote}:{rc_path}', path, rcflags, 'copy')
+                if remote_type != 'drive':
+                    cmd.extend(('--retries-sleep', '3s'))
+                self.__add_bwlimit(cmd, 'dl')
+                return cmd, None
+            fs = f'{remote},acknowledge_abuse=true:' if remote_type == 'drive' else f'{remote}:'
+            config = {} if remote_type == 'drive' else {'RetriesInterval': '3s'}
+            if is_dir:
+                return None, self.__sync_job('sync/copy', f'{fs}{rc_path}', path, config)
+            return None, ('operations/copyfile', {'srcFs': fs, 'srcRemote': rc_path, 'dstFs': path,
+                                                  'dstRemote': self.name, '_config': self.__job_config(config)})
+
+        error = await self.__transfer(config_path, build, remote, remote_type)
+        if error is None:
+            return
+        if error:
+            await self.__listener.onDownloadError(error[:4000])
+        else:
+            await self.__listener.onDownloadComplete()
 
-        if remote_type == 'drive' and not config_dict['RCLONE_FLAGS'] and not self.__listener.rcFlags:
-            cmd.append('--drive-acknowledge-abuse')
-        elif remote_type != 'drive':
-            cmd.extend(('--retries-sleep', '3s'))
+    async def __is_dir(self, config_path, remote, rc_path):
+        if not rc_path:
+            return True
+        item = await self.__stat(config_path, remote, rc_path)
+        return item is None or item['IsDir']
 
-        await self.__start_download(cmd, remote_type)
+    @staticmethod
+    async def __stat(config_path, remote, rc_path):
+        daemon = await get_rclone_daemon(config_path)
+        return (await daemon.call('operations/stat', fs=f'{remote}:', remote=rc_path,
+                                  opt={'noModTime': True, 'noMimeType': True}))['item']
 
     async def __get_gdrive_link(self, config_path, remote, rc_path, mime_type):
         if mime_type == 'Folder':
-            epath = rc_path.strip('/').rsplit('/', 1)
-            epath = f'{remote}:{epath[0]}' if len(
-                epath) > 1 else f'{remote}:'
-            destination = f'{remote}:{rc_path}'
+            rc_file = rc_path
         elif rc_path:
-            epath = f"{remote}:{rc_path}/{self.name}"
-            destination = epath
+            rc_file = f"{rc_path}/{self.name}"
         else:
-            epath = f"{remote}:{rc_path}{self.name}"
-            destination = epath
+            rc_file = self.name
+        destination = f'{remote}:{rc_file}'
 
-        cmd = ['rclone', 'lsjson', '--fast-list', '--no-mimetype',
-               '--no-modtime', '--config', config_path, epath]
-        res, err, code = await cmd_exec(cmd)
-
-        if code == 0:
-            result = loads(res)
-            fid = next((r['ID']
-                       for r in result if r['Path'] == self.name), 'err')
+        try:
+            item = await self.__stat(config_path, remote, rc_file)
+            fid = item['ID'] if item else 'err'
             link = f'https://drive.google.com/drive/folders/{fid}' if mime_type == 'Folder' else f'https://drive.google.com/uc?id={fid}&export=download'
-        elif code != -9:
+        except (RcloneRcException, ClientError) as err:
             LOGGER.error(
-                f'while getting drive link. Path: {destination}. Stderr: {err}')
+                f'while getting drive link. Path: {destination}. Error: {err}')
             link = ''
         return link, destination
 
-    async def __start_upload(self, cmd, remote_type):
-        self.__proc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
-        _, return_code = await gather(self.__progress(), self.__proc.wait())
-
-        if self.__is_cancelled:
-            return False
-
-        if return_code == -9:
-            return False
-        elif return_code != 0:
-            error = (await self.__proc.stderr.read()).decode().strip()
-            if not error and remote_type == 'drive' and config_dict['USE_SERVICE_ACCOUNTS']:
-                error = "Mostly your service accounts don't have access to this drive!"
-            LOGGER.error(error)
-            if self.__sa_number != 0 and remote_type == 'drive' and 'RATE_LIMIT_EXCEEDED' in error and config_dict['USE_SERVICE_ACCOUNTS']:
-                if self.__sa_count < self.__sa_number:
-                    remote = self.__switchServiceAccount()
-                    cmd[7] = f"{remote}:{cmd[7].split(':', 1)[1]}"
-                    return False if self.__is_cancelled else await self.__start_upload(cmd, remote_type)
-                else:
-                    LOGGER.info(
-                        f"Reached maximum number of service accounts switching, which is {self.__sa_count}")
-            await self.__listener.onUploadError(error[:4000])
-            return False
-        else:
-            return True
+    async def __get_public_link(self, config_path, destination):
+        remote, rc_path = destination.split(':', 1)
+        try:
+            daemon = await get_rclone_daemon(config_path)
+            return (await daemon.call('operations/publiclink', fs=f'{remote}:', remote=rc_path))['url'], ''
+        except (RcloneRcException, ClientError) as err:
+            LOGGER.error(
+                f'while getting link. Path: {destination} | Error: {err}')
+            return '', str(err)
 
     async def upload(self, path, size):
         self.__is_upload = True
@@ -217,6 +276,7 @@ class RcloneTransferHelper:
         if rc_path.startswith('mrcc:'):
             rc_path = rc_path.split('mrcc:', 1)[1]
             oconfig_path = f'rclone/{self.__listener.message.from_user.id}.conf'
+            await ensure_user_blobs(self.__listener.message.from_user.id)
         else:
             oconfig_path = 'rclone.conf'
 
@@ -247,25 +307,37 @@ class RcloneTransferHelper:
                 and await aiopath.isdir('accounts'):
             fconfig_path = await self.__create_rc_sa(oremote, remote_opts)
             if fconfig_path != 'rclone.conf':
-                sa_files = await listdir('accounts')
-                self.__sa_number = len(sa_files)
-                self.__sa_index = randrange(self.__sa_number)
-                fremote = f'sa{self.__sa_index:03}'
+                fremote = await sync_to_async(self.__pick_service_account, size)
                 LOGGER.info(f'Upload with service account {fremote}')
 
         rcflags = self.__listener.rcFlags or config_dict['RCLONE_FLAGS']
         method = 'move' if not self.__listener.seed or self.__listener.newDir else 'copy'
-        cmd = self.__getUpdatedCommand(
-            fconfig_path, path, f'{fremote}:{rc_path}', rcflags, method)
-        if remote_type == 'drive' and not config_dict['RCLONE_FLAGS'] and not self.__listener.rcFlags:
-            cmd.extend(('--drive-chunk-size', '64M',
-                       '--drive-upload-cutoff', '32M'))
-        elif remote_type != 'drive':
-            cmd.extend(('--retries-sleep', '3s'))
-
-        result = await self.__start_upload(cmd, remote_type)
-        if not result:
+
+        def build(remote):
+            if rcflags or self.__task_limit('up'):
+                cmd = self.__getUpdatedCommand(
+                    fconfig_path, path, f'{remote}:{rc_path}', rcflags, method)
+                if remote_type != 'drive':
+                    cmd.extend(('--retries-sleep', '3s'))
+                self.__add_bwlimit(cmd, 'up')
+                return cmd, None
+            fs = f'{remote},chunk_size=64M,upload_cutoff=32M:' if remote_type == 'drive' else f'{remote}:'
+            config = {} if remote_type == 'drive' else {'RetriesInterval': '3s'}
+            if mime_type == 'Folder':
+                return None, self.__sync_job(f'sync/{method}', path, f'{fs}{rc_path}', config)
+            return None, (f'operations/{method}file', {'srcFs': ospath.dirname(path), 'srcRemote': ospath.basename(path),
+                                                      'dstFs': f'{fs}{rc_path}', 'dstRemote': ospath.basename(path),
+                                                      '_config': self.__job_config(config)})
+
+        error = await self.__transfer(fconfig_path, build, fremote, remote_type)
+        if error is None:
             return
+        if error:
+            await self.__listener.onUploadError(error[:4000])
+            return
+        if self.__sa_number != 0:
+            await sync_to_async(self.__record_usage, size)
+        invalidate_listing(oconfig_path, f'{oremote}:')
 
         if remote_type == 'drive':
             link, destination = await self.__get_gdrive_link(oconfig_path, oremote, rc_path, mime_type)
@@ -276,16 +348,7 @@ class RcloneTransferHelper:
                 destination = f"{oremote}:{rc_path}/{self.name}"
             else:
                 destination = f"{oremote}:{self.name}"
-
-            cmd = ['rclone', 'link', '--config', oconfig_path, destination]
-            res, err, code = await cmd_exec(cmd)
-
-            if code == 0:
-                link = res
-            elif code != -9:
-                LOGGER.error(
-                    f'while getting link. Path: {destination} | Stderr: {err}')
-                link = ''
+            link, _ = await self.__get_public_link(oconfig_path, destination)
         if self.__is_cancelled:
             return
         LOGGER.info(f'Upload Done. Path: {destination}')
@@ -303,51 +366,66 @@ class RcloneTransferHelper:
 
         src_remote_type, dst_remote_type = src_remote_opts['type'], dst_remote_opt['type']
 
-        cmd = self.__getUpdatedCommand(
-            config_path, f'{src_remote}:{src_path}', destination, rcflags, 'copy')
-        if not rcflags:
+        def build(_):
+            if rcflags or self.__task_limit('up'):
+                cmd = self.__getUpdatedCommand(
+                    config_path, f'{src_remote}:{src_path}', destination, rcflags, 'copy')
+                self.__add_bwlimit(cmd, 'up')
+                return cmd, None
+            src_fs, dst_fs, config = f'{src_remote}:', f'{dst_remote}:', {}
             if src_remote_type == 'drive' and dst_remote_type != 'drive':
-                cmd.append('--drive-acknowledge-abuse')
+                src_fs = f'{src_remote},acknowledge_abuse=true:'
             elif dst_remote_type == 'drive' and src_remote_type != 'drive':
-                cmd.extend(('--drive-chunk-size', '64M',
-                           '--drive-upload-cutoff', '32M'))
+                dst_fs = f'{dst_remote},chunk_size=64M,upload_cutoff=32M:'
             elif src_remote_type == 'drive':
-                cmd.extend(('--tpslimit', '3', '--transfers', '3'))
-
-        self.__proc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
-        _, return_code = await gather(self.__progress(), self.__proc.wait())
-
-        if self.__is_cancelled:
-            return None, None
+                config = {'TPSLimit': 3, 'Transfers': 3}
+            if mime_type == 'Folder':
+                return None, self.__sync_job('sync/copy', f'{src_fs}{src_path}', f'{dst_fs}{dst_path}', config)
+            return None, ('operations/copyfile', {'srcFs': src_fs, 'srcRemote': src_path, 'dstFs': f'{dst_fs}{dst_path}',
+                                                  'dstRemote': self.name, '_config': self.__job_config(config)})
 
-        if return_code == -9:
+        error = await self.__transfer(config_path, build, src_remote, src_remote_type)
+        if error is None:
             return None, None
-        elif return_code != 0:
-            error = (await self.__proc.stderr.read()).decode().strip()
-            LOGGER.error(error)
+        if error:
             await self.__listener.onUploadError(error[:4000])
             return None, None
-        else:
-            if dst_remote_opt == 'drive':
-                link, destination = await self.__get_gdrive_link(config_path, dst_remote, dst_path, mime_type)
-                return (None, None) if self.__is_cancelled else (link, destination)
-            else:
-                if mime_type != 'Folder':
-                    destination += f'/{self.name}' if dst_path else self.name
+        invalidate_listing(config_path, f'{dst_remote}:')
+        if dst_remote_type == 'drive':
+            link, destination = await self.__get_gdrive_link(config_path, dst_remote, dst_path, mime_type)
+            return (None, None) if self.__is_cancelled else (link, destination)
+        if mime_type != 'Folder':
+            destination += f'/{self.name}' if dst_path else self.name
+        link, err = await self.__get_public_link(config_path, destination)
+        if self.__is_cancelled:
+            return None, None
+        if err:
+            await self.__listener.onUploadError(err[:4000])
+            return None, None
+        return link, destination
 
-                cmd = ['rclone', 'link', '--config', config_path, destination]
-                res, err, code = await cmd_exec(cmd)
+    @staticmethod
+    def __job_config(config):
+        return {'UseListR': True, 'LowLevelRetries': 1, 'Metadata': True} | config
 
-                if self.__is_cancelled:
-                    return None, None
+    def __sync_job(self, method, source, destination, config):
+        ext = '*.{' + ','.join(GLOBAL_EXTENSION_FILTER) + '}'
+        return method, {'srcFs': source, 'dstFs': destination, '_config': self.__job_config(config),
+                        '_filter': {'ExcludeRule': [ext], 'IgnoreCase': True}}
 
-                if code == 0:
-                    return res, destination
-                elif code != -9:
-                    LOGGER.error(
-                        f'while getting link. Path: {destination} | Stderr: {err}')
-                    await self.__listener.onUploadError(err[:4000])
-                    return None, None
+    @staticmethod
+    def __bwlimit_rate():
+        up, dl = bandwidth_governor.limit('up'), bandwidth_governor.limit('dl')
+        return ':'.join(f'{max(limit // 1024, 1)}K' if limit else 'off' for limit in [up, dl])
+
+    def __task_limit(self, direction):
+        return bandwidth_governor.task_limit(self.__listener.message.from_user.id, direction)
+
+    def __add_bwlimit(self, cmd, direction):
+        if '--bwlimit' in cmd:
+            return
+        if limit := self.__task_limit(direction):
+            cmd.extend(('--bwlimit', f'{max(limit // 1024, 1)}K'))
 
     @staticmethod
     def __getUpdatedCommand(config_path, source, destination, rcflags, method):
@@ -381,6 +459,8 @@ class RcloneTransferHelper:
                 self.__proc.kill()
             except:
                 pass
+        if self.__jobid is not None:
+            await self.__daemon.stop_job(self.__jobid)
         if self.__is_download:
             LOGGER.info(f"Cancelling Download: {self.name}")
             await self.__listener.onDownloadError('Download stopped by user!')
@@ -40,6 +40,9 @@ class Aria2Status:
     def processed_bytes(self):
         return self.__download.completed_length_string()
 
+    def speed_raw(self):
+        return self.__download.download_speed
+
     def speed(self):
         return self.__download.download_speed_string()
 
@@ -78,6 +81,10 @@ class Aria2Status:
     def uploaded_bytes(self):
         return self.__download.upload_length_string()
 
+    def upload_speed_raw(self):
+        self.__update()
+        return self.__download.upload_speed
+
     def upload_speed(self):
         self.__update()
         return self.__download.upload_speed_string()
@@ -36,6 +36,9 @@ class QbittorrentStatus:
     def processed_bytes(self):
         return get_readable_file_size(self.__info.downloaded)
 
+    def speed_raw(self):
+        return self.__info.dlspeed
+
     def speed(self):
         return f"{get_readable_file_size(self.__info.dlspeed)}/s"
 
@@ -76,6 +79,9 @@ class QbittorrentStatus:
     def uploaded_bytes(self):
         return get_readable_file_size(self.__info.uploaded)
 
+    def upload_speed_raw(self):
+        return self.__info.upspeed
+
     def upload_speed(self):
         return f"{get_readable_file_size(self.__info.upspeed)}/s"
 
@@ -15,6 +15,9 @@ class RcloneStatus:
     def progress(self):
         return self.__obj.percentage
 
+    def speed_raw(self):
+        return self.__obj.speed_raw
+
     def speed(self):
         return self.__obj.speed
 
@@ -32,6 +32,9 @@ class TelegramStatus:
             progress_raw = 0
         return f'{round(progress_raw, 2)}%'
 
+    def speed_raw(self):
+        return self.__obj.speed
+
     def speed(self):
         return f'{get_readable_file_size(self.__obj.speed)}/s'
 
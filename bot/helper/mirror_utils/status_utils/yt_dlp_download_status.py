@@ -35,6 +35,9 @@ class YtDlpDownloadStatus:
     def progress(self):
         return f'{round(self.__obj.progress, 2)}%'
 
+    def speed_raw(self):
+        return self.__obj.download_speed
+
     def speed(self):
         return f'{get_readable_file_size(self.__obj.download_speed)}/s'
 
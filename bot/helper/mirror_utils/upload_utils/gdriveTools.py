@@ -2,30 +2,88 @@
 from logging import getLogger, ERROR
 from time import time
 from pickle import load as pload
-from os import makedirs, path as ospath, listdir, remove as osremove
-from io import FileIO
+from os import makedirs, path as ospath, listdir, remove as osremove, open as osopen, close as osclose, pwrite, ftruncate, \
+    posix_fallocate, O_WRONLY, O_CREAT
 from re import search as re_search
 from urllib.parse import parse_qs, urlparse, quote as rquote
-from random import randrange
+from threading import Lock, local
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from httplib2 import Http
 from google.oauth2 import service_account
+from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaFileUpload
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type, RetryError
 
 from bot import config_dict, DRIVES_NAMES, DRIVES_IDS, INDEX_URLS, GLOBAL_EXTENSION_FILTER
 from bot.helper.ext_utils.bot_utils import setInterval, async_to_sync, get_readable_file_size
 from bot.helper.ext_utils.fs_utils import get_mime_type
-from bot.helper.ext_utils.leech_utils import format_filename
+from bot.helper.ext_utils.leech_utils import format_filename, get_md5_hash
+from bot.helper.ext_utils.dedup_manager import lookup_content, store_content
+from bot.helper.ext_utils.bandwidth_manager import bandwidth_governor
+from bot.helper.ext_utils.sa_ledger import sa_ledger
 
 LOGGER = getLogger(__name__)
 getLogger('googleapiclient.discovery').setLevel(ERROR)
 
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RANGE_PARTS = 4
+DOWNLOAD_RANGE_MIN_SIZE = 256 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class DriveServicePool:
+
+    def __init__(self):
+        self.__OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
+        self.__credentials = {}
+        self.__lock = Lock()
+        self.__local = local()
+
+    def credentials(self, key):
+        # the credentials file is only re-checked by check(), when a helper picks or switches an account
+        if (cached := self.__credentials.get(key)) is not None:
+            return cached[0]
+        return self.check(key)
+
+    def check(self, key):
+        stamp = ospath.getmtime(key)
+        with self.__lock:
+            credentials, cached_stamp = self.__credentials.get(key, (None, None))
+            if credentials is None or cached_stamp != stamp:
+                if key.endswith('.pickle'):
+                    with open(key, 'rb') as f:
+                        credentials = pload(f)
+                else:
+                    credentials = service_account.Credentials.from_service_account_file(
+                        key, scopes=self.__OAUTH_SCOPE)
+                self.__credentials[key] = (credentials, stamp)
+            if not credentials.valid:
+                credentials.refresh(Request())
+        return credentials
+
+    def service(self, key):
+        if key is None:
+            return build('drive', 'v3', cache_discovery=False)
+        if not hasattr(self.__local, 'services'):
+            self.__local.services = {}
+        credentials = self.credentials(key)
+        service, service_credentials = self.__local.services.get(key, (None, None))
+        if service is None or service_credentials is not credentials:
+            http = AuthorizedHttp(credentials, http=Http())
+            service = build('drive', 'v3', http=http, cache_discovery=False)
+            self.__local.services[key] = (service, credentials)
+        return service
+
+
+drive_pool = DriveServicePool()
+
 
 class GoogleDriveHelper:
 
     def __init__(self, name=None, path=None, listener=None):
-        self.__OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
         self.__G_DRIVE_DIR_MIME_TYPE = "application/vnd.google-apps.folder"
         self.__G_DRIVE_BASE_DOWNLOAD_URL = "https://drive.google.com/uc?id={}&export=download"
         self.__G_DRIVE_DIR_BASE_DOWNLOAD_URL = "https://drive.google.com/drive/folders/{}"
@@ -50,9 +108,10 @@ class GoogleDriveHelper:
         self.__sa_index = 0
         self.__sa_count = 1
         self.__sa_number = 100
-        self.__service = self.__authorize()
+        self.__service_key = self.__authorize()
         self.__file_processed_bytes = 0
         self.__processed_bytes = 0
+        self.__lock = Lock()
         self.name = name
 
     @property
@@ -66,45 +125,47 @@ class GoogleDriveHelper:
     def processed_bytes(self):
         return self.__processed_bytes
 
-    def __authorize(self):
-        credentials = None
+    @property
+    def __service(self):
+        return drive_pool.service(self.__service_key)
+
+    def __authorize(self, size=0):
         if config_dict['USE_SERVICE_ACCOUNTS']:
-            json_files = listdir("accounts")
+            json_files = sa_ledger.accounts()
             self.__sa_number = len(json_files)
-            self.__sa_index = randrange(self.__sa_number)
+            self.__sa_index = json_files.index(sa_ledger.pick(json_files, size))
             LOGGER.info(
                 f"Authorizing with {json_files[self.__sa_index]} service account")
-            credentials = service_account.Credentials.from_service_account_file(
-                f'accounts/{json_files[self.__sa_index]}',
-                scopes=self.__OAUTH_SCOPE)
+            drive_pool.check(f'accounts/{json_files[self.__sa_index]}')
+            return f'accounts/{json_files[self.__sa_index]}'
         elif ospath.exists('token.pickle'):
             LOGGER.info("Authorize with token.pickle")
-            with open('token.pickle', 'rb') as f:
-                credentials = pload(f)
-        else:
-            LOGGER.error('token.pickle not found!')
-        return build('drive', 'v3', credentials=credentials, cache_discovery=False)
+            drive_pool.check('token.pickle')
+            return 'token.pickle'
+        LOGGER.error('token.pickle not found!')
+        return None
 
     def __alt_authorize(self):
         if not self.__alt_auth:
             self.__alt_auth = True
             if ospath.exists('token.pickle'):
                 LOGGER.info("Authorize with token.pickle")
-                with open('token.pickle', 'rb') as f:
-                    credentials = pload(f)
-                return build('drive', 'v3', credentials=credentials, cache_discovery=False)
+                drive_pool.check('token.pickle')
+                return 'token.pickle'
             else:
                 LOGGER.error('token.pickle not found!')
         return None
 
     def __switchServiceAccount(self):
-        if self.__sa_index == self.__sa_number - 1:
-            self.__sa_index = 0
-        else:
-            self.__sa_index += 1
+        if self.__service_key and self.__service_key.startswith('accounts/'):
+            sa_ledger.rate_limited(ospath.basename(self.__service_key))
         self.__sa_count += 1
+        self.__service_key = self.__authorize()
         LOGGER.info(f"Switching to {self.__sa_index} index")
-        self.__service = self.__authorize()
+
+    def __record_usage(self, size):
+        if self.__service_key and self.__service_key.startswith('accounts/'):
+            sa_ledger.record(ospath.basename(self.__service_key), size)
 
     @staticmethod
     def __getIdFromUrl(link):
@@ -158,6 +219,8 @@ class GoogleDriveHelper:
             self.__file_processed_bytes = self.__status.total_size * self.__status.progress()
             self.__processed_bytes += chunk_size
             self.__total_time += self.__update_interval
+        elif self.__is_downloading:
+            self.__total_time += self.__update_interval
 
     def deletefile(self, link: str):
         try:
@@ -171,10 +234,10 @@ class GoogleDriveHelper:
             LOGGER.info(f"Delete Result: {msg}")
         except HttpError as err:
             if "File not found" in str(err) or "insufficientFilePermissions" in str(err):
-                token_service = self.__alt_authorize()
-                if token_service is not None:
+                token_key = self.__alt_authorize()
+                if token_key is not None:
                     LOGGER.error('File not found. Trying with token.pickle...')
-                    self.__service = token_service
+                    self.__service_key = token_key
                     return self.deletefile(link)
                 err = "File not found or insufficientFilePermissions!"
             LOGGER.error(f"Delete Result: {err}")
@@ -183,6 +246,8 @@ class GoogleDriveHelper:
 
     def upload(self, file_name, size):
         self.__is_uploading = True
+        if config_dict['USE_SERVICE_ACCOUNTS']:
+            self.__service_key = self.__authorize(size)
         item_path = f"{self.__path}/{file_name}"
         LOGGER.info(f"Uploading: {item_path}")
         self.__updater = setInterval(self.__update_interval, self.__progress)
@@ -306,11 +371,14 @@ class GoogleDriveHelper:
                                      resumable=True,
                                      chunksize=100 * 1024 * 1024)
 
+        md5 = get_md5_hash(file_path) if config_dict['CONTENT_DEDUP'] else None
         # Insert a file
         drive_file = self.__service.files().create(
             body=file_metadata, media_body=media_body, supportsAllDrives=True)
-        response = None
+        response = self.__copy_duplicate(md5, file_metadata, media_body.size()) if md5 else None
+        duplicate = response is not None
         retries = 0
+        uploaded = 0
         while response is None and not self.__is_cancelled:
             try:
                 self.__status, response = drive_file.next_chunk()
@@ -340,8 +408,15 @@ class GoogleDriveHelper:
                     else:
                         LOGGER.error(f"Got: {reason}")
                         raise err
+            sent = media_body.size() if response is not None else self.__status.resumable_progress
+            async_to_sync(bandwidth_governor.throttle, self.__user_id, 'up', sent - uploaded)
+            uploaded = sent
         if self.__is_cancelled:
             return
+        if not duplicate:
+            self.__record_usage(media_body.size())
+            if md5:
+                async_to_sync(store_content, md5, 'gdrive', response['id'])
         if not self.__listener.seed or self.__listener.newDir:
             try:
                 osremove(file_path)
@@ -358,6 +433,25 @@ class GoogleDriveHelper:
             return self.__G_DRIVE_BASE_DOWNLOAD_URL.format(drive_file.get('id'))
         return
 
+    def __copy_duplicate(self, md5, file_metadata, size):
+        if not (file_id := async_to_sync(lookup_content, md5).get('gdrive')):
+            return None
+        try:
+            response = self.__service.files().copy(fileId=file_id, body=file_metadata, supportsAllDrives=True,
+                                                   fields='id, md5Checksum').execute()
+        except HttpError as err:
+            LOGGER.info(f"Content dedup copy failed, uploading instead: {err}")
+            return None
+        if response.get('md5Checksum') != md5:
+            try:
+                self.__service.files().delete(fileId=response['id'], supportsAllDrives=True).execute()
+            except HttpError as err:
+                LOGGER.error(f"Failed to delete mismatched dedup copy {response['id']}: {err}")
+            return None
+        LOGGER.info(f"Content dedup hit, copied existing file: {file_metadata['name']}")
+        self.__processed_bytes += size
+        return response
+
     def clone(self, link):
         self.__is_cloning = True
         self.__start_time = time()
@@ -389,6 +483,7 @@ class GoogleDriveHelper:
                 if mime_type is None:
                     mime_type = 'File'
                 size = int(meta.get('size', 0))
+                self.__record_usage(size)
             return durl, size, mime_type, self.__total_files, self.__total_folders
         except Exception as err:
             if isinstance(err, RetryError):
@@ -399,10 +494,10 @@ class GoogleDriveHelper:
                 msg = "User rate limit exceeded."
             elif "File not found" in err:
                 if not self.__alt_auth:
-                    token_service = self.__alt_authorize()
-                    if token_service is not None:
+                    token_key = self.__alt_authorize()
+                    if token_key is not None:
                         LOGGER.error('File not found. Trying with token.pickle...')
-                        self.__service = token_service
+                        self.__service_key = token_key
                         return self.clone(link)
                 msg = "File not found."
             else:
@@ -425,6 +520,7 @@ class GoogleDriveHelper:
             elif not file.get('name').lower().endswith(tuple(GLOBAL_EXTENSION_FILTER)):
                 self.__total_files += 1
                 self.__copyFile(file.get('id'), dest_id, file.get('name'))
+                self.__record_usage(int(file.get('size', 0)))
                 self.__processed_bytes += int(file.get('size', 0))
                 self.__total_time = int(time() - self.__start_time)
             if self.__is_cancelled:
@@ -541,9 +637,9 @@ class GoogleDriveHelper:
         telegraph_content = []
         Title = False
         if len(DRIVES_IDS) > 1:
-            token_service = self.__alt_authorize()
-            if token_service is not None:
-                self.__service = token_service
+            token_key = self.__alt_authorize()
+            if token_key is not None:
+                self.__service_key = token_key
         for drive_name, dir_id, index_url in zip(DRIVES_NAMES, DRIVES_IDS, INDEX_URLS):
             isRecur = False if isRecursive and len(
                 dir_id) > 23 else isRecursive
@@ -623,11 +719,11 @@ class GoogleDriveHelper:
             err = str(err).replace('>', '').replace('<', '')
             if "File not found" in err:
                 if not self.__alt_auth:
-                    token_service = self.__alt_authorize()
-                    if token_service is not None:
+                    token_key = self.__alt_authorize()
+                    if token_key is not None:
                         LOGGER.error(
                             'File not found. Trying with token.pickle...')
-                        self.__service = token_service
+                        self.__service_key = token_key
                         return self.count(link)
                 msg = "File not found."
             else:
@@ -676,14 +772,16 @@ class GoogleDriveHelper:
         self.__is_downloading = True
         file_id = self.__getIdFromUrl(link)
         self.__updater = setInterval(self.__update_interval, self.__progress)
+        self.__is_errored = False
+        jobs = []
         try:
             meta = self.__getFileMetadata(file_id)
             if meta.get("mimeType") == self.__G_DRIVE_DIR_MIME_TYPE:
-                self.__download_folder(file_id, self.__path, self.name)
+                self.__download_folder(file_id, self.__path, self.name, jobs)
             else:
                 makedirs(self.__path, exist_ok=True)
-                self.__download_file(file_id, self.__path,
-                                     self.name, meta.get('mimeType'))
+                self.__add_download_job(file_id, self.__path, self.name, meta.get('size'), jobs)
+            self.__download_jobs(jobs)
         except Exception as err:
             if isinstance(err, RetryError):
                 LOGGER.info(
@@ -694,11 +792,11 @@ class GoogleDriveHelper:
                 err = "Download Quota Exceeded."
             elif "File not found" in err:
                 if not self.__alt_auth:
-                    token_service = self.__alt_authorize()
-                    if token_service is not None:
+                    token_key = self.__alt_authorize()
+                    if token_key is not None:
                         LOGGER.error(
                             'File not found. Trying with token.pickle...')
-                        self.__service = token_service
+                        self.__service_key = token_key
                         self.__updater.cancel()
                         return self.download(link)
                 err = 'File not found!'
@@ -710,7 +808,7 @@ class GoogleDriveHelper:
                 return
             async_to_sync(self.__listener.onDownloadComplete)
 
-    def __download_folder(self, folder_id, path, folder_name):
+    def __download_folder(self, folder_id, path, folder_name, jobs):
         folder_name = folder_name.replace('/', '')
         if not ospath.exists(f"{path}/{folder_name}"):
             makedirs(f"{path}/{folder_name}")
@@ -722,47 +820,101 @@ class GoogleDriveHelper:
         for item in result:
             file_id = item['id']
             filename = item['name']
+            size = item.get('size')
             shortcut_details = item.get('shortcutDetails')
             if shortcut_details is not None:
                 file_id = shortcut_details['targetId']
                 mime_type = shortcut_details['targetMimeType']
+                if mime_type != self.__G_DRIVE_DIR_MIME_TYPE:
+                    size = self.__getFileMetadata(file_id).get('size')
             else:
                 mime_type = item.get('mimeType')
             if mime_type == self.__G_DRIVE_DIR_MIME_TYPE:
-                self.__download_folder(file_id, path, filename)
+                self.__download_folder(file_id, path, filename, jobs)
             elif not ospath.isfile(f"{path}{filename}") and not filename.lower().endswith(tuple(GLOBAL_EXTENSION_FILTER)):
-                self.__download_file(file_id, path, filename, mime_type)
+                self.__add_download_job(file_id, path, filename, size, jobs)
             if self.__is_cancelled:
                 break
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(3),
-           retry=(retry_if_exception_type(Exception)))
-    def __download_file(self, file_id, path, filename, mime_type):
-        request = self.__service.files().get_media(
-            fileId=file_id, supportsAllDrives=True)
+    def __add_download_job(self, file_id, path, filename, size, jobs):
         filename = filename.replace('/', '')
         if len(filename.encode()) > 255:
             ext = ospath.splitext(filename)[1]
             filename = f"{filename[:245]}{ext}"
             if self.name.endswith(ext):
                 self.name = filename
-        if self.__is_cancelled:
+        # the fd is opened by the first range job and closed by the last one, see __download_job
+        file_ = {'path': f"{path}/{filename}", 'fd': None, 'jobs': 1}
+        fd = osopen(file_['path'], O_WRONLY | O_CREAT, 0o666)
+        try:
+            if size is not None:
+                size = int(size)
+                ftruncate(fd, size)
+                if size == 0:
+                    return
+                try:
+                    posix_fallocate(fd, 0, size)
+                except OSError:
+                    pass
+        finally:
+            osclose(fd)
+        if size is None:
+            jobs.append({'id': file_id, 'file': file_, 'offset': 0, 'end': None})
+            return
+        parts = DOWNLOAD_RANGE_PARTS if size >= DOWNLOAD_RANGE_MIN_SIZE else 1
+        part_size = -(-size // parts)
+        file_['jobs'] = -(-size // part_size)
+        for start in range(0, size, part_size):
+            jobs.append({'id': file_id, 'file': file_, 'offset': start, 'end': min(start + part_size, size)})
+
+    def __download_job(self, job):
+        file_ = job['file']
+        with self.__lock:
+            if file_['fd'] is None:
+                file_['fd'] = osopen(file_['path'], O_WRONLY | O_CREAT, 0o666)
+        try:
+            self.__download_range(job)
+        finally:
+            with self.__lock:
+                file_['jobs'] -= 1
+                if file_['jobs'] == 0:
+                    osclose(file_['fd'])
+                    file_['fd'] = None
+
+    def __download_jobs(self, jobs):
+        if not jobs:
             return
-        fh = FileIO(f"{path}/{filename}", 'wb')
-        downloader = MediaIoBaseDownload(
-            fh, request, chunksize=100 * 1024 * 1024)
-        done = False
+        with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(jobs))) as executor:
+            futures = [executor.submit(self.__download_job, job) for job in jobs]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    self.__is_errored = True
+                    raise future.exception()
+
+    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(3),
+           retry=(retry_if_exception_type(Exception)))
+    def __download_range(self, job):
         retries = 0
-        while not done:
-            if self.__is_cancelled:
-                fh.close()
-                break
+        while job['end'] is None or job['offset'] < job['end']:
+            if self.__is_cancelled or self.__is_errored:
+                return
+            service_key = self.__service_key
+            end = job['offset'] + DOWNLOAD_CHUNK_SIZE
+            if job['end'] is not None:
+                end = min(end, job['end'])
+            request = drive_pool.service(service_key).files().get_media(
+                fileId=job['id'], supportsAllDrives=True)
+            request.headers['range'] = f"bytes={job['offset']}-{end - 1}"
+            requested = end - job['offset']
             try:
-                self.__status, done = downloader.next_chunk()
+                content = request.execute()
             except HttpError as err:
                 if err.resp.status in [500, 502, 503, 504] and retries < 10:
                     retries += 1
                     continue
+                if job['end'] is None and err.resp.status == 416:
+                    return
                 if err.resp.get('content-type', '').startswith('application/json'):
                     reason = eval(err.content).get(
                         'error').get('errors')[0].get('reason')
@@ -772,20 +924,31 @@ class GoogleDriveHelper:
                     ]:
                         raise err
                     if config_dict['USE_SERVICE_ACCOUNTS']:
-                        if self.__sa_count >= self.__sa_number:
-                            LOGGER.info(
-                                f"Reached maximum number of service accounts switching, which is {self.__sa_count}")
+                        if not self.__switch_after_error(service_key):
                             raise err
-                        else:
-                            if self.__is_cancelled:
-                                return
-                            self.__switchServiceAccount()
-                            LOGGER.info(f"Got: {reason}, Trying Again...")
-                            return self.__download_file(file_id, path, filename, mime_type)
+                        LOGGER.info(f"Got: {reason}, Resuming from offset {job['offset']}...")
+                        continue
                     else:
                         LOGGER.error(f"Got: {reason}")
-                        raise err
-        self.__file_processed_bytes = 0
+                raise err
+            pwrite(job['file']['fd'], content, job['offset'])
+            job['offset'] += len(content)
+            with self.__lock:
+                self.__processed_bytes += len(content)
+            async_to_sync(bandwidth_governor.throttle, self.__user_id, 'dl', len(content))
+            if job['end'] is None and len(content) < requested:
+                return
+
+    def __switch_after_error(self, service_key):
+        with self.__lock:
+            if service_key != self.__service_key:
+                return True
+            if self.__sa_count >= self.__sa_number:
+                LOGGER.info(
+                    f"Reached maximum number of service accounts switching, which is {self.__sa_count}")
+                return False
+            self.__switchServiceAccount()
+            return True
 
     async def cancel_download(self):
         self.__is_cancelled = True
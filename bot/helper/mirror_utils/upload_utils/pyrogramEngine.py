@@ -4,9 +4,8 @@ from logging import getLogger, ERROR
 from aiofiles.os import remove as aioremove, path as aiopath, rename as aiorename, makedirs
 from os import walk, path as ospath
 from time import time
-from PIL import Image
 from pyrogram.types import InputMediaVideo, InputMediaDocument
-from pyrogram.errors import FloodWait, RPCError, PeerIdInvalid
+from pyrogram.errors import FloodWait, RPCError
 from asyncio import sleep
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type, RetryError
 from re import match as re_match, sub as re_sub
@@ -16,10 +15,15 @@ from aioshutil import copy
 from bot import config_dict, user_data, GLOBAL_EXTENSION_FILTER, bot, user, IS_PREMIUM_USER
 from bot.helper.themes import BotTheme
 from bot.helper.telegram_helper.button_build import ButtonMaker
-from bot.helper.telegram_helper.message_utils import sendBot
+from bot.helper.telegram_helper.message_utils import sendBot, chat_info
+from bot.helper.telegram_helper.send_scheduler import tg_scheduler, PRIORITY_HIGH
 from bot.helper.ext_utils.fs_utils import clean_unwanted, is_archive, get_base_name
 from bot.helper.ext_utils.bot_utils import get_readable_file_size, sync_to_async
-from bot.helper.ext_utils.leech_utils import get_media_info, get_document_type, take_ss, get_mediainfo_link, format_filename
+from bot.helper.ext_utils.bandwidth_manager import bandwidth_governor
+from bot.helper.ext_utils.db_handler import ensure_user_blobs
+from bot.helper.ext_utils.leech_utils import get_media_info, get_video_dimensions, get_document_type, take_ss, get_mediainfo_link, format_filename, \
+    FileSlice, THUMB_CACHE_DIR
+from bot.helper.ext_utils.dedup_manager import get_fingerprint, lookup_content, store_content
 
 LOGGER = getLogger(__name__)
 getLogger("pyrogram").setLevel(ERROR)
@@ -42,9 +46,11 @@ class TgUploader:
         self.__corrupted = 0
         self.__is_corrupted = False
         self.__media_dict = {'videos': {}, 'documents': {}}
+        self.__part_thumbs = {}
         self.__last_msg_in_group = False
         self.__prm_media = False
         self.__up_path = ''
+        self.__up_slice = None
         self.__ldump = ''
         self.__mediainfo = False
         self.__as_doc = False
@@ -54,7 +60,7 @@ class TgUploader:
 
     async def __buttons(self, up_path):
         buttons = ButtonMaker()
-        if self.__mediainfo:
+        if self.__mediainfo and self.__up_slice is None:
             buttons.ubutton(BotTheme('MEDIAINFO_LINK'), await get_mediainfo_link(up_path))
         if config_dict['SAVE_MSG'] and (config_dict['LEECH_LOG_ID'] or not self.__listener.isPrivate):
             buttons.ibutton(BotTheme('SAVE_MSG'), 'save', 'footer')
@@ -70,18 +76,8 @@ class TgUploader:
             if self.__ldump:
                 destination = 'Dump'
                 for channel_id in self.__ldump.split():
-                    if channel_id.startswith('-100'):
-                        channel_id = int(channel_id)
-                    elif channel_id.startswith('@'):
-                        channel_id = channel_id.replace('@', '')
-                    else:
-                        continue
-                    try:
-                        chat = await bot.get_chat(channel_id)
+                    if chat := await chat_info(channel_id):
                         await bot.copy_message(chat_id=chat.id, from_chat_id=self.__sent_msg.chat.id, message_id=self.__sent_msg.id)
-                    except PeerIdInvalid as e:
-                        LOGGER.error(f"{e.NAME}: {e.MESSAGE} for {channel_id}")
-                        continue
         except Exception as err:
             if not self.__is_cancelled:
                 LOGGER.error(f"Failed To Send in {destination}:\n{str(err)}")
@@ -94,6 +90,7 @@ class TgUploader:
         chunk_size = current - self.__last_uploaded
         self.__last_uploaded = current
         self.__processed_bytes += chunk_size
+        await bandwidth_governor.throttle(self.__user_id, 'up', chunk_size)
 
     async def __user_settings(self):
         user_dict = user_data.get(self.__user_id, {})
@@ -103,6 +100,7 @@ class TgUploader:
         self.__mediainfo = config_dict['SHOW_MEDIAINFO'] or user_dict.get('mediainfo')
         self.__ldump = user_dict.get('ldump', '') or ''
         self.__has_buttons = bool(config_dict['SAVE_MSG'] or self.__mediainfo)
+        await ensure_user_blobs(self.__listener.message.from_user.id)
         if not await aiopath.exists(self.__thumb):
             self.__thumb = None
 
@@ -135,7 +133,9 @@ class TgUploader:
     async def __prepare_file(self, prefile_, dirpath):
         cap_mono, file_ = await format_filename(prefile_, self.__user_id, dirpath)
         if prefile_ != file_:
-            if self.__listener.seed and not self.__listener.newDir and not dirpath.endswith("/splited_files_mltb"):
+            if self.__up_slice is not None:
+                self.__up_path = ospath.join(dirpath, file_)
+            elif self.__listener.seed and not self.__listener.newDir and not dirpath.endswith("/splited_files_mltb"):
                 dirpath = f'{dirpath}/copied_mltb'
                 await makedirs(dirpath, exist_ok=True)
                 new_path = ospath.join(dirpath, file_)
@@ -160,7 +160,9 @@ class TgUploader:
             extn = len(ext)
             remain = 64 - extn
             name = name[:remain]
-            if self.__listener.seed and not self.__listener.newDir and not dirpath.endswith("/splited_files_mltb"):
+            if self.__up_slice is not None:
+                self.__up_path = ospath.join(dirpath, f"{name}{ext}")
+            elif self.__listener.seed and not self.__listener.newDir and not dirpath.endswith("/splited_files_mltb"):
                 dirpath = f'{dirpath}/copied_mltb'
                 await makedirs(dirpath, exist_ok=True)
                 new_path = ospath.join(dirpath, f"{name}{ext}")
@@ -207,18 +209,8 @@ class TgUploader:
             if self.__ldump:
                 destination = 'Dump'
                 for channel_id in self.__ldump.split():
-                    if channel_id.startswith('-100'):
-                        channel_id = int(channel_id)
-                    elif channel_id.startswith('@'):
-                        channel_id = channel_id.replace('@', '')
-                    else:
-                        continue
-                    try:
-                        chat = await bot.get_chat(channel_id)
+                    if chat := await chat_info(channel_id):
                         await bot.copy_media_group(chat_id=chat.id, from_chat_id=self.__sent_msg.chat.id, message_id=self.__sent_msg.id)
-                    except PeerIdInvalid as e:
-                        LOGGER.error(f"{e.NAME}: {e.MESSAGE} for {channel_id}")
-                        continue
         except Exception as err:
             if not self.__is_cancelled:
                 LOGGER.error(f"Failed To Send in {destination}:\n{str(err)}")
@@ -236,49 +228,59 @@ class TgUploader:
                 if file_.lower().endswith(tuple(GLOBAL_EXTENSION_FILTER)):
                     await aioremove(self.__up_path)
                     continue
-                try:
-                    f_size = await aiopath.getsize(self.__up_path)
-                    if self.__listener.seed and file_ in o_files and f_size in m_size:
-                        continue
-                    self.__total_files += 1
-                    if f_size == 0:
-                        LOGGER.error(f"{self.__up_path} size is zero, telegram don't upload zero size files")
-                        self.__corrupted += 1
+                source = self.__up_path
+                for part in self.__listener.virtual_parts.get(source, [None]):
+                    if part is not None:
+                        file_, offset, length = part
+                        self.__up_path = ospath.join(dirpath, file_)
+                        self.__up_slice = (source, offset, length)
+                    try:
+                        f_size = self.__up_slice[2] if self.__up_slice else await aiopath.getsize(self.__up_path)
+                        if self.__listener.seed and file_ in o_files and f_size in m_size:
+                            continue
+                        self.__total_files += 1
+                        if f_size == 0:
+                            LOGGER.error(f"{self.__up_path} size is zero, telegram don't upload zero size files")
+                            self.__corrupted += 1
+                            continue
+                        if self.__is_cancelled:
+                            return
+                        self.__prm_media = True if f_size > 2097152000 else False
+                        cap_mono, file_ = await self.__prepare_file(file_, dirpath)
+                        if self.__last_msg_in_group:
+                            group_lists = [x for v in self.__media_dict.values()
+                                           for x in v.keys()]
+                            if (match := re_match(r'.+(?=\.0*\d+$)|.+(?=\.part\d+\..+)', self.__up_path)) and match.group(0) not in group_lists:
+                                for key, value in list(self.__media_dict.items()):
+                                    for subkey, msgs in list(value.items()):
+                                        if len(msgs) > 1:
+                                            await self.__send_media_group(subkey, key, msgs)
+                        self.__last_msg_in_group = False
+                        self.__last_uploaded = 0
+                        await self.__switching_client()
+                        await self.__upload_file(cap_mono, file_)
+                        if self.__is_cancelled:
+                            return
+                        if not self.__is_corrupted and (self.__listener.isSuperGroup or config_dict['LEECH_LOG_ID']):
+                            self.__msgs_dict[self.__sent_msg.link] = file_
+                        await sleep(1)
+                    except Exception as err:
+                        if isinstance(err, RetryError):
+                            LOGGER.info(f"Total Attempts: {err.last_attempt.attempt_number}")
+                        else:
+                            LOGGER.error(f"{format_exc()}. Path: {self.__up_path}")
+                        if self.__is_cancelled:
+                            return
                         continue
-                    if self.__is_cancelled:
-                        return
-                    self.__prm_media = True if f_size > 2097152000 else False
-                    cap_mono, file_ = await self.__prepare_file(file_, dirpath)
-                    if self.__last_msg_in_group:
-                        group_lists = [x for v in self.__media_dict.values()
-                                       for x in v.keys()]
-                        if (match := re_match(r'.+(?=\.0*\d+$)|.+(?=\.part\d+\..+)', self.__up_path)) and match.group(0) not in group_lists:
-                            for key, value in list(self.__media_dict.items()):
-                                for subkey, msgs in list(value.items()):
-                                    if len(msgs) > 1:
-                                        await self.__send_media_group(subkey, key, msgs)
-                    self.__last_msg_in_group = False
-                    self.__last_uploaded = 0
-                    await self.__switching_client()
-                    await self.__upload_file(cap_mono, file_)
-                    if self.__is_cancelled:
-                        return
-                    if not self.__is_corrupted and (self.__listener.isSuperGroup or config_dict['LEECH_LOG_ID']):
-                        self.__msgs_dict[self.__sent_msg.link] = file_
-                    await sleep(1)
-                except Exception as err:
-                    if isinstance(err, RetryError):
-                        LOGGER.info(f"Total Attempts: {err.last_attempt.attempt_number}")
-                    else:
-                        LOGGER.error(f"{format_exc()}. Path: {self.__up_path}")
-                    if self.__is_cancelled:
-                        return
-                    continue
-                finally:
-                    if not self.__is_cancelled and await aiopath.exists(self.__up_path) and \
-                        (not self.__listener.seed or self.__listener.newDir or
-                         dirpath.endswith("/splited_files_mltb") or '/copied_mltb/' in self.__up_path):
-                        await aioremove(self.__up_path)
+                    finally:
+                        if not self.__is_cancelled and await aiopath.exists(self.__up_path) and \
+                            (not self.__listener.seed or self.__listener.newDir or
+                             dirpath.endswith("/splited_files_mltb") or '/copied_mltb/' in self.__up_path):
+                            await aioremove(self.__up_path)
+                self.__up_slice = None
+                if source in self.__listener.virtual_parts and not self.__is_cancelled and \
+                        (not self.__listener.seed or self.__listener.newDir):
+                    await aioremove(source)
         for key, value in list(self.__media_dict.items()):
             for subkey, msgs in list(value.items()):
                 if len(msgs) > 1:
@@ -296,6 +298,44 @@ class TgUploader:
         LOGGER.info(f"Leech Completed: {self.name}")
         await self.__listener.onUploadComplete(None, size, self.__msgs_dict, self.__total_files, self.__corrupted, self.name)
 
+    async def __video_thumb(self, fingerprint, duration=None):
+        if match := re_match(r'.+(?=\.0*\d+$)|.+(?=\.part\d+\..+)', self.__up_path):
+            pname = match.group(0)
+            if (thumb := self.__part_thumbs.get(pname)) is not None and await aiopath.exists(thumb):
+                return thumb
+            thumb = self.__part_thumbs[pname] = await take_ss(self.__up_path, duration, fingerprint)
+            return thumb
+        return await take_ss(self.__up_path, duration, fingerprint)
+
+    async def __thumb_stamp(self):
+        return await aiopath.getmtime(self.__thumb) if self.__thumb is not None else None
+
+    async def __send_duplicate(self, cap_mono, fingerprint, as_doc):
+        client_key = f"tg{self.__sent_msg._client.me.id}"
+        cached = (await lookup_content(fingerprint)).get(client_key)
+        if not cached or cached['document'] != as_doc or cached.get('thumb') != await self.__thumb_stamp():
+            return False
+        try:
+            self.__sent_msg = await self.__sent_msg.reply_cached_media(cached['file_id'],
+                                                                       quote=True,
+                                                                       caption=cap_mono,
+                                                                       disable_notification=True,
+                                                                       reply_markup=await self.__buttons(self.__up_path))
+        except RPCError as e:
+            LOGGER.info(f"Content dedup resend failed, uploading instead: {e}")
+            return False
+        LOGGER.info(f"Content dedup hit, resent existing file: {self.__up_path}")
+        self.__processed_bytes += await aiopath.getsize(self.__up_path)
+        return True
+
+    async def __store_duplicate(self, fingerprint):
+        media = self.__sent_msg.document or self.__sent_msg.video or self.__sent_msg.audio or self.__sent_msg.photo
+        if media is None:
+            return
+        await store_content(fingerprint, f"tg{self.__sent_msg._client.me.id}",
+                            {'file_id': media.file_id, 'document': self.__sent_msg.document is not None,
+                             'thumb': await self.__thumb_stamp()})
+
     @retry(wait=wait_exponential(multiplier=2, min=4, max=8), stop=stop_after_attempt(3),
            retry=retry_if_exception_type(Exception))
     async def __upload_file(self, cap_mono, file, force_document=False):
@@ -304,7 +344,10 @@ class TgUploader:
         thumb = self.__thumb
         self.__is_corrupted = False
         try:
-            is_video, is_audio, is_image = await get_document_type(self.__up_path)
+            if self.__up_slice is not None:
+                is_video, is_audio, is_image = False, False, False
+            else:
+                is_video, is_audio, is_image = await get_document_type(self.__up_path)
 
             if not is_image and thumb is None:
                 file_name = ospath.splitext(file)[0]
@@ -312,20 +355,32 @@ class TgUploader:
                 if await aiopath.isfile(thumb_path):
                     thumb = thumb_path
 
-            if self.__as_doc or force_document or (not is_video and not is_audio and not is_image):
+            as_doc = self.__as_doc or force_document or (not is_video and not is_audio and not is_image)
+            fingerprint = await get_fingerprint(self.__up_path) if self.__up_slice is None else None
+            dedup = fingerprint is not None and config_dict['CONTENT_DEDUP']
+            await tg_scheduler.acquire(self.__sent_msg.chat.id, PRIORITY_HIGH)
+            duplicate = dedup and await self.__send_duplicate(cap_mono, fingerprint, as_doc)
+            if duplicate:
+                key = 'documents' if self.__sent_msg.document else 'videos' if self.__sent_msg.video else 'others'
+            elif as_doc:
                 key = 'documents'
                 if is_video and thumb is None:
-                    thumb = await take_ss(self.__up_path, None)
+                    thumb = await self.__video_thumb(fingerprint)
                 if self.__is_cancelled:
                     return
-                nrml_media = await self.__sent_msg.reply_document(document=self.__up_path,
-                                                                       quote=True,
-                                                                       thumb=thumb,
-                                                                       caption=cap_mono,
-                                                                       force_document=True,
-                                                                       disable_notification=True,
-                                                                       progress=self.__upload_progress,
-                                                                       reply_markup=await self.__buttons(self.__up_path))
+                document = FileSlice(*self.__up_slice, ospath.basename(self.__up_path)) if self.__up_slice else self.__up_path
+                try:
+                    nrml_media = await self.__sent_msg.reply_document(document=document,
+                                                                      quote=True,
+                                                                      thumb=thumb,
+                                                                      caption=cap_mono,
+                                                                      force_document=True,
+                                                                      disable_notification=True,
+                                                                      progress=self.__upload_progress,
+                                                                      reply_markup=await self.__buttons(self.__up_path))
+                finally:
+                    if self.__up_slice:
+                        document.close()
                 
                 if self.__prm_media and (self.__has_buttons or not self.__listener.leechlogmsg):
                     self.__sent_msg = await bot.copy_message(nrml_media.chat.id, nrml_media.chat.id, nrml_media.id, reply_to_message_id=self.__sent_msg.id, reply_markup=await self.__buttons(self.__up_path))
@@ -336,13 +391,8 @@ class TgUploader:
                 key = 'videos'
                 duration = (await get_media_info(self.__up_path))[0]
                 if thumb is None:
-                    thumb = await take_ss(self.__up_path, duration)
-                if thumb is not None:
-                    with Image.open(thumb) as img:
-                        width, height = img.size
-                else:
-                    width = 480
-                    height = 320
+                    thumb = await self.__video_thumb(fingerprint, duration)
+                width, height = await get_video_dimensions(self.__up_path)
                 if not self.__up_path.upper().endswith(("MKV", "MP4")):
                     dirpath, file_ = self.__up_path.rsplit('/', 1)
                     if self.__listener.seed and not self.__listener.newDir and not dirpath.endswith("/splited_files_mltb"):
@@ -412,15 +462,20 @@ class TgUploader:
                         await self.__send_media_group(pname, key, msgs)
                     else:
                         self.__last_msg_in_group = True
+            if dedup and not duplicate and not self.__is_cancelled:
+                await self.__store_duplicate(fingerprint)
             await self.__copy_file()
 
-            if self.__thumb is None and thumb is not None and await aiopath.exists(thumb):
+            if self.__thumb is None and thumb is not None and not thumb.startswith(THUMB_CACHE_DIR) \
+                    and await aiopath.exists(thumb):
                 await aioremove(thumb)
         except FloodWait as f:
             LOGGER.warning(str(f))
+            tg_scheduler.pause(self.__sent_msg.chat.id, f.value)
             await sleep(f.value)
         except Exception as err:
-            if self.__thumb is None and thumb is not None and await aiopath.exists(thumb):
+            if self.__thumb is None and thumb is not None and not thumb.startswith(THUMB_CACHE_DIR) \
+                    and await aiopath.exists(thumb):
                 await aioremove(thumb)
             LOGGER.error(f"{format_exc()}. Path: {self.__up_path}")
             if 'Telegram says: [400' in str(err) and key != 'documents':
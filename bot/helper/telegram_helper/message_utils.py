@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 from traceback import format_exc
-from asyncio import sleep
+from asyncio import sleep, gather
 from aiofiles.os import remove as aioremove
 from random import choice as rchoice
 from time import time
 from re import match as re_match
+from functools import partial
+from collections import OrderedDict
 
 from pyrogram.types import InputMediaPhoto
-from pyrogram.errors import ReplyMarkupInvalid, FloodWait, PeerIdInvalid, RPCError, UserNotParticipant, MessageNotModified, MessageEmpty, PhotoInvalidDimensions, WebpageCurlFailed, MediaEmpty
+from pyrogram.errors import ReplyMarkupInvalid, PeerIdInvalid, RPCError, UserNotParticipant, MessageNotModified, MessageEmpty, PhotoInvalidDimensions, WebpageCurlFailed, MediaEmpty
 
 from bot import config_dict, LOGGER, bot_name, status_reply_dict, status_reply_dict_lock, Interval, bot, user, download_dict_lock
-from bot.helper.ext_utils.bot_utils import get_readable_message, setInterval, sync_to_async, download_image_url
+from bot.helper.ext_utils.bot_utils import get_readable_message, get_status_view, setInterval, sync_to_async, download_image_url
 from bot.helper.telegram_helper.button_build import ButtonMaker
+from bot.helper.telegram_helper.send_scheduler import tg_scheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from bot.helper.ext_utils.exceptions import TgLinkException
 
+CHAT_PEERS_SIZE = 256
+
+chat_peers = OrderedDict()
+
 
 async def sendMessage(message, text, buttons=None, photo=None):
     try:
@@ -21,8 +28,8 @@ async def sendMessage(message, text, buttons=None, photo=None):
             try:
                 if photo == 'IMAGES':
                     photo = rchoice(config_dict['IMAGES'])
-                return await message.reply_photo(photo=photo, reply_to_message_id=message.id,
-                                                 caption=text, reply_markup=buttons, disable_notification=True)
+                return await tg_scheduler.submit(message.chat.id, partial(message.reply_photo, photo=photo, reply_to_message_id=message.id,
+                                                 caption=text, reply_markup=buttons, disable_notification=True), PRIORITY_HIGH)
             except IndexError:
                 pass
             except (PhotoInvalidDimensions, WebpageCurlFailed, MediaEmpty):
@@ -32,12 +39,8 @@ async def sendMessage(message, text, buttons=None, photo=None):
                 return
             except Exception as e:
                 LOGGER.error(format_exc())
-        return await message.reply(text=text, quote=True, disable_web_page_preview=True,
-                                   disable_notification=True, reply_markup=buttons)
-    except FloodWait as f:
-        LOGGER.warning(str(f))
-        await sleep(f.value * 1.2)
-        return await sendMessage(message, text, buttons, photo)
+        return await tg_scheduler.submit(message.chat.id, partial(message.reply, text=text, quote=True, disable_web_page_preview=True,
+                                   disable_notification=True, reply_markup=buttons), PRIORITY_HIGH)
     except ReplyMarkupInvalid:
         return await sendMessage(message, text, None, photo)
     except Exception as e:
@@ -52,8 +55,8 @@ async def sendBot(message, text, buttons=None, photo=None):
             try:
                 if photo == 'IMAGES':
                     photo = rchoice(config_dict['IMAGES'])
-                return await message._client.send_photo(chat_id=user_id, photo=photo, caption=text,
-                                                        reply_markup=buttons, disable_notification=True)
+                return await tg_scheduler.submit(user_id, partial(message._client.send_photo, chat_id=user_id, photo=photo, caption=text,
+                                                        reply_markup=buttons, disable_notification=True), PRIORITY_HIGH)
             except IndexError:
                 pass
             except (PhotoInvalidDimensions, WebpageCurlFailed, MediaEmpty):
@@ -63,12 +66,8 @@ async def sendBot(message, text, buttons=None, photo=None):
                 return
             except Exception as e:
                 LOGGER.error(format_exc())
-        return await message._client.send_message(chat_id=user_id, text=text, disable_web_page_preview=True,
-                                                  disable_notification=True, reply_markup=buttons)
-    except FloodWait as f:
-        LOGGER.warning(str(f))
-        await sleep(f.value * 1.2)
-        return await sendBot(message, text, buttons, photo)
+        return await tg_scheduler.submit(user_id, partial(message._client.send_message, chat_id=user_id, text=text, disable_web_page_preview=True,
+                                                  disable_notification=True, reply_markup=buttons), PRIORITY_HIGH)
     except ReplyMarkupInvalid:
         return await sendBot(message, text, None, photo)
     except Exception as e:
@@ -77,18 +76,25 @@ async def sendBot(message, text, buttons=None, photo=None):
 
 
 async def chat_info(channel_id):
+    channel_id = str(channel_id)
+    if channel_id in chat_peers:
+        chat_peers.move_to_end(channel_id)
+        return chat_peers[channel_id]
     if channel_id.startswith('-100'):
-        channel_id = int(channel_id)
+        peer_id = int(channel_id)
     elif channel_id.startswith('@'):
-        channel_id = channel_id.replace('@', '')
+        peer_id = channel_id.replace('@', '')
     else:
         return None
     try:
-        chat = await bot.get_chat(channel_id)
-        return chat
+        chat = await bot.get_chat(peer_id)
     except PeerIdInvalid as e:
-        LOGGER.error(f"{e.NAME}: {e.MESSAGE} for {channel_id}")
+        LOGGER.error(f"{e.NAME}: {e.MESSAGE} for {peer_id}")
         return None
+    chat_peers[channel_id] = chat
+    if len(chat_peers) > CHAT_PEERS_SIZE:
+        chat_peers.popitem(last=False)
+    return chat
 
 
 async def sendMirrorLog(message, text, ids, buttons=None, photo=None):
@@ -99,8 +105,8 @@ async def sendMirrorLog(message, text, ids, buttons=None, photo=None):
                 try:
                     if photo == 'IMAGES':
                         photo = rchoice(config_dict['IMAGES'])
-                    return await message._client.send_photo(chat_id=chat.id, photo=photo, caption=text,
-                                                     reply_markup=buttons, disable_notification=True)
+                    return await tg_scheduler.submit(chat.id, partial(message._client.send_photo, chat_id=chat.id, photo=photo, caption=text,
+                                                     reply_markup=buttons, disable_notification=True), PRIORITY_HIGH)
                 except IndexError:
                     pass
                 except (PhotoInvalidDimensions, WebpageCurlFailed, MediaEmpty):
@@ -110,28 +116,23 @@ async def sendMirrorLog(message, text, ids, buttons=None, photo=None):
                     return
                 except Exception as e:
                     LOGGER.error(str(e))
-            return await message._client.send_message(chat_id=chat.id, text=text, disable_web_page_preview=True,
-                                               disable_notification=True, reply_markup=buttons)
-        except FloodWait as f:
-            LOGGER.warning(str(f))
-            await sleep(f.value * 1.2)
-            return await sendMirrorLog(message, text, ids, buttons, photo)
+            return await tg_scheduler.submit(chat.id, partial(message._client.send_message, chat_id=chat.id, text=text, disable_web_page_preview=True,
+                                               disable_notification=True, reply_markup=buttons), PRIORITY_HIGH)
         except Exception as e:
             LOGGER.error(str(e))
             return str(e)
 
 
-async def editMessage(message, text, buttons=None, photo=None):
+async def editMessage(message, text, buttons=None, photo=None, priority=PRIORITY_NORMAL):
     try:
         if message.media:
             if photo:
-                return await message.edit_media(InputMediaPhoto(photo, text), reply_markup=buttons)
-            return await message.edit_caption(caption=text, reply_markup=buttons)
-        await message.edit(text=text, disable_web_page_preview=True, reply_markup=buttons)
-    except FloodWait as f:
-        LOGGER.warning(str(f))
-        await sleep(f.value * 1.2)
-        return await editMessage(message, text, buttons, photo)
+                return await tg_scheduler.submit(message.chat.id, partial(message.edit_media, InputMediaPhoto(photo, text),
+                                                                          reply_markup=buttons), priority, message.id)
+            return await tg_scheduler.submit(message.chat.id, partial(message.edit_caption, caption=text,
+                                                                      reply_markup=buttons), priority, message.id)
+        await tg_scheduler.submit(message.chat.id, partial(message.edit, text=text, disable_web_page_preview=True,
+                                                           reply_markup=buttons), priority, message.id)
     except (MessageNotModified, MessageEmpty):
         pass
     except Exception as e:
@@ -141,11 +142,8 @@ async def editMessage(message, text, buttons=None, photo=None):
 
 async def sendFile(message, file, caption=None):
     try:
-        return await message.reply_document(document=file, quote=True, caption=caption, disable_notification=True)
-    except FloodWait as f:
-        LOGGER.warning(str(f))
-        await sleep(f.value * 1.2)
-        return await sendFile(message, file, caption)
+        return await tg_scheduler.submit(message.chat.id, partial(message.reply_document, document=file, quote=True,
+                                                                  caption=caption, disable_notification=True), PRIORITY_HIGH)
     except Exception as e:
         LOGGER.error(str(e))
         return str(e)
@@ -153,16 +151,9 @@ async def sendFile(message, file, caption=None):
 
 async def sendRss(text):
     try:
-        if user:
-            return await user.send_message(chat_id=config_dict['RSS_CHAT_ID'], text=text, disable_web_page_preview=True,
-                                           disable_notification=True)
-        else:
-            return await bot.send_message(chat_id=config_dict['RSS_CHAT_ID'], text=text, disable_web_page_preview=True,
-                                          disable_notification=True)
-    except FloodWait as f:
-        LOGGER.warning(str(f))
-        await sleep(f.value * 1.2)
-        return await sendRss(text)
+        client = user or bot
+        return await tg_scheduler.submit(config_dict['RSS_CHAT_ID'], partial(client.send_message, chat_id=config_dict['RSS_CHAT_ID'], text=text,
+                                                                             disable_web_page_preview=True, disable_notification=True))
     except Exception as e:
         LOGGER.error(str(e))
         return str(e)
@@ -250,26 +241,45 @@ async def update_all_messages(force=False):
     async with status_reply_dict_lock:
         if not status_reply_dict or not Interval or (not force and time() - list(status_reply_dict.values())[0][1] < 3):
             return
-        for chat_id in list(status_reply_dict.keys()):
+        chat_ids = list(status_reply_dict.keys())
+        for chat_id in chat_ids:
             status_reply_dict[chat_id][1] = time()
+    views = {}
+    messages = {}
     async with download_dict_lock:
-        msg, buttons = await sync_to_async(get_readable_message)
-    if msg is None:
-        return
+        for chat_id in chat_ids:
+            view = get_status_view(chat_id)
+            key = (view['page'], view['user_id'], view['status'])
+            if key not in views:
+                views[key] = await sync_to_async(get_readable_message, chat_id)
+            messages[chat_id] = views[key]
+    edits = []
     async with status_reply_dict_lock:
         for chat_id in list(status_reply_dict.keys()):
+            if chat_id not in messages:
+                continue
+            msg, buttons = messages[chat_id]
+            if msg is None:
+                continue
             if status_reply_dict[chat_id] and msg != status_reply_dict[chat_id][0].text:
-                rmsg = await editMessage(status_reply_dict[chat_id][0], msg, buttons)
-                if isinstance(rmsg, str) and rmsg.startswith('Telegram says: [400'):
-                    del status_reply_dict[chat_id]
-                    continue
-                status_reply_dict[chat_id][0].text = msg
-                status_reply_dict[chat_id][1] = time()
+                edits.append((chat_id, status_reply_dict[chat_id][0], msg, buttons))
+    # low priority edits can wait behind uploads for a while, don't hold the lock meanwhile
+    results = await gather(*[editMessage(message, msg, buttons, priority=PRIORITY_LOW)
+                             for _, message, msg, buttons in edits])
+    async with status_reply_dict_lock:
+        for (chat_id, message, msg, _), rmsg in zip(edits, results):
+            if not status_reply_dict.get(chat_id) or status_reply_dict[chat_id][0] is not message:
+                continue
+            if isinstance(rmsg, str) and rmsg.startswith('Telegram says: [400'):
+                del status_reply_dict[chat_id]
+                continue
+            message.text = msg
+            status_reply_dict[chat_id][1] = time()
 
 
 async def sendStatusMessage(msg):
     async with download_dict_lock:
-        progress, buttons = await sync_to_async(get_readable_message)
+        progress, buttons = await sync_to_async(get_readable_message, msg.chat.id)
     if progress is None:
         return
     async with status_reply_dict_lock:
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+from asyncio import sleep
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+from pyrogram.errors import FloodWait
+
+from bot import LOGGER, bot_loop
+from bot.helper.ext_utils.bot_utils import TokenBucket
+
+PRIORITY_HIGH = 0  # new messages, task completion and uploads
+PRIORITY_NORMAL = 1  # interactive edits
+PRIORITY_LOW = 2  # status page refreshes
+
+GLOBAL_RATE = 25
+PRIVATE_RATE, PRIVATE_BURST = 1, 3
+GROUP_RATE, GROUP_BURST = 20 / 60, 5
+
+
+class ChatQueue:
+    def __init__(self, chat_id):
+        if isinstance(chat_id, int) and chat_id > 0:
+            self.bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+        else:
+            self.bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+        self.heap = []
+        self.pending = {}
+        self.resume_at = 0
+        self.running = False
+
+
+class SendScheduler:
+    def __init__(self):
+        self.__global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.__queues = {}
+        self.__seq = count()
+
+    def __queue(self, chat_id):
+        if (queue := self.__queues.get(chat_id)) is None:
+            queue = self.__queues[chat_id] = ChatQueue(chat_id)
+        return queue
+
+    async def submit(self, chat_id, func, priority=PRIORITY_NORMAL, key=None):
+        queue = self.__queue(chat_id)
+        if key is not None and (entry := queue.pending.get(key)) is not None:
+            # superseded edit, the newest content takes the queued slot
+            entry[3] = func
+            entry[0] = min(entry[0], priority)
+            queue.heap.sort()
+            return await entry[4]
+        entry = [priority, next(self.__seq), key, func, bot_loop.create_future()]
+        heappush(queue.heap, entry)
+        if key is not None:
+            queue.pending[key] = entry
+        if not queue.running:
+            queue.running = True
+            bot_loop.create_task(self.__drain(queue))
+        return await entry[4]
+
+    async def acquire(self, chat_id, priority=PRIORITY_NORMAL):
+        await self.submit(chat_id, None, priority)
+
+    def pause(self, chat_id, seconds):
+        queue = self.__queue(chat_id)
+        queue.resume_at = max(queue.resume_at, time() + seconds)
+
+    async def __drain(self, queue):
+        try:
+            while queue.heap:
+                _, _, key, func, future = heappop(queue.heap)
+                if key is not None:
+                    queue.pending.pop(key, None)
+                while True:
+                    if (wait := queue.resume_at - time()) > 0:
+                        await sleep(wait)
+                    await queue.bucket.acquire()
+                    await self.__global.acquire()
+                    try:
+                        result = await func() if func is not None else None
+                    except FloodWait as f:
+                        LOGGER.warning(str(f))
+                        queue.resume_at = time() + f.value * 1.2
+                        continue
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    break
+        finally:
+            queue.running = False
+
+
+tg_scheduler = SendScheduler()
@@ -1,21 +1,50 @@
 #!/usr/bin/env python3
 from random import choice as rchoice
+from string import Formatter
 from bot import config_dict, LOGGER
 from bot.helper.themes import wzml_minimal
 
 AVL_THEMES = {'minimal': wzml_minimal}
 
-def BotTheme(var_name, **format_vars):
+
+class CompiledTheme:
+    def __init__(self, name, theme):
+        self.name = name
+        self.__formatters = {}
+        style = theme.WZMLStyle
+        for var_name in dir(style):
+            if var_name.startswith('__') or not isinstance(text := getattr(style, var_name), str):
+                continue
+            try:
+                static = all(field is None for _, field, _, _ in Formatter().parse(text))
+            except ValueError:
+                static = False
+            if static:
+                # no placeholders, render once and keep the result
+                self.__formatters[var_name] = lambda _, text=text.format_map({}): text
+            else:
+                self.__formatters[var_name] = text.format_map
+
+    def __call__(self, var_name, **format_vars):
+        return self.__formatters[var_name](format_vars)
+
+    def render(self, *fields):
+        # fields ==> var_name or (var_name, {format_vars}), rendered and joined in one go
+        return ''.join(self.__formatters[field]({}) if isinstance(field, str) else self.__formatters[field[0]](field[1])
+                       for field in fields)
+
+
+compiled_themes = {name: CompiledTheme(name, theme) for name, theme in AVL_THEMES.items()}
+LOGGER.info(f"Compiled Themes: {', '.join(compiled_themes)}")
+
+
+def get_theme():
+    # resolve once per message, so a random theme stays the same for all of its fragments
     theme_ = config_dict['BOT_THEME']
+    if theme_ == 'random':
+        return rchoice(list(compiled_themes.values()))
+    return compiled_themes.get(theme_, compiled_themes['minimal'])
 
-    if theme_ in AVL_THEMES:
-        text = getattr(AVL_THEMES[theme_].WZMLStyle(), var_name)
-    elif theme_ == 'random':
-        rantheme = rchoice(list(AVL_THEMES.values()))
-        LOGGER.info(f"Random Theme Chosen: {rantheme}")
-        text = getattr(rantheme.WZMLStyle(), var_name)
-    else:
-        text = getattr(wzml_minimal.WZMLStyle(), var_name)
-
-    formatted_text = text.format_map(format_vars)
-    return formatted_text
+
+def BotTheme(var_name, **format_vars):
+    return get_theme()(var_name, **format_vars)
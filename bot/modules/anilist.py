@@ -7,14 +7,10 @@ from calendar import month_name
 from pycountry import countries as conn
 from urllib.parse import quote as q
 
-from bot import bot, LOGGER, config_dict, user_data
-from bot.helper.telegram_helper.filters import CustomFilters
-from bot.helper.telegram_helper.bot_commands import BotCommands
+from bot import LOGGER, config_dict, user_data
 from bot.helper.telegram_helper.message_utils import sendMessage, editMessage
 from bot.helper.telegram_helper.button_build import ButtonMaker
 from bot.helper.ext_utils.bot_utils import get_readable_time
-from pyrogram.handlers import MessageHandler, CallbackQueryHandler
-from pyrogram.filters import command, regex
 
 
 GENRES_EMOJI = {"Action": "👊", "Adventure": choice(['🪂', '🧗‍♀']), "Comedy": "🤣", "Drama": " 🎭", "Ecchi": choice(['💋', '🥵']), "Fantasy": choice(['🧞', '🧞‍♂', '🧞‍♀','🌗']), "Hentai": "🔞", "Horror": "☠", "Mahou Shoujo": "☯", "Mecha": "🤖", "Music": "🎸", "Mystery": "🔮", "Psychological": "♟", "Romance": "💞", "Sci-Fi": "🛸", "Slice of Life": choice(['☘','🍁']), "Sports": "⚽️", "Supernatural": "🫧", "Thriller": choice(['🥶', '🔪','🤯'])}
@@ -430,10 +426,3 @@ async def anime_help(_, message):
 • /character : <i>[search AniList Character]</i>
 • /manga : <i>[search manga]</i>'''
     await sendMessage(message, help_string)
-
-bot.add_handler(MessageHandler(anilist, filters=command(BotCommands.AniListCommand) & CustomFilters.authorized))
-bot.add_handler(MessageHandler(character, filters=command("character") & CustomFilters.authorized))
-bot.add_handler(MessageHandler(manga, filters=command("manga") & CustomFilters.authorized))
-bot.add_handler(MessageHandler(anime_help, filters=command(BotCommands.AnimeHelpCommand) & CustomFilters.authorized))
-bot.add_handler(CallbackQueryHandler(setAnimeButtons, filters=regex(r'^anime')))
-bot.add_handler(CallbackQueryHandler(setCharacButtons, filters=regex(r'^cha')))
@@ -22,6 +22,7 @@ from bot.helper.telegram_helper.button_build import ButtonMaker
 from bot.helper.ext_utils.bot_utils import setInterval, sync_to_async, new_thread
 from bot.helper.ext_utils.db_handler import DbManger
 from bot.helper.ext_utils.task_manager import start_from_queued
+from bot.helper.ext_utils.bandwidth_manager import bandwidth_governor
 from bot.helper.ext_utils.help_messages import default_desp
 from bot.helper.mirror_utils.rclone_utils.serve import rclone_serve_booter
 from bot.modules.torrent_search import initiate_search_tools
@@ -46,7 +47,7 @@ default_values = {'AUTO_DELETE_MESSAGE_DURATION': 30,
                   'TITLE_NAME': 'WZ Mirror/Leech X',
                   'GD_INFO': 'Uploaded by WZML-X',
                   }
-bool_vars = ['AS_DOCUMENT', 'BOT_PM', 'STOP_DUPLICATE', 'SET_COMMANDS', 'SAVE_MSG', 'SHOW_MEDIAINFO', 'SOURCE_LINK',
+bool_vars = ['AS_DOCUMENT', 'BOT_PM', 'STOP_DUPLICATE', 'CONTENT_DEDUP', 'SET_COMMANDS', 'SAVE_MSG', 'SHOW_MEDIAINFO', 'SOURCE_LINK',
              'IS_TEAM_DRIVE', 'USE_SERVICE_ACCOUNTS', 'WEB_PINCODE', 'EQUAL_SPLITS', 'DISABLE_DRIVE_LINK', 'DELETE_LINKS']
 
 
@@ -126,6 +127,18 @@ async def load_config():
         MEGA_EMAIL = ''
         MEGA_PASSWORD = ''
 
+    MEGA_TRANSFER_SLOTS = environ.get('MEGA_TRANSFER_SLOTS', '')
+    MEGA_TRANSFER_SLOTS = '' if len(MEGA_TRANSFER_SLOTS) == 0 else int(MEGA_TRANSFER_SLOTS)
+
+    DOWNLOAD_BANDWIDTH_LIMIT = environ.get('DOWNLOAD_BANDWIDTH_LIMIT', '')
+    DOWNLOAD_BANDWIDTH_LIMIT = '' if len(DOWNLOAD_BANDWIDTH_LIMIT) == 0 else float(DOWNLOAD_BANDWIDTH_LIMIT)
+
+    UPLOAD_BANDWIDTH_LIMIT = environ.get('UPLOAD_BANDWIDTH_LIMIT', '')
+    UPLOAD_BANDWIDTH_LIMIT = '' if len(UPLOAD_BANDWIDTH_LIMIT) == 0 else float(UPLOAD_BANDWIDTH_LIMIT)
+
+    USER_BANDWIDTH_SHARE = environ.get('USER_BANDWIDTH_SHARE', '')
+    USER_BANDWIDTH_SHARE = '' if len(USER_BANDWIDTH_SHARE) == 0 else int(USER_BANDWIDTH_SHARE)
+
     UPTOBOX_TOKEN = environ.get('UPTOBOX_TOKEN', '')
     if len(UPTOBOX_TOKEN) == 0:
         UPTOBOX_TOKEN = ''
@@ -266,6 +279,9 @@ async def load_config():
     STOP_DUPLICATE = environ.get('STOP_DUPLICATE', '')
     STOP_DUPLICATE = STOP_DUPLICATE.lower() == 'true'
 
+    CONTENT_DEDUP = environ.get('CONTENT_DEDUP', '')
+    CONTENT_DEDUP = CONTENT_DEDUP.lower() == 'true'
+
     IS_TEAM_DRIVE = environ.get('IS_TEAM_DRIVE', '')
     IS_TEAM_DRIVE = IS_TEAM_DRIVE.lower() == 'true'
 
@@ -581,6 +597,10 @@ async def load_config():
                         'MEDIA_GROUP': MEDIA_GROUP,
                         'MEGA_EMAIL': MEGA_EMAIL,
                         'MEGA_PASSWORD': MEGA_PASSWORD,
+                        'MEGA_TRANSFER_SLOTS': MEGA_TRANSFER_SLOTS,
+                        'DOWNLOAD_BANDWIDTH_LIMIT': DOWNLOAD_BANDWIDTH_LIMIT,
+                        'UPLOAD_BANDWIDTH_LIMIT': UPLOAD_BANDWIDTH_LIMIT,
+                        'USER_BANDWIDTH_SHARE': USER_BANDWIDTH_SHARE,
                         'MDL_TEMPLATE': MDL_TEMPLATE,
                         'OWNER_ID': OWNER_ID,
                         'QUEUE_ALL': QUEUE_ALL,
@@ -604,6 +624,7 @@ async def load_config():
                         'STATUS_LIMIT': STATUS_LIMIT,
                         'STATUS_UPDATE_INTERVAL': STATUS_UPDATE_INTERVAL,
                         'STOP_DUPLICATE': STOP_DUPLICATE,
+                        'CONTENT_DEDUP': CONTENT_DEDUP,
                         'SUDO_USERS': SUDO_USERS,
                         'TELEGRAM_API': TELEGRAM_API,
                         'TELEGRAM_HASH': TELEGRAM_HASH,
@@ -755,6 +776,8 @@ async def edit_variable(_, message, pre_message, key):
         aria2_options['bt-stop-timeout'] = f'{value}'
     elif key == 'LEECH_SPLIT_SIZE':
         value = min(int(value), MAX_SPLIT_SIZE)
+    elif key in ['DOWNLOAD_BANDWIDTH_LIMIT', 'UPLOAD_BANDWIDTH_LIMIT']:
+        value = float(value)
     elif key == 'CAP_FONT':
         value = value.strip().lower()
         if value not in ['b', 'i', 'u', 's', 'spoiler', 'code']:
@@ -795,6 +818,8 @@ async def edit_variable(_, message, pre_message, key):
         await start_from_queued()
     elif key in ['RCLONE_SERVE_URL', 'RCLONE_SERVE_PORT', 'RCLONE_SERVE_USER', 'RCLONE_SERVE_PASS']:
         await rclone_serve_booter()
+    elif key in ['DOWNLOAD_BANDWIDTH_LIMIT', 'UPLOAD_BANDWIDTH_LIMIT', 'USER_BANDWIDTH_SHARE']:
+        await bandwidth_governor.update()
 
 
 async def edit_aria(_, message, pre_message, key):
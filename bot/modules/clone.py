@@ -3,9 +3,11 @@ from pyrogram.handlers import MessageHandler
 from pyrogram.filters import command
 from random import SystemRandom
 from string import ascii_letters, digits
-from asyncio import sleep, gather
+from asyncio import gather
+from functools import partial
 from aiofiles.os import path as aiopath
 from json import loads
+from aiohttp import ClientError
 
 from bot import LOGGER, download_dict, download_dict_lock, config_dict, bot
 from bot.helper.ext_utils.task_manager import limit_checker, task_utils
@@ -15,13 +17,15 @@ from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.mirror_utils.status_utils.gdrive_status import GdriveStatus
 from bot.helper.ext_utils.bot_utils import is_gdrive_link, new_task, sync_to_async, is_share_link, new_task, is_rclone_path, cmd_exec, get_telegraph_list, arg_parser
-from bot.helper.ext_utils.exceptions import DirectDownloadLinkException
+from bot.helper.ext_utils.exceptions import DirectDownloadLinkException, RcloneRcException
 from bot.helper.mirror_utils.download_utils.direct_link_generator import direct_link_generator
 from bot.helper.mirror_utils.rclone_utils.list import RcloneList
 from bot.helper.mirror_utils.rclone_utils.transfer import RcloneTransferHelper
+from bot.helper.mirror_utils.rclone_utils.daemon import get_rclone_daemon
 from bot.helper.ext_utils.help_messages import CLONE_HELP_MESSAGE
 from bot.helper.mirror_utils.status_utils.rclone_status import RcloneStatus
 from bot.helper.listeners.tasks_listener import MirrorLeechListener
+from bot.helper.ext_utils.batch_manager import run_multi
 from bot.helper.themes import BotTheme
 
 
@@ -63,15 +67,16 @@ async def rcloneNode(client, message, link, dst_path, rcf, tag):
     remote, src_path = link.split(':', 1)
     src_path = src_path .strip('/')
 
-    cmd = ['rclone', 'lsjson', '--fast-list', '--stat',
-           '--no-modtime', '--config', config_path, f'{remote}:{src_path}']
-    res = await cmd_exec(cmd)
-    if res[2] != 0:
-        if res[2] != -9:
-            msg = f'Error: While getting RClone Stats. Path: {remote}:{src_path}. Stderr: {res[1][:4000]}'
-            await sendMessage(message, msg)
+    try:
+        daemon = await get_rclone_daemon(config_path)
+        rstat = (await daemon.call('operations/stat', fs=f'{remote}:', remote=src_path, opt={'noModTime': True}))['item']
+    except (RcloneRcException, ClientError) as err:
+        msg = f'Error: While getting RClone Stats. Path: {remote}:{src_path}. Error: {str(err)[:4000]}'
+        await sendMessage(message, msg)
+        return
+    if rstat is None:
+        await sendMessage(message, f'Error: Path not found. Path: {remote}:{src_path}')
         return
-    rstat = loads(res[0])
     if rstat['IsDir']:
         name = src_path.rsplit('/', 1)[-1] if src_path else remote
         dst_path += name if dst_path.endswith(':') else f'/{name}'
@@ -94,25 +99,38 @@ async def rcloneNode(client, message, link, dst_path, rcf, tag):
     if not link:
         return
     LOGGER.info(f'Cloning Done: {name}')
-    cmd1 = ['rclone', 'lsf', '--fast-list', '-R',
-            '--files-only', '--config', config_path, destination]
-    cmd2 = ['rclone', 'lsf', '--fast-list', '-R',
-            '--dirs-only', '--config', config_path, destination]
-    cmd3 = ['rclone', 'size', '--fast-list', '--json',
-            '--config', config_path, destination]
-    res1, res2, res3 = await gather(cmd_exec(cmd1), cmd_exec(cmd2), cmd_exec(cmd3))
-    if res1[2] != res2[2] != res3[2] != 0:
-        if res1[2] == -9:
-            return
-        files = None
-        folders = None
-        size = 0
-        LOGGER.error(f'Error: While getting RClone Stats. Path: {destination}. Stderr: {res1[1][:4000]}')
+    if mime_type != 'Folder':
+        files, folders, size = 1, 0, rstat['Size']
+    elif RCTransfer.stats:
+        files, size = RCTransfer.copied
+        try:
+            dst_remote, dst_rc_path = destination.split(':', 1)
+            folders = len((await daemon.call('operations/list', fs=f'{dst_remote}:', remote=dst_rc_path,
+                                             opt={'recurse': True, 'dirsOnly': True, 'noModTime': True,
+                                                  'noMimeType': True}))['list'])
+        except (RcloneRcException, ClientError) as err:
+            LOGGER.error(f'Error: While getting RClone Stats. Path: {destination}. Error: {err}')
+            folders = None
     else:
-        files = len(res1[0].split("\n"))
-        folders = len(res2[0].split("\n"))
-        rsize = loads(res3[0])
-        size = rsize['bytes']
+        cmd1 = ['rclone', 'lsf', '--fast-list', '-R',
+                '--files-only', '--config', config_path, destination]
+        cmd2 = ['rclone', 'lsf', '--fast-list', '-R',
+                '--dirs-only', '--config', config_path, destination]
+        cmd3 = ['rclone', 'size', '--fast-list', '--json',
+                '--config', config_path, destination]
+        res1, res2, res3 = await gather(cmd_exec(cmd1), cmd_exec(cmd2), cmd_exec(cmd3))
+        if res1[2] != res2[2] != res3[2] != 0:
+            if res1[2] == -9:
+                return
+            files = None
+            folders = None
+            size = 0
+            LOGGER.error(f'Error: While getting RClone Stats. Path: {destination}. Stderr: {res1[1][:4000]}')
+        else:
+            files = len(res1[0].split("\n"))
+            folders = len(res2[0].split("\n"))
+            rsize = loads(res3[0])
+            size = rsize['bytes']
     await listener.onUploadComplete(link, size, files, folders, mime_type, name, destination)
 
 
@@ -196,21 +214,7 @@ async def clone(client, message):
     if not link and (reply_to := message.reply_to_message):
         link = reply_to.text.split('\n', 1)[0].strip()
 
-    @new_task
-    async def __run_multi():
-        if multi > 1:
-            await sleep(5)
-            msg = [s.strip() for s in input_list]
-            index = msg.index('-i')
-            msg[index+1] = f"{multi - 1}"
-            nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=message.reply_to_message_id + 1)
-            nextmsg = await sendMessage(nextmsg, " ".join(msg))
-            nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=nextmsg.id)
-            nextmsg.from_user = message.from_user
-            await sleep(5)
-            clone(client, nextmsg)
-
-    __run_multi()
+    run_multi(client, message, input_list, multi, partial(clone, client))
 
     if len(link) == 0:
         reply_message = await sendMessage(message, CLONE_HELP_MESSAGE)
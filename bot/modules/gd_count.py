@@ -8,7 +8,7 @@ from bot.helper.telegram_helper.message_utils import deleteMessage, sendMessage
 from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.ext_utils.bot_utils import is_gdrive_link, sync_to_async, new_task, get_readable_file_size
-from bot.helper.themes import BotTheme
+from bot.helper.themes import BotTheme, get_theme
 
 
 @new_task
@@ -31,13 +31,13 @@ async def countNode(_, message):
             await sendMessage(message, name)
             return
         await deleteMessage(msg)
-        msg = BotTheme('COUNT_NAME', COUNT_NAME=name)
-        msg += BotTheme('COUNT_SIZE', COUNT_SIZE=get_readable_file_size(size))
-        msg += BotTheme('COUNT_TYPE', COUNT_TYPE=mime_type)
+        theme = get_theme()
+        msg = theme.render(('COUNT_NAME', {'COUNT_NAME': name}),
+                           ('COUNT_SIZE', {'COUNT_SIZE': get_readable_file_size(size)}),
+                           ('COUNT_TYPE', {'COUNT_TYPE': mime_type}))
         if mime_type == 'Folder':
-            msg += BotTheme('COUNT_SUB', COUNT_SUB=folders)
-            msg += BotTheme('COUNT_FILE', COUNT_FILE=files)
-        msg += BotTheme('COUNT_CC', COUNT_CC=tag)
+            msg += theme.render(('COUNT_SUB', {'COUNT_SUB': folders}), ('COUNT_FILE', {'COUNT_FILE': files}))
+        msg += theme('COUNT_CC', COUNT_CC=tag)
     else:
         msg = 'Send Gdrive link along with command or by replying to the link by command'
     await sendMessage(message, msg, photo='IMAGES')
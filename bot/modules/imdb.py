@@ -3,14 +3,10 @@ from re import findall, IGNORECASE
 from imdb import Cinemagoer
 from pycountry import countries as conn
 
-from pyrogram.handlers import MessageHandler, CallbackQueryHandler
-from pyrogram.filters import command, regex
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from pyrogram.errors import MediaEmpty, PhotoInvalidDimensions, WebpageMediaEmpty
 
 from bot import bot, LOGGER, user_data, config_dict
-from bot.helper.telegram_helper.filters import CustomFilters
-from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.message_utils import sendMessage, editMessage
 from bot.helper.ext_utils.bot_utils import get_readable_time
 from bot.helper.telegram_helper.button_build import ButtonMaker
@@ -241,7 +237,3 @@ async def imdb_callback(_, query):
         await query.answer()
         await query.message.delete()
         await query.message.reply_to_message.delete()
-
-
-bot.add_handler(MessageHandler(imdb_search, filters=command(BotCommands.IMDBCommand) & CustomFilters.authorized))
-bot.add_handler(CallbackQueryHandler(imdb_callback, filters=regex(r'^imdb')))
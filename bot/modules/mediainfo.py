@@ -6,11 +6,8 @@ from aiofiles import open as aiopen
 from aiofiles.os import remove as aioremove, path as aiopath, mkdir
 from os import path as ospath, getcwd
 
-from pyrogram.handlers import MessageHandler 
-from pyrogram.filters import command
 
 from bot import LOGGER, bot, config_dict
-from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.message_utils import editMessage, sendMessage
 from bot.helper.ext_utils.bot_utils import cmd_exec
@@ -73,5 +70,3 @@ async def mediainfo(_, message):
         return await gen_mediainfo(message, None, file, rply)
     else:
         return await sendMessage(message, help_msg)
-
-bot.add_handler(MessageHandler(mediainfo, filters=command(BotCommands.MediaInfoCommand) & CustomFilters.authorized))
@@ -3,7 +3,7 @@ from pyrogram.handlers import MessageHandler
 from pyrogram.filters import command
 from base64 import b64encode
 from re import match as re_match
-from asyncio import sleep
+from functools import partial
 from aiofiles.os import path as aiopath
 
 from bot import bot, DOWNLOAD_DIR, LOGGER, config_dict
@@ -24,10 +24,11 @@ from bot.helper.telegram_helper.message_utils import sendMessage, editMessage, g
 from bot.helper.listeners.tasks_listener import MirrorLeechListener
 from bot.helper.ext_utils.help_messages import MIRROR_HELP_MESSAGE
 from bot.helper.ext_utils.bulk_links import extract_bulk_links
+from bot.helper.ext_utils.batch_manager import run_bulk, run_multi
 
 
 @new_task
-async def _mirror_leech(client, message, isQbit=False, isLeech=False, sameDir=None, bulk=[]):
+async def _mirror_leech(client, message, isQbit=False, isLeech=False, sameDir=None):
     text = message.text.split('\n')
     input_list = text[0].split(' ')
 
@@ -91,40 +92,10 @@ async def _mirror_leech(client, message, isQbit=False, isLeech=False, sameDir=No
         except:
             await sendMessage(message, 'Reply to text file or tg message that have links seperated by new line!')
             return
-        b_msg = input_list[:1]
-        b_msg.append(f'{bulk[0]} -i {len(bulk)}')
-        nextmsg = await sendMessage(message, " ".join(b_msg))
-        nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=nextmsg.id)
-        nextmsg.from_user = message.from_user
-        _mirror_leech(client, nextmsg, isQbit, isLeech, sameDir, bulk)
+        run_bulk(client, message, input_list[0], bulk, partial(_mirror_leech, client, isQbit=isQbit, isLeech=isLeech))
         return
 
-    if len(bulk) != 0:
-        del bulk[0]
-
-    @new_task
-    async def __run_multi():
-        if multi <= 1:
-            return
-        await sleep(5)
-        if len(bulk) != 0:
-            msg = input_list[:1]
-            msg.append(f'{bulk[0]} -i {multi - 1}')
-            nextmsg = await sendMessage(message, " ".join(msg))
-        else:
-            msg = [s.strip() for s in input_list]
-            index = msg.index('-i')
-            msg[index+1] = f"{multi - 1}"
-            nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=message.reply_to_message_id + 1)
-            nextmsg = await sendMessage(nextmsg, " ".join(msg))
-        nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=nextmsg.id)
-        if folder_name:
-            sameDir['tasks'].add(nextmsg.id)
-        nextmsg.from_user = message.from_user
-        await sleep(5)
-        _mirror_leech(client, nextmsg, isQbit, isLeech, sameDir, bulk)
-
-    __run_multi()
+    run_multi(client, message, input_list, multi, partial(_mirror_leech, client, isQbit=isQbit, isLeech=isLeech, sameDir=sameDir), sameDir if folder_name else None)
 
     path = f'{DOWNLOAD_DIR}{message.id}{folder_name}'
 
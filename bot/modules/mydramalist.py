@@ -4,12 +4,9 @@ from requests import get as rget
 from urllib.parse import quote as q
 from pycountry import countries as conn
 
-from pyrogram.filters import command, regex
-from pyrogram.handlers import MessageHandler, CallbackQueryHandler 
 from pyrogram.errors import MediaEmpty, PhotoInvalidDimensions, WebpageMediaEmpty, ReplyMarkupInvalid
 
-from bot import LOGGER, bot, config_dict, user_data
-from bot.helper.telegram_helper.filters import CustomFilters
+from bot import LOGGER, config_dict, user_data
 from bot.helper.telegram_helper.message_utils import sendMessage, editMessage
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.button_build import ButtonMaker
@@ -151,6 +148,3 @@ async def mdl_callback(_, query):
         await query.answer()
         await message.delete()
         await message.reply_to_message.delete()
-
-bot.add_handler(MessageHandler(mydramalist_search, filters=command(BotCommands.MyDramaListCommand) & CustomFilters.authorized))
-bot.add_handler(CallbackQueryHandler(mdl_callback, filters=regex(r'^mdl')))
@@ -4,18 +4,28 @@ from pyrogram.filters import command, regex
 from psutil import cpu_percent, virtual_memory, disk_usage
 from time import time
 
-from bot import status_reply_dict_lock, download_dict, download_dict_lock, botStartTime, DOWNLOAD_DIR, Interval, config_dict, bot
+from bot import status_reply_dict_lock, download_dict_lock, botStartTime, DOWNLOAD_DIR, Interval, config_dict, bot
 from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage, auto_delete_message, sendStatusMessage, update_all_messages
-from bot.helper.ext_utils.bot_utils import get_readable_file_size, get_readable_time, turn_page, setInterval, new_task
+from bot.helper.ext_utils.bot_utils import get_readable_file_size, get_readable_time, turn_page, setInterval, new_task, \
+    get_status_view, get_status_tasks, STATUS_FILTERS
 from bot.helper.themes import BotTheme
 
 
 @new_task
 async def mirror_status(_, message):
+    view = get_status_view(message.chat.id)
+    view['page'], view['user_id'], view['status'] = 0, None, None
+    for arg in message.text.split()[1:]:
+        if arg == 'me':
+            view['user_id'] = message.from_user.id
+        elif arg.isdigit():
+            view['user_id'] = int(arg)
+        elif arg in STATUS_FILTERS:
+            view['status'] = arg
     async with download_dict_lock:
-        count = len(download_dict)
+        count = len(get_status_tasks(view))
     if count == 0:
         currentTime = get_readable_time(time() - botStartTime)
         free = get_readable_file_size(disk_usage(DOWNLOAD_DIR).free)
@@ -41,7 +51,8 @@ async def status_pages(_, query):
     if data[1] == "ref":
         await update_all_messages(True)
     else:
-        await turn_page(data)
+        await turn_page(data, query.message.chat.id)
+        await update_all_messages(True)
 
 
 bot.add_handler(MessageHandler(mirror_status, filters=command(
@@ -303,6 +303,9 @@ async def set_thumb(client, message, pre_event, key, direct=False):
         await mkdir(path)
     photo_dir = await message.download()
     des_dir = ospath.join(path, f'{user_id}.jpg')
+    # the old thumbnail may be linked to a shared blob, never write through it
+    if await aiopath.exists(des_dir):
+        await aioremove(des_dir)
     await sync_to_async(Image.open(photo_dir).convert("RGB").save, des_dir, "JPEG")
     await aioremove(photo_dir)
     update_user_ldata(user_id, 'thumb', des_dir)
@@ -319,6 +322,8 @@ async def add_rclone(client, message, pre_event):
     if not await aiopath.isdir(path):
         await mkdir(path)
     des_dir = ospath.join(path, f'{user_id}.conf')
+    if await aiopath.exists(des_dir):
+        await aioremove(des_dir)
     await message.download(file_name=des_dir)
     update_user_ldata(user_id, 'rclone', f'rclone/{user_id}.conf')
     await message.delete()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 from pyrogram.filters import command, regex, user
-from asyncio import sleep, wait_for, Event, wrap_future
+from asyncio import wait_for, Event, wrap_future
 from aiohttp import ClientSession
 from aiofiles.os import path as aiopath
 from yt_dlp import YoutubeDL
@@ -20,6 +20,7 @@ from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.listeners.tasks_listener import MirrorLeechListener
 from bot.helper.ext_utils.help_messages import YT_HELP_MESSAGE
 from bot.helper.ext_utils.bulk_links import extract_bulk_links
+from bot.helper.ext_utils.batch_manager import run_bulk, run_multi
 
 
 @new_task
@@ -239,10 +240,9 @@ async def _mdisk(link, name):
 
 
 @new_task
-async def _ytdl(client, message, isLeech=False, sameDir=None, bulk=[]):
+async def _ytdl(client, message, isLeech=False, sameDir=None, qual=''):
     text = message.text.split('\n')
     input_list = text[0].split(' ')
-    qual = ''
     arg_base = {'link': '', '-i': 0, '-m': '', '-s': False, '-opt': '',
             '-b': False, '-n': '', '-z': False, '-up': '', '-rcf': ''}
 
@@ -288,38 +288,10 @@ async def _ytdl(client, message, isLeech=False, sameDir=None, bulk=[]):
         except:
             await sendMessage(message, 'Reply to text file or tg message that have links seperated by new line!')
             return
-        b_msg = input_list[:1]
-        b_msg.append(f'{bulk[0]} -i {len(bulk)}')
-        nextmsg = await sendMessage(message, " ".join(b_msg))
-        nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=nextmsg.id)
-        nextmsg.from_user = message.from_user
-        _ytdl(client, nextmsg, isLeech, sameDir, bulk)
+        run_bulk(client, message, input_list[0], bulk, partial(_ytdl, client, isLeech=isLeech))
         return
 
-    if len(bulk) != 0:
-        del bulk[0]
-
-    @new_task
-    async def __run_multi():
-        if multi <= 1:
-            return
-        await sleep(5)
-        if len(bulk) != 0:
-            msg = input_list[:1]
-            msg.append(f'{bulk[0]} -i {multi - 1}')
-            nextmsg = await sendMessage(message, " ".join(msg))
-        else:
-            msg = [s.strip() for s in input_list]
-            index = msg.index('-i')
-            msg[index+1] = f"{multi - 1}"
-            nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=message.reply_to_message_id + 1)
-            nextmsg = await sendMessage(nextmsg, " ".join(msg))
-        nextmsg = await client.get_messages(chat_id=message.chat.id, message_ids=nextmsg.id)
-        if folder_name:
-            sameDir['tasks'].add(nextmsg.id)
-        nextmsg.from_user = message.from_user
-        await sleep(5)
-        _ytdl(client, nextmsg, isLeech, sameDir, bulk)
+    run_multi(client, message, input_list, multi, partial(_ytdl, client, isLeech=isLeech, sameDir=sameDir), sameDir if folder_name else None)
 
     path = f'{DOWNLOAD_DIR}{message.id}{folder_name}'
 
@@ -431,13 +403,10 @@ async def _ytdl(client, message, isLeech=False, sameDir=None, bulk=[]):
     except Exception as e:
         msg = str(e).replace('<', ' ').replace('>', ' ')
         await sendMessage(message, f'{tag} {msg}')
-        __run_multi()
         await delete_links(message)
         return
 
-    __run_multi()
-
-    if not select:
+    if not select and not qual:
         user_id = message.from_user.id
         user_dict = user_data.get(user_id, {})
         if 'format' in options:
@@ -457,12 +426,12 @@ async def _ytdl(client, message, isLeech=False, sameDir=None, bulk=[]):
     
 
 
-async def ytdl(client, message):
-    _ytdl(client, message)
+async def ytdl(client, message, qual=''):
+    _ytdl(client, message, qual=qual)
 
 
-async def ytdlleech(client, message):
-    _ytdl(client, message, isLeech=True)
+async def ytdlleech(client, message, qual=''):
+    _ytdl(client, message, isLeech=True, qual=qual)
 
 
 bot.add_handler(MessageHandler(ytdl, filters=command(